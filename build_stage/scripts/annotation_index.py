@@ -0,0 +1,195 @@
+#
+# An index of the annotations (genes and features) of a project.
+#
+# The browser looks annotations up by name (e.g. for bookmarks) and by region
+# (the genes in a selection). Rather than scanning the .gff and .csv files
+# each time, they're parsed once, when the project is built, into a SQLite
+# database with a single table:
+#
+#   features(name, chromosome, start, end, bin, type, source)
+#
+# Positions are in base-pairs, as in the files they come from (for .gff
+# files, 1-based with the end included). 'source' is the annotation the
+# feature came from ('genes' or 'features'), and features from .csv files have
+# no chromosome.
+#
+# Names are indexed, so a name is looked up in logarithmic time. Regions are
+# found with the binning scheme used by genome browsers: each feature is put in
+# the smallest of a hierarchy of fixed-size bins that contains it, so the
+# features overlapping a region can only be in a few ranges of bins, which
+# are also indexed.
+#
+
+import csv
+import os
+import sqlite3
+from pathlib import Path
+from typing import Iterator, Optional
+from urllib.parse import unquote
+
+# Version of the database's layout (stored as its user_version)
+INDEX_VERSION = 1
+
+# The smallest bins hold 2^17 (128k) base-pairs, and the bins at each level
+# after that are 2^3 times larger, so the largest (a single bin, at level
+# BIN_LEVELS - 1) holds 2^32 base-pairs. Bins are numbered from the largest
+# level down, so the bins at each level are numbered from the offset below.
+BIN_FIRST_SHIFT = 17
+BIN_NEXT_SHIFT = 3
+BIN_LEVELS = 6
+BIN_OFFSETS = [ sum( 8**k for k in range(BIN_LEVELS - 1 - level) ) for level in range(BIN_LEVELS) ]
+
+def region_bin(start: int, end: int) -> int:
+    '''
+    Get the bin for a feature from start to end (both included): the
+    smallest bin which contains it
+    '''
+    (start_bin, end_bin) = ( start >> BIN_FIRST_SHIFT, end >> BIN_FIRST_SHIFT )
+    for offset in BIN_OFFSETS:
+        if start_bin == end_bin:
+            return offset + start_bin
+        (start_bin, end_bin) = ( start_bin >> BIN_NEXT_SHIFT, end_bin >> BIN_NEXT_SHIFT )
+    raise ValueError(f"Feature from {start} to {end} is too large to index")
+
+def overlapping_bins(start: int, end: int) -> list[tuple[int, int]]:
+    '''
+    Get the ranges of bins (first and last) which may have features
+    overlapping the region from start to end (both included), one for each
+    level
+    '''
+    (start_bin, end_bin) = ( max(0, start) >> BIN_FIRST_SHIFT, max(0, end) >> BIN_FIRST_SHIFT )
+    ranges = []
+    for offset in BIN_OFFSETS:
+        ranges.append( (offset + start_bin, offset + end_bin) )
+        (start_bin, end_bin) = ( start_bin >> BIN_NEXT_SHIFT, end_bin >> BIN_NEXT_SHIFT )
+    return ranges
+
+def read_gff(path: Path) -> Iterator[tuple[str, str, int, int, str]]:
+    '''
+    Read the features in a .gff file, as tuples of name, chromosome, start,
+    end and type. A feature's name is its 'Name' attribute, or its 'ID' if
+    it has none (features with neither are left out).
+    '''
+    with open(path, 'r') as f:
+        for line in f:
+            if line.startswith('##FASTA'):
+                # the rest of the file is sequences
+                break
+            if line.startswith('#') or not line.strip():
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 9:
+                raise ValueError(f"Not a valid GFF line in {path}: {line.strip()}")
+            attributes = {}
+            for attribute in fields[8].split(';'):
+                (key, _, value) = attribute.strip().partition('=')
+                attributes[key] = unquote(value)
+            name = attributes.get('Name') or attributes.get('ID')
+            if name:
+                yield ( name, fields[0], int(fields[3]), int(fields[4]), fields[2] )
+
+def read_features_csv(path: Path) -> Iterator[tuple[str, str, int, int, str]]:
+    '''
+    Read the features in a features .csv file (with 'name', 'start', 'end',
+    'id' and 'type' columns), as tuples of name, chromosome (always None),
+    start, end and type
+    '''
+    with open(path, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            yield ( row['name'], None, int(float(row['start'])), int(float(row['end'])), row.get('type') )
+
+def build_index(path: Path, sources: list[tuple[str, Path]]):
+    '''
+    Build the index of the annotations in the given files, as a list of
+    tuples of the name of the annotation ('genes' for a .gff file, or
+    'features' for a .csv file) and the path to the file. The index is
+    written to a temporary file first, and only replaces the one at path
+    once it's complete.
+    '''
+    path = Path(path)
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.unlink(missing_ok=True)
+
+    db = sqlite3.connect(tmp)
+    try:
+        # (the database isn't in use until it's complete, so it can be
+        # written without a journal)
+        db.execute("PRAGMA journal_mode = OFF")
+        db.execute("PRAGMA synchronous = OFF")
+        db.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+        db.execute("""
+            CREATE TABLE features (
+                name TEXT NOT NULL, chromosome TEXT, start INTEGER NOT NULL, end INTEGER NOT NULL,
+                bin INTEGER NOT NULL, type TEXT, source TEXT NOT NULL
+            )
+        """)
+        for (source, file) in sources:
+            features = read_gff(file) if source == 'genes' else read_features_csv(file)
+            db.executemany("INSERT INTO features VALUES (?, ?, ?, ?, ?, ?, ?)", (
+                ( name, chromosome, start, end, region_bin(start, end), type, source )
+                for (name, chromosome, start, end, type) in features
+            ))
+        # (indices are faster to create once all the rows are in)
+        db.execute("CREATE INDEX features_name ON features (name)")
+        db.execute("CREATE INDEX features_bin ON features (bin, start)")
+        db.commit()
+    finally:
+        db.close()
+    os.replace(tmp, path)
+
+class AnnotationIndex:
+    '''
+    An index of annotations built with build_index, given its path (opened
+    read-only). Features are returned as dicts with the columns of the table
+    (see the top of this file) other than 'bin'.
+    '''
+
+    COLUMNS = ('name', 'chromosome', 'start', 'end', 'type', 'source')
+
+    def __init__(self, path: Path):
+        self.db = sqlite3.connect(f"file:{Path(path).resolve()}?mode=ro", uri=True)
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version != INDEX_VERSION:
+            self.db.close()
+            raise ValueError(f"Annotation index {path} has version {version} (expected {INDEX_VERSION})")
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _features(self, query: str, args: tuple) -> list[dict]:
+        columns = ", ".join(self.COLUMNS)
+        rows = self.db.execute(f"SELECT {columns} FROM features WHERE {query} ORDER BY start, end, name", args)
+        return [ dict(zip(self.COLUMNS, row)) for row in rows ]
+
+    def lookup(self, name: str) -> list[dict]:
+        '''
+        Get the features with the given name
+        '''
+        return self._features("name = ?", (name,))
+
+    def names(self, names: list[str]) -> set[str]:
+        '''
+        Get which of the given names are the names of features
+        '''
+        return { name for name in names if self.db.execute(
+            "SELECT 1 FROM features WHERE name = ? LIMIT 1", (name,)).fetchone() is not None }
+
+    def region(self, start: int, end: int, chromosome: Optional[str] = None) -> list[dict]:
+        '''
+        Get the features overlapping the region from start to end (both
+        included), on the given chromosome (if given, in which case features
+        with no chromosome are included too)
+        '''
+        ranges = overlapping_bins(start, end)
+        query = "(" + " OR ".join( "bin BETWEEN ? AND ?" for _ in ranges ) + ") AND start <= ? AND end >= ?"
+        args = ( *( b for r in ranges for b in r ), end, start )
+        if chromosome is not None:
+            query += " AND (chromosome = ? OR chromosome IS NULL)"
+            args += (chromosome,)
+        return self._features(query, args)
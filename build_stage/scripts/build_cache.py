@@ -0,0 +1,210 @@
+#
+# A content-addressed cache for the results of processing Hi-C files.
+#
+# Entries are keyed on a hash of the contents of the input .hic file along with
+# the settings used to process it, so a result can be reused no matter where
+# the input file lives, what the dataset is called, or which project it
+# belongs to. The cache directory can be shared between projects (and users),
+# and is kept under a size limit by evicting the least-recently-used entries.
+#
+# Layout of the cache directory:
+#
+#   CACHE_DIR/
+#     entries/
+#       ab/abcdef.../        <- one directory per entry (named by its key)
+#         entry.json         <- metadata (input digest, settings, size)
+#         structure.csv      <- copies of the output files (or, for entries
+#         ...                   of contacts extracted from a Hi-C file, the
+#                               arrays of them, see hic_contacts.py)
+#     locks/                 <- lock files, so the same run is never
+#       abcdef....lock          performed by two processes at once
+#     tmp/                   <- staging area for entries being written
+#
+
+import os
+import json
+import time
+import shutil
+import fcntl
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+# Bump this when the format of entries (or the outputs stored in them) changes,
+# so that old entries are no longer matched
+CACHE_VERSION = 1
+
+SIZE_SUFFIXES = { 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4 }
+
+def parse_size(size: str) -> int:
+    '''
+    Parse a human-readable size (e.g. '500M', '20G' or just a number of bytes)
+    into a number of bytes
+    '''
+    size = str(size).strip().upper().removesuffix('B')
+    if size and size[-1] in SIZE_SUFFIXES:
+        return int( float(size[:-1]) * SIZE_SUFFIXES[size[-1]] )
+    return int(size)
+
+@lru_cache(maxsize=None)
+def _file_digest(path: str, size: int, mtime_ns: int) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(4 * 1024**2):
+            h.update(chunk)
+    return h.hexdigest()
+
+def file_digest(path: Path) -> str:
+    '''
+    Get the SHA-256 digest of the contents of a file. Digests are remembered
+    for the lifetime of the process, as long as the file isn't modified.
+    '''
+    path = Path(path).resolve()
+    stat = path.stat()
+    return _file_digest(str(path), stat.st_size, stat.st_mtime_ns)
+
+def _dir_size(path: Path) -> int:
+    return sum( f.stat().st_size for f in path.iterdir() if f.is_file() )
+
+class BuildCache:
+    '''
+    A content-addressed cache of output files, stored in the given
+    directory and kept under max_size bytes
+    '''
+
+    def __init__(self, root: Path, max_size: int):
+        self.root = Path(root).resolve()
+        self.max_size = max_size
+
+    def _path(self, *parts) -> Path:
+        '''
+        Get a path inside the cache directory, making sure its parent exists
+        '''
+        path = self.root.joinpath(*parts)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def key(self, input: Path, settings: dict) -> str:
+        '''
+        Get the key for the results of processing the given input file
+        with the given settings
+        '''
+        ident = json.dumps({
+            'version': CACHE_VERSION,
+            'input': file_digest(input),
+            'settings': settings
+        }, sort_keys=True)
+        return hashlib.sha256(ident.encode()).hexdigest()
+
+    def entry_dir(self, key: str) -> Path:
+        return self._path('entries', key[:2], key)
+
+    @contextmanager
+    def lock(self, key: str):
+        '''
+        Context manager which holds an exclusive lock on the given key. Any
+        other process trying to lock the same key will block until it is
+        released.
+        '''
+        with open(self._path('locks', f"{key}.lock"), 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def fetch(self, key: str, outdir: Path) -> bool:
+        '''
+        Copy the files stored under the given key into outdir.
+
+        Returns False if there is no such entry in the cache.
+        '''
+        entry = self.entry_dir(key)
+        try:
+            with open(entry/'entry.json', 'r') as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+
+        outdir.mkdir(parents=True, exist_ok=True)
+        try:
+            for name in meta['files']:
+                shutil.copy2(entry/name, outdir/name)
+        except FileNotFoundError:
+            # An entry may be evicted out from under us by another process
+            return False
+
+        # Mark the entry as recently-used
+        os.utime(entry)
+        return True
+
+    def entry_files(self, key: str, names: list[str]) -> Optional[list[Path]]:
+        '''
+        Get the paths to the named files stored under the given key, to read
+        them where they are (rather than copying them out with fetch).
+
+        Returns None if there is no such entry in the cache, or it doesn't
+        have all the files.
+        '''
+        entry = self.entry_dir(key)
+        paths = [ entry/name for name in names ]
+        if not (entry/'entry.json').is_file() or not all( path.is_file() for path in paths ):
+            return None
+
+        # Mark the entry as recently-used
+        os.utime(entry)
+        return paths
+
+    def store(self, key: str, files: list[Path], **metadata):
+        '''
+        Store copies of the given files under the given key. Any extra
+        keyword arguments are saved in the entry's metadata.
+        '''
+        entry = self.entry_dir(key)
+        staging = Path(tempfile.mkdtemp(dir=self._path('tmp', 'entry').parent))
+        try:
+            for file in files:
+                shutil.copy2(file, staging/file.name)
+            meta = {
+                **metadata,
+                'files': [ file.name for file in files ],
+                'size': _dir_size(staging),
+                'created': time.time()
+            }
+            with open(staging/'entry.json', 'w') as f:
+                json.dump(meta, f)
+
+            # Move the finished entry into place. Renaming is atomic, so other
+            # processes will never see a partially-written entry.
+            if entry.exists():
+                shutil.rmtree(entry)
+            os.rename(staging, entry)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        self.evict()
+
+    def evict(self):
+        '''
+        Remove the least-recently-used entries until the cache
+        is under its size limit
+        '''
+        with self.lock('evict'):
+            entries = []
+            for entry in self.root.glob('entries/*/*'):
+                try:
+                    with open(entry/'entry.json', 'r') as f:
+                        size = json.load(f)['size']
+                    entries.append( (entry.stat().st_mtime, size, entry) )
+                except (FileNotFoundError, json.JSONDecodeError, KeyError):
+                    continue
+
+            total = sum( size for (_, size, _) in entries )
+            for (_, size, entry) in sorted(entries):
+                if total <= self.max_size:
+                    break
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
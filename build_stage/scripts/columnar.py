@@ -0,0 +1,54 @@
+#
+# Binary (columnar) versions of the outputs from processing a Hi-C file.
+#
+# These hold the same data as the text files written by hic2structure, but as
+# numpy arrays, which are much smaller and faster to write and read back:
+#
+#   structure.npy   float32 array of shape (beads, 3), bead positions
+#   contactmap.npz  'bins' (int32 array of shape (records, 2), the positions of
+#                   the bins in base pairs) and 'counts' (float32 array)
+#   inputset.npy    int32 arrays of shape (contacts, 2), pairs of bead
+#   outputset.npy   numbers, in the same form as the contact sets
+#
+
+from pathlib import Path
+
+import numpy as np
+
+def records_to_arrays(records: list) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Convert contact records (as read from a .hic file by hicstraw) to a tuple
+    of arrays: the positions of the bins and the counts
+    '''
+    bins = np.array( [ (r.binX, r.binY) for r in records ], dtype=np.int32 ).reshape(-1, 2)
+    counts = np.array( [ r.counts for r in records ], dtype=np.float32 )
+    return (bins, counts)
+
+def contact_set_to_array(contacts: set) -> np.ndarray:
+    '''
+    Convert a set of contacts (pairs of bead numbers) to a sorted array
+    '''
+    return np.array( sorted(contacts), dtype=np.int32 ).reshape(-1, 2)
+
+def write_structure(path: Path, positions: np.ndarray):
+    np.save(path, np.asarray(positions, dtype=np.float32))
+
+def write_contact_records(path: Path, records: list):
+    write_contact_arrays(path, *records_to_arrays(records))
+
+def write_contact_arrays(path: Path, bins: np.ndarray, counts: np.ndarray):
+    with open(path, 'wb') as f:
+        np.savez(f, bins=np.asarray(bins, dtype=np.int32), counts=np.asarray(counts, dtype=np.float32))
+
+def write_contact_set(path: Path, contacts: set):
+    np.save(path, contact_set_to_array(contacts))
+
+def read_structure(path: Path, mmap: bool = False) -> np.ndarray:
+    return np.load(path, mmap_mode='r' if mmap else None)
+
+def read_contact_records(path: Path) -> tuple[np.ndarray, np.ndarray]:
+    with np.load(path) as data:
+        return ( data['bins'], data['counts'] )
+
+def read_contact_set(path: Path, mmap: bool = False) -> np.ndarray:
+    return np.load(path, mmap_mode='r' if mmap else None)
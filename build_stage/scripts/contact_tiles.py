@@ -0,0 +1,178 @@
+#
+# Multi-resolution, tiled contact maps.
+#
+# A contact map at a high resolution has far more records than can be drawn
+# in a zoomed-out view. Instead, it's downsampled into a pyramid of levels:
+# level 0 is the contact map at the project's resolution, and each level
+# after it bins together pairs of bins from the one before (summing their
+# counts), so level k has a resolution 2^k times coarser. The last level is
+# the first small enough to fit in a single tile.
+#
+# Each level is split into square tiles of TILE_SIZE x TILE_SIZE bins, so a
+# view only needs the tiles it shows. Records are only kept for binX <= binY
+# (as in the records read from .hic files), so there are only tiles on and
+# above the diagonal. All the levels are stored together in three files:
+#
+#   tiles_offsets.npy  uint8 array of shape (records, 2), the position of each
+#                      record's bins within its tile
+#   tiles_counts.npy   float32 array of the counts
+#   tiles_index.npy    int64 array of shape (tiles, 5), the level, tile_x and
+#                      tile_y of each tile, and the start and stop of its
+#                      records in the arrays above. Sorted by level, then
+#                      tile_x, then tile_y.
+#
+# and are memory-mapped when they're read back (see ContactTiles).
+#
+
+from pathlib import Path
+
+import numpy as np
+
+# The number of bins along each side of a tile. Positions within a tile are
+# stored as uint8, so this can be at most 256.
+TILE_SIZE = 256
+
+# The files the tiles are stored in
+TILE_FILES = ('tiles_offsets.npy', 'tiles_counts.npy', 'tiles_index.npy')
+
+def downsample(bins: np.ndarray, counts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Bin together pairs of bins, summing the counts of the records that fall
+    in the same pair of coarser bins. bins are bin numbers (not positions in
+    base pairs). Returns the coarser bins (sorted) and their counts.
+    '''
+    if len(bins) == 0:
+        return ( np.empty((0, 2), dtype=np.int64), np.empty(0, dtype=np.float32) )
+    coarse = np.asarray(bins, dtype=np.int64) // 2
+    width = int(coarse.max()) + 1
+    (keys, inverse) = np.unique(coarse[:, 0] * width + coarse[:, 1], return_inverse=True)
+    summed = np.bincount(inverse.reshape(-1), weights=counts)
+    return ( np.stack([ keys // width, keys % width ], axis=1), summed.astype(np.float32) )
+
+def num_levels(num_bins: int, tile_size: int = TILE_SIZE) -> int:
+    '''
+    Get the number of levels in the pyramid for a contact map of num_bins
+    bins: enough for the last one to fit in a single tile
+    '''
+    levels = 1
+    while num_bins > tile_size:
+        num_bins = -(-num_bins // 2)
+        levels += 1
+    return levels
+
+def make_tiles(bins: np.ndarray, counts: np.ndarray, resolution: int,
+        tile_size: int = TILE_SIZE) -> tuple[tuple[np.ndarray, np.ndarray, np.ndarray], list[dict]]:
+    '''
+    Build the pyramid of tiles for a contact map, given the positions of the
+    bins in base pairs (as read from a .hic file) and their counts. Returns
+    the arrays (offsets, counts and index) described at the top of this
+    file, and a description of each level.
+    '''
+    if not 0 < tile_size <= 256:
+        raise ValueError(f"tile_size must be between 1 and 256 (not {tile_size})")
+
+    bins = np.asarray(bins, dtype=np.int64).reshape(-1, 2) // resolution
+    counts = np.asarray(counts, dtype=np.float32)
+    num_bins = int(bins.max()) + 1 if len(bins) > 0 else 0
+
+    (offsets, level_counts, index, levels) = ([], [], [], [])
+    start = 0
+    for level in range(num_levels(num_bins, tile_size)):
+        if level > 0:
+            (bins, counts) = downsample(bins, counts)
+
+        # Sort the records by tile, then by position
+        tiles = bins // tile_size
+        order = np.lexsort(( bins[:, 1], bins[:, 0], tiles[:, 1], tiles[:, 0] ))
+        (bins, counts, tiles) = (bins[order], counts[order], tiles[order])
+
+        # Find where the records for each tile start
+        first = np.ones(len(tiles), dtype=bool)
+        first[1:] = np.any(tiles[1:] != tiles[:-1], axis=1)
+        starts = np.flatnonzero(first)
+        stops = np.append(starts[1:], len(tiles))[:len(starts)]
+
+        offsets.append( (bins % tile_size).astype(np.uint8) )
+        level_counts.append(counts)
+        index.append( np.column_stack([
+            np.full(len(starts), level), tiles[starts, 0], tiles[starts, 1], start + starts, start + stops
+        ]).astype(np.int64) )
+        levels.append({
+            'level': level,
+            'resolution': resolution * 2**level,
+            'bins': -(-num_bins // 2**level),
+            'tiles': len(starts),
+            'records': len(counts)
+        })
+        start += len(counts)
+
+    arrays = (
+        np.concatenate(offsets).reshape(-1, 2) if offsets else np.empty((0, 2), dtype=np.uint8),
+        np.concatenate(level_counts) if level_counts else np.empty(0, dtype=np.float32),
+        np.concatenate(index).reshape(-1, 5) if index else np.empty((0, 5), dtype=np.int64)
+    )
+    return (arrays, levels)
+
+def save_tiles(paths: list[Path], bins: np.ndarray, counts: np.ndarray, resolution: int,
+        tile_size: int = TILE_SIZE) -> list[dict]:
+    '''
+    Build the pyramid of tiles for a contact map (see make_tiles), and save
+    it in the given paths (one for each of TILE_FILES). Returns the
+    description of each level.
+    '''
+    (arrays, levels) = make_tiles(bins, counts, resolution, tile_size)
+    for (path, array) in zip(paths, arrays):
+        np.save(path, array)
+    return levels
+
+class ContactTiles:
+    '''
+    The tiles of a contact map saved with save_tiles, given the paths to its
+    files (memory-mapped, so only the tiles which are read are loaded)
+    '''
+
+    def __init__(self, paths: list[Path], tile_size: int = TILE_SIZE):
+        (self.offsets, self.counts, index) = [ np.load(path, mmap_mode='r') for path in paths ]
+        self.tile_size = tile_size
+        self.index = np.asarray(index)
+        self._index_keys = self._keys(self.index)
+
+    def levels(self) -> int:
+        return int(self.index[:, 0].max()) + 1 if len(self.index) > 0 else 0
+
+    def tile(self, level: int, tile_x: int, tile_y: int) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Get the records in a tile, as the bin numbers (at that level) and the
+        counts. Tiles with no records (including the ones below the
+        diagonal) are empty.
+        '''
+        row = np.searchsorted(self._index_keys, self._keys(np.array([[level, tile_x, tile_y]])))[0]
+        if row == len(self.index) or tuple(self.index[row, :3]) != (level, tile_x, tile_y):
+            return ( np.empty((0, 2), dtype=np.int64), np.empty(0, dtype=np.float32) )
+        (start, stop) = self.index[row, 3:]
+        corner = np.array([ tile_x, tile_y ], dtype=np.int64) * self.tile_size
+        return ( self.offsets[start:stop].astype(np.int64) + corner, np.asarray(self.counts[start:stop]) )
+
+    def region(self, level: int, start: int, end: int) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Get the records at a level with both bins in the range [start, end)
+        of bin numbers, reading only the tiles which overlap it
+        '''
+        (first, last) = ( start // self.tile_size, max(start, end - 1) // self.tile_size )
+        (bins, counts) = ([], [])
+        for tile_x in range(first, last + 1):
+            for tile_y in range(tile_x, last + 1):
+                (tile_bins, tile_counts) = self.tile(level, tile_x, tile_y)
+                keep = np.all((tile_bins >= start) & (tile_bins < end), axis=1)
+                bins.append(tile_bins[keep])
+                counts.append(tile_counts[keep])
+        if not bins:
+            return ( np.empty((0, 2), dtype=np.int64), np.empty(0, dtype=np.float32) )
+        return ( np.concatenate(bins), np.concatenate(counts) )
+
+    @staticmethod
+    def _keys(rows: np.ndarray) -> np.ndarray:
+        # a single sortable key for each (level, tile_x, tile_y), in the
+        # same order as the index is sorted in
+        rows = rows.astype(np.int64)
+        return (rows[:, 0] << 42) | (rows[:, 1] << 21) | rows[:, 2]
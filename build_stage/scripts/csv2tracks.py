@@ -0,0 +1,560 @@
+#
+# csv2tracks: create track (array) data for the 4DGB Browser from csv files.
+#
+# Each track is made from a list of columns (one for each dataset), which are
+# written as arrays in a track.npz file, along with a track.json file of
+# metadata describing it. A column without a name is empty (every value is
+# the track's fill value), e.g. for a dataset the track has no data for.
+#
+# Tracks can also be written uncompressed, so they can be memory-mapped when
+# they're read (see load_track) rather than decompressed into memory by every
+# process reading them:
+#
+#   npz   track.npz, a (compressed) numpy archive of arr_0, arr_1, ...
+#   npy   arr_0.npy, arr_1.npy, ..., a numpy array file for each column
+#   raw   track.bin, the values of every column, one after another, with no
+#         header. The byte offset and length of each column, and the type of
+#         the values, are recorded in track.json.
+#
+# This can be used as a module (see make_tracks) or through the command-line
+# wrapper, 'csv2tracks'.
+#
+
+import argparse
+import os
+import numpy
+import json
+import functools
+import tempfile
+import zipfile
+import multiprocessing
+import multiprocessing.pool
+
+from pathlib import Path
+
+# globals
+DTYPES          = { "float32": numpy.float32, "float64": numpy.float64 }
+TRACK_FORMATS   = ( "npz", "npy", "raw" )
+
+# data shared with the worker processes writing tracks (set in each worker
+# when it starts, and never in the process calling make_tracks, which may be
+# writing other tracks in other threads)
+_SHARED         = {}
+
+helptext = ""
+
+def get_structure_array_metadata(name, type, min, max, npz_file):
+    array_metadata = '''{{
+"name"      : "{0}",
+"type"      : "structure",
+"version"   : "0.1",
+"tags"      : [],
+"data"      : {{
+    "type"  : "{1}",
+    "dim"   : 1,
+    "min"   : {2},
+    "max"   : {3},
+    "values" : [
+        {{
+            "id"  : "arr_0",
+            "url" : "{4}"
+        }},
+        {{
+            "id"  : "arr_1",
+            "url" : "{5}"
+        }}
+    ]
+}}
+}}
+'''.format(name, type, min, max, npz_file, npz_file)
+
+    return array_metadata
+
+def get_track_metadata(name, type, min, max, format, urls, columns, dtype, length):
+    '''
+    Get the metadata for a track with the given number of columns, written in
+    the given format. urls are the urls of the track's data files (see
+    track_data_files), and each column has length values of the given dtype.
+    '''
+    if format == "npz":
+        return json.loads(get_structure_array_metadata(name, type, min, max, urls[0]))
+
+    if format == "npy":
+        values = [ { "id": "arr_{}".format(i), "url": str(urls[i]) } for i in range(columns) ]
+    else:
+        # the columns are stored one after another in the same file
+        itemsize = numpy.dtype(dtype).itemsize
+        values = [
+            { "id": "arr_{}".format(i), "url": str(urls[0]), "offset": i * length * itemsize, "length": length }
+            for i in range(columns)
+        ]
+    # (min and max are written as they're printed, like in the npz metadata,
+    # rather than as the nearest float64 to a float32)
+    return {
+        "name": name,
+        "type": "structure",
+        "version": "0.1",
+        "tags": [],
+        "data": {
+            "type": type,
+            "dim": 1,
+            "min": float(str(min)),
+            "max": float(str(max)),
+            "format": format,
+            "dtype": numpy.lib.format.dtype_to_descr(numpy.dtype(dtype)),
+            "values": values
+        }
+    }
+
+def track_data_files(track, format="npz"):
+    '''
+    Get the names of the files (in the track's directory) a track's arrays
+    are written to in the given format
+    '''
+    if format == "npz":
+        return [ "track.npz" ]
+    if format == "npy":
+        return [ "arr_{}.npy".format(i) for i in range(len(track["columns"])) ]
+    if format == "raw":
+        return [ "track.bin" ]
+    raise ValueError("Unknown track format '{}' (must be one of: {})".format(format, ", ".join(TRACK_FORMATS)))
+
+class Column:
+    '''
+    The values of one column of a csv file, read in one or more chunks.
+
+    The minimum and maximum (ignoring NaNs) are kept as chunks are added. If
+    spool is True, the chunks are written out to a temporary file rather than
+    kept in memory.
+    '''
+    def __init__(self, dtype, spool=False):
+        self.dtype  = numpy.dtype(dtype)
+        self.length = 0
+        self.min    = None
+        self.max    = None
+        self._parts = []
+        self._file  = tempfile.TemporaryFile(buffering=0) if spool else None
+
+    def append(self, values):
+        values = numpy.asarray(values, dtype=self.dtype)
+        valid = values[ ~numpy.isnan(values) ]
+        if valid.size:
+            (curmin, curmax) = (valid.min(), valid.max())
+            self.min = curmin if self.min is None else min(self.min, curmin)
+            self.max = curmax if self.max is None else max(self.max, curmax)
+        self.length += len(values)
+
+        if self._file is None:
+            self._parts.append(values)
+        else:
+            self._file.write(values.tobytes())
+
+    def chunks(self, chunksize=None):
+        '''
+        Iterate over the values in the column, in chunks of (up to) chunksize
+        '''
+        if self._file is None:
+            yield from self._parts
+            return
+
+        # read with pread, since the file may be shared with other processes
+        chunksize = chunksize or self.length
+        for start in range(0, self.length, chunksize):
+            count = min(chunksize, self.length - start)
+            buf = os.pread(self._file.fileno(), count * self.dtype.itemsize, start * self.dtype.itemsize)
+            yield numpy.frombuffer(buf, dtype=self.dtype)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+def track_file(basedir, track, column):
+    # the file for a column is the track's file, unless the column overrides it
+    return os.path.join(basedir, column.get("file", track["file"]))
+
+def needed_columns(tracks, basedir):
+    '''
+    Get a dict mapping each distinct csv file used by the tracks to the
+    list of columns needed from it
+    '''
+    files = {}
+    for track in tracks:
+        for c in track["columns"]:
+            if "name" not in c:
+                continue
+            columns = files.setdefault(track_file(basedir, track, c), [])
+            if c["name"] not in columns:
+                columns.append(c["name"])
+    return files
+
+def read_columns(fname, names, dtype, chunksize=None):
+    '''
+    Read the named columns of a csv file (only once, and in chunks of
+    chunksize rows, if given). Returns a dict of column names to Columns.
+    '''
+    # (pandas is slow to import, and only needed here)
+    import pandas as pd
+    columns = { name: Column(dtype, spool=chunksize is not None) for name in names }
+    chunks = pd.read_csv( fname, usecols=names, dtype={ name: dtype for name in names },
+                          engine='c', float_precision='round_trip', chunksize=chunksize )
+    if chunksize is None:
+        # the whole file was read at once
+        chunks = [ chunks ]
+    for chunk in chunks:
+        for name in names:
+            columns[name].append( chunk[name].to_numpy() )
+    return columns
+
+def _write_column(f, column, length, fillvalue, chunksize=None):
+    # write the values of a column to a file, one chunk at a time, replacing
+    # NaNs with the fillvalue and padding it to the given length
+    fill = column.dtype.type(fillvalue)
+    for chunk in column.chunks(chunksize):
+        f.write( numpy.where(numpy.isnan(chunk), fill, chunk).tobytes() )
+    f.write( numpy.full(length - column.length, fill, dtype=column.dtype).tobytes() )
+
+def _write_npy_header(f, dtype, length):
+    numpy.lib.format.write_array_header_1_0(f, {
+        "descr": numpy.lib.format.dtype_to_descr(dtype),
+        "fortran_order": False,
+        "shape": (length,)
+    })
+
+def _replace(fname, write):
+    # write a file by writing a temporary file next to it, and moving it into
+    # place. Processes that already have the old file memory-mapped keep
+    # reading it, rather than seeing it change (or shrink) underneath them.
+    (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(fname), prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp, fname)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def write_npz(fname, columns, fillvalue, chunksize=None, compression=None):
+    '''
+    Write the columns as arrays in a compressed .npz file, in the same form as
+    numpy.savez_compressed, but one chunk at a time. Columns shorter than the
+    longest one are padded to the same length, and NaNs are replaced with the
+    fillvalue.
+
+    compression is the zlib compression level (1-9), or 0 to store the arrays
+    uncompressed (like numpy.savez). If None, zlib's default level is used.
+    '''
+    length = max( c.length for c in columns )
+    if compression == 0:
+        options = { "compression": zipfile.ZIP_STORED }
+    else:
+        options = { "compression": zipfile.ZIP_DEFLATED, "compresslevel": compression }
+    with zipfile.ZipFile(fname, mode="w", allowZip64=True, **options) as zipf:
+        for i, column in enumerate(columns):
+            with zipf.open("arr_{}.npy".format(i), "w", force_zip64=True) as f:
+                _write_npy_header(f, column.dtype, length)
+                _write_column(f, column, length, fillvalue, chunksize)
+
+def write_npy(fnames, columns, fillvalue, chunksize=None):
+    '''
+    Write each of the columns as an array in its own .npy file (padded and
+    filled like write_npz)
+    '''
+    length = max( c.length for c in columns )
+    for fname, column in zip(fnames, columns):
+        def write(f):
+            _write_npy_header(f, column.dtype, length)
+            _write_column(f, column, length, fillvalue, chunksize)
+        _replace(fname, write)
+
+def write_raw(fname, columns, fillvalue, chunksize=None):
+    '''
+    Write the columns one after another in a single binary file, with no
+    header (padded and filled like write_npz). All the columns must have
+    the same dtype.
+    '''
+    length = max( c.length for c in columns )
+    def write(f):
+        for column in columns:
+            _write_column(f, column, length, fillvalue, chunksize)
+    _replace(fname, write)
+
+def _remove_stale_files(directory, keep):
+    # remove the data files left in a track's directory from writing it in
+    # a different format
+    for name in os.listdir(directory):
+        if name not in keep and (name in ("track.npz", "track.bin") or
+                                 (name.startswith("arr_") and name.endswith(".npy"))):
+            os.unlink(os.path.join(directory, name))
+
+def write_structure_variable( track, data, basedir, destination, relative=None, chunksize=None,
+                              compression=None, format="npz", verbose=False ):
+    '''
+    Write the track.json file and the data files (track.npz, or the files for
+    the given format) for a track, given the dict of data read from the csv
+    files, keyed by (file, column name)
+    '''
+    varname = track["name"]
+    trackdir   = os.path.join(destination, varname)
+    afile_json = os.path.join(trackdir, "track.json")
+    afiles     = [ os.path.join(trackdir, name) for name in track_data_files(track, format) ]
+
+    if relative:
+        urls = [ Path(afile).relative_to(relative) for afile in afiles ]
+    else:
+        urls = afiles
+
+    named = [ data[ (track_file(basedir, track, c), c["name"]) ] for c in track["columns"] if "name" in c ]
+    dtype = named[0].dtype if named else numpy.float64
+    columns = []
+    for c in track["columns"]:
+        if "file" in c and verbose:
+            # file overridden locally
+            print("Overriding file")
+        columns.append( data[ (track_file(basedir, track, c), c["name"]) ] if "name" in c else Column(dtype) )
+
+    # find min and max over all the columns
+    mins = [ c.min for c in columns if c.min is not None ]
+    maxs = [ c.max for c in columns if c.max is not None ]
+    if mins:
+        (minval, maxval) = (min(mins), max(maxs))
+    else:
+        if verbose:
+            print("Track {} has no values".format(varname))
+        (minval, maxval) = (0.0, 0.0)
+
+    # write the files
+    if verbose:
+        print("saving file to: {}".format(afile_json))
+        for afile in afiles:
+            print("saving file to: {}".format(afile))
+    os.makedirs(trackdir, exist_ok=True)
+    _remove_stale_files(trackdir, track_data_files(track, format))
+    length = max( c.length for c in columns )
+    if format == "npz":
+        array_metadata = get_structure_array_metadata( varname, track["type"], minval, maxval, urls[0])
+    else:
+        array_metadata = json.dumps( get_track_metadata( varname, track["type"], minval, maxval, format,
+                                     urls, len(columns), columns[0].dtype, length ), indent=4 )
+
+    # fill na with the minimum value
+    if format == "npz":
+        write_npz(afiles[0], columns, minval, chunksize, compression)
+    elif format == "npy":
+        write_npy(afiles, columns, minval, chunksize)
+    else:
+        write_raw(afiles[0], columns, minval, chunksize)
+
+    # the metadata is written last, so it never describes data that isn't there yet
+    with open(afile_json, "w") as f:
+        f.write(array_metadata)
+
+    return json.loads(array_metadata)
+
+def load_track(directory, mmap=True):
+    '''
+    Load the arrays of a track written by make_tracks (in any format), given
+    its directory. Returns the track's metadata and its list of arrays.
+    Arrays of tracks in the npy and raw formats are memory-mapped (read-only)
+    unless mmap is False, so processes reading the same track share its
+    pages in the OS page cache.
+    '''
+    with open(os.path.join(directory, "track.json")) as f:
+        metadata = json.load(f)
+    values = metadata["data"]["values"]
+    format = metadata["data"].get("format", "npz")
+    mode = "r" if mmap else None
+
+    # files are found in the track's directory, whatever the urls are relative to
+    def path(value):
+        return os.path.join(directory, os.path.basename(value["url"]))
+
+    if format == "npz":
+        with numpy.load(path(values[0])) as npz:
+            # (the npz metadata always lists two arrays, whatever the track has)
+            arrays = [ npz[key] for key in sorted(npz.files, key=lambda k: int(k[4:])) ]
+    elif format == "npy":
+        arrays = [ numpy.load(path(value), mmap_mode=mode) for value in values ]
+    else:
+        dtype = numpy.dtype(metadata["data"]["dtype"])
+        arrays = []
+        for value in values:
+            if mmap and value["length"] > 0:
+                # (empty files can't be memory-mapped)
+                arrays.append( numpy.memmap(path(value), dtype=dtype, mode="r",
+                                            offset=value["offset"], shape=(value["length"],)) )
+            else:
+                arrays.append( numpy.fromfile(path(value), dtype=dtype,
+                                              offset=value["offset"], count=value["length"]) )
+    return (metadata, arrays)
+
+def _init_worker(options):
+    # (forked workers inherit the options, so the data that's already been
+    # read isn't copied to them)
+    _SHARED.update(options)
+
+def _write_track(track):
+    # write a track in a worker process, using the shared data
+    return write_structure_variable(track, **_SHARED)
+
+def make_tracks(tracks, basedir, destination, relative=None, dtype="float64", chunksize=None,
+                jobs=1, compression=None, format="npz", threads=False, skip=(), verbose=False):
+    '''
+    Create the track data for a list of tracks (as in the 'tracks' section of
+    a workflow file). Files are relative to basedir, as is the destination
+    directory (unless it's absolute). Each csv file is read only once, no
+    matter how many tracks or columns use it. Tracks are then written by up
+    to 'jobs' processes at once, or threads if threads is True (which is
+    safer when other threads are running, and still runs the compression in
+    parallel, since zlib releases the GIL).
+
+    The arrays of each track are written in the given format (one of
+    TRACK_FORMATS, see the top of this file). compression only applies to
+    the npz format.
+
+    Tracks named in skip are assumed to be up to date in the destination
+    already, so they aren't written (and their columns aren't read). They're
+    still included in array_results.json and the returned metadata.
+
+    Also writes array_results.json in the destination directory. Returns the
+    list of metadata (i.e. the contents of track.json) for each track.
+    '''
+    outdir = os.path.join(basedir, destination)
+    if format not in TRACK_FORMATS:
+        raise ValueError("Unknown track format '{}' (must be one of: {})".format(format, ", ".join(TRACK_FORMATS)))
+
+    # read the data (only for the tracks being written)
+    data = {}
+    written = [ track for track in tracks if track["name"] not in skip ]
+    for fname, names in needed_columns(written, basedir).items():
+        if verbose:
+            print("Reading {} columns from: {}".format(len(names), fname))
+        for name, column in read_columns(fname, names, DTYPES[dtype], chunksize).items():
+            data[(fname, name)] = column
+
+    # create arrays
+    # (add some missing metadata)
+    tracks = [ { **track, "type": "float", "fillvalue": "min" } for track in tracks ]
+    written = [ track for track in tracks if track["name"] not in skip ]
+    options = {
+        "data": data, "basedir": basedir, "destination": outdir, "relative": relative,
+        "chunksize": chunksize, "compression": compression, "format": format, "verbose": verbose
+    }
+    write = functools.partial(write_structure_variable, **options)
+    metadata = {}
+    try:
+        if jobs > 1 and len(written) > 1:
+            # workers share the data that's already been read
+            if threads:
+                pool = multiprocessing.pool.ThreadPool( min(jobs, len(written)) )
+            else:
+                pool = multiprocessing.get_context("fork").Pool( min(jobs, len(written)),
+                    initializer=_init_worker, initargs=(options,) )
+                write = _write_track
+            with pool:
+                for (track, track_metadata) in zip(written, pool.imap(write, written)):
+                    if verbose:
+                        print("Created track: {}".format(track_metadata["name"]))
+                    metadata[track["name"]] = track_metadata
+        else:
+            for track in written:
+                if verbose:
+                    print("Creating track: {}".format(track["name"]))
+                metadata[track["name"]] = write(track)
+    finally:
+        for column in data.values():
+            column.close()
+
+    # write out a json fragment that can be included in a project file to define arrays
+    entries = []
+    arrays = { "arrays" : entries }
+    curid = 0
+    for t in tracks:
+        entries.append({"id": curid, "url": "{}/{}/{}".format(destination, t["name"], "track.json")})
+        curid += 1
+    array_results = os.path.join(outdir, "array_results.json")
+    if verbose:
+        print("Writing arrays results file: {}".format(array_results))
+
+    with open(array_results, "w") as ajson:
+        ajson.write(json.dumps(arrays, indent=4))
+
+    for t in tracks:
+        if t["name"] not in metadata:
+            with open(os.path.join(outdir, t["name"], "track.json")) as f:
+                metadata[t["name"]] = json.load(f)
+    return [ metadata[t["name"]] for t in tracks ]
+
+def create_tracks(workflow, destination, **kwargs):
+    '''
+    Create the track data for all the tracks in a workflow file. See
+    make_tracks for the options.
+    '''
+    import yaml
+    with open(workflow, 'r') as wstream:
+        workflow_data = yaml.safe_load(wstream)
+    return make_tracks(workflow_data["tracks"], os.path.dirname(workflow), destination, **kwargs)
+
+def main():
+    # normal option parsing
+    parser = argparse.ArgumentParser(
+                description="csv2tracks: a tool to create array data from csv files",
+                epilog=helptext,
+                formatter_class=argparse.ArgumentDefaultsHelpFormatter )
+
+    parser.add_argument(    "--workflow",
+                            required=True,
+                            default="workflow.yaml",
+                            help="the workflow input file")
+
+    parser.add_argument(    "--destination",
+                            required=True,
+                            default="results",
+                            help="directory for results (relative to directory containing workflow input file)")
+
+    parser.add_argument(    "--relative",
+                            required=False,
+                            help="Make paths in the output metadata json files relative to this directory"
+    )
+
+    parser.add_argument(    "--dtype",
+                            required=False,
+                            default="float64",
+                            choices=list(DTYPES.keys()),
+                            help="type of the values in the output arrays")
+
+    parser.add_argument(    "--chunksize",
+                            required=False,
+                            type=int,
+                            default=None,
+                            help="read csv files this many rows at a time, to limit memory use on large files")
+
+    parser.add_argument(    "--jobs",
+                            required=False,
+                            type=int,
+                            default=1,
+                            help="number of tracks to write at once (in separate processes)")
+
+    parser.add_argument(    "--compression",
+                            required=False,
+                            type=int,
+                            default=None,
+                            choices=range(0, 10),
+                            metavar="{0-9}",
+                            help="zlib compression level for the track files, or 0 for no compression (default: zlib's default level)")
+
+    parser.add_argument(    "--format",
+                            required=False,
+                            default="npz",
+                            choices=TRACK_FORMATS,
+                            help="format of the track files: a compressed npz file, a npy file for each column, or a single raw binary file (npy and raw can be memory-mapped when read)")
+
+    parser.add_argument(    "--verbose",
+                            required=False,
+                            action="store_true",
+                            help="report verbosely")
+
+    args = parser.parse_args()
+
+    create_tracks(args.workflow, args.destination, relative=args.relative, dtype=args.dtype,
+                  chunksize=args.chunksize, jobs=args.jobs, compression=args.compression,
+                  format=args.format, verbose=args.verbose)
@@ -0,0 +1,131 @@
+#
+# Summaries of an ensemble of structures: several LAMMPS simulations
+# (replicates) of the same dataset, run with different random seeds.
+#
+# Replicates are added one at a time, so only one needs to be in memory at
+# once. From them, we keep:
+#
+#   mean_distance.npy       float32 array of shape (beads, beads), the mean
+#                           distance between each pair of beads. This is
+#                           accumulated in a file (memory-mapped), a block of
+#                           rows at a time.
+#   variance.npy            float64 array of shape (beads,), the variance in
+#                           the position of each bead (the mean squared
+#                           distance from its mean position, once the
+#                           replicates are aligned)
+#   contact_frequency.npz   'pairs' (int32 array of shape (contacts, 2), pairs
+#                           of bead numbers) and 'frequency' (float32 array),
+#                           the fraction of replicates each contact is found in
+#
+
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+# Number of elements in each block of the distance matrix computed at once
+DISTANCE_BLOCK = 4 * 1024**2
+
+def kabsch(mobile: np.ndarray, reference: np.ndarray) -> np.ndarray:
+    '''
+    Rotate and translate mobile (an array of positions of shape (beads, 3))
+    to minimize its RMSD from reference, which must be centered on the origin.
+    Returns the aligned positions.
+    '''
+    centered = mobile - mobile.mean(axis=0)
+    (u, _, vt) = np.linalg.svd(centered.T @ reference)
+    # Correct for a reflection, if the best fit is one
+    d = np.sign( np.linalg.det(u @ vt) ) or 1.0
+    u[:, -1] *= d
+    return centered @ (u @ vt)
+
+def bead_contacts(pairs: np.ndarray, weights: np.ndarray, beads: int) -> np.ndarray:
+    '''
+    Sum the weights of the contacts each bead is part of. Beads are
+    numbered from 1 in pairs.
+    '''
+    totals = np.zeros(beads, dtype=np.float64)
+    for side in (0, 1):
+        np.add.at(totals, pairs[:, side] - 1, weights)
+    return totals
+
+class Ensemble:
+    '''
+    Summary statistics over replicate structures, which are added one at a
+    time. If mean_distance_file is given, the mean distance matrix is
+    accumulated in it (it's skipped otherwise, since it's quadratic in the
+    number of beads).
+    '''
+    def __init__(self, mean_distance_file: Optional[Path] = None):
+        self.mean_distance_file = mean_distance_file
+        self.count = 0
+        self.reference = None
+        self._mean = None
+        self._m2 = None
+        self._distance = None
+        self._contacts = Counter()
+
+    def add(self, positions: np.ndarray, contacts: set):
+        '''
+        Add a replicate: its bead positions and the set of contacts found in it
+        '''
+        positions = np.asarray(positions, dtype=np.float64)
+        if self.reference is None:
+            self.reference = positions - positions.mean(axis=0)
+            self._mean = np.zeros_like(self.reference)
+            self._m2 = np.zeros(len(positions), dtype=np.float64)
+            if self.mean_distance_file is not None:
+                self._distance = np.lib.format.open_memmap(self.mean_distance_file,
+                    mode='w+', dtype=np.float32, shape=(len(positions), len(positions))
+                )
+        elif positions.shape != self.reference.shape:
+            raise ValueError(f"Replicate has {len(positions)} beads, but the first one had {len(self.reference)}")
+
+        self.count += 1
+
+        # Welford's algorithm, for the variance of the aligned positions
+        aligned = kabsch(positions, self.reference)
+        delta = aligned - self._mean
+        self._mean += delta / self.count
+        self._m2 += np.einsum('ij,ij->i', delta, aligned - self._mean)
+
+        # Running mean of the distance matrix (distances don't depend on
+        # alignment, so the original positions are used)
+        if self._distance is not None:
+            rows = max(1, DISTANCE_BLOCK // len(positions))
+            for start in range(0, len(positions), rows):
+                block = positions[start:start+rows]
+                distances = np.linalg.norm(block[:, np.newaxis, :] - positions[np.newaxis, :, :], axis=2)
+                self._distance[start:start+rows] += (distances - self._distance[start:start+rows]) / self.count
+
+        self._contacts.update(contacts)
+
+    def variance(self) -> np.ndarray:
+        return self._m2 / self.count
+
+    def contact_frequency(self) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Get the contacts found in any replicate (as a sorted array of pairs)
+        and the fraction of replicates each was found in
+        '''
+        pairs = sorted(self._contacts)
+        frequency = np.array( [ self._contacts[p] for p in pairs ], dtype=np.float32 ) / self.count
+        return ( np.array(pairs, dtype=np.int32).reshape(-1, 2), frequency )
+
+    def save(self, variance_file: Path, contact_frequency_file: Path):
+        '''
+        Save the variance and contact frequencies (and finish writing the
+        mean distance matrix, if there is one)
+        '''
+        np.save(variance_file, self.variance())
+        (pairs, frequency) = self.contact_frequency()
+        with open(contact_frequency_file, 'wb') as f:
+            np.savez(f, pairs=pairs, frequency=frequency)
+        if self._distance is not None:
+            self._distance.flush()
+            self._distance = None
+
+def read_contact_frequency(path: Path) -> tuple[np.ndarray, np.ndarray]:
+    with np.load(path) as data:
+        return ( data['pairs'], data['frequency'] )
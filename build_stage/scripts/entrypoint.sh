@@ -7,6 +7,8 @@
 # input and output project directories. Builds the project in /in and
 # places the result in /out
 #
+# Any arguments are passed along to the workflow script
+#
 
 set -eu
 
@@ -16,4 +18,4 @@ echo -ne "\e[1m> Workflow version: \e[0m"
 
 # Build project
 echo -e "\e[1m[\e[32m>\e[0m\e[1m]:\e[0m Building project... (this may take a while)" >&2
-python3 ./scripts/workflow.py /in /out
+python3 ./scripts/workflow.py /in /out "$@"
@@ -0,0 +1,80 @@
+#
+# Contact records extracted from Hi-C files, as arrays.
+#
+# Reading contact records from a .hic file means decompressing the block for
+# the chromosome and resolution every time, even if only the settings for the
+# simulation have changed. Instead, all the records for a (file, chromosome,
+# resolution) are extracted once and kept (in the build cache) as arrays:
+#
+#   bins.npy    int32 array of shape (records, 2), the positions of the bins
+#               in base pairs (as in the records from hicstraw)
+#   counts.npy  float32 array of the counts
+#
+# which are memory-mapped when they're read back. Filtering them by the
+# count_threshold (and optionally removing blacked-out segments) is then done
+# with array operations.
+#
+
+from collections import namedtuple
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+import columnar
+
+# The files a block of contact records is stored in
+CONTACT_FILES = ('bins.npy', 'counts.npy')
+
+# A contact record, with the same fields as the ones read from .hic files by
+# hicstraw (for the hic2structure functions which take records)
+ContactRecord = namedtuple('ContactRecord', ['binX', 'binY', 'counts'])
+
+def extract_contacts(hic, settings: dict) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Read all the contact records for the chromosome and resolution in the
+    settings from a Hi-C file (opened with hic2structure), whatever their
+    count. Returns a tuple of the bins and counts.
+    '''
+    records = hic.get_contact_records({ **settings, 'count_threshold': float('-inf') })
+    return columnar.records_to_arrays(records)
+
+def save_contacts(directory: Path, bins: np.ndarray, counts: np.ndarray) -> list[Path]:
+    '''
+    Save a block of contact records in a directory. Returns the paths to the
+    files written.
+    '''
+    paths = [ Path(directory).joinpath(name) for name in CONTACT_FILES ]
+    np.save(paths[0], np.asarray(bins, dtype=np.int32).reshape(-1, 2))
+    np.save(paths[1], np.asarray(counts, dtype=np.float32))
+    return paths
+
+def read_contacts(directory: Path) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Read a block of contact records saved with save_contacts (memory-mapped)
+    '''
+    (bins, counts) = [ np.load(Path(directory).joinpath(name), mmap_mode='r') for name in CONTACT_FILES ]
+    return (bins, counts)
+
+def filter_contacts(bins: np.ndarray, counts: np.ndarray, count_threshold: float,
+        resolution: int, blackout: Optional[list] = None) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Keep only the contact records with a count higher than count_threshold.
+    If blackout is given (a list of [start, end] ranges of segments,
+    numbered from 1 and including both ends), records for bins in any of
+    them are removed too.
+    '''
+    keep = counts > count_threshold
+    if blackout and len(bins) > 0:
+        segments = bins // resolution + 1
+        blacked = np.zeros( int(segments.max()) + 1, dtype=bool )
+        for (start, end) in blackout:
+            blacked[ max(0, start) : max(0, end + 1) ] = True
+        keep &= ~blacked[ segments[:, 0] ] & ~blacked[ segments[:, 1] ]
+    return ( np.asarray(bins[keep]), np.asarray(counts[keep]) )
+
+def arrays_to_records(bins: np.ndarray, counts: np.ndarray) -> list[ContactRecord]:
+    '''
+    Convert arrays of contact records back into records
+    '''
+    return [ ContactRecord(x, y, c) for ((x, y), c) in zip(bins.tolist(), counts.tolist()) ]
@@ -0,0 +1,225 @@
+#
+# The build as a pipeline of stages, run as a dependency graph.
+#
+# Each stage declares the stages it comes after, the files it reads (inputs)
+# and writes (outputs), and any other configuration its outputs depend on.
+# A stage starts as soon as the stages it comes after are done, so independent
+# stages run at the same time. (They run in threads, since the heavy lifting
+# in each stage is done in other processes or in code that releases the GIL.)
+#
+# When a stage finishes, a digest of its inputs and configuration (its
+# "stamp") is recorded. The next time, the stage is skipped if its stamp
+# hasn't changed and its outputs still exist.
+#
+
+import json
+import hashlib
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from build_cache import file_digest
+
+@dataclass
+class Stage:
+    '''
+    A stage of the build. The callables are given a dict of the results of
+    the stages this one comes after, keyed on their names.
+    '''
+    name: str
+    # Run the stage, returning its result
+    run: Callable[[dict], Any]
+    # Names of the stages this one depends on
+    after: list[str] = field(default_factory=list)
+    # Files the stage reads
+    inputs: Callable[[dict], list[Path]] = lambda results: []
+    # Anything else (JSON-serializable) that the outputs depend on
+    config: Callable[[dict], Any] = lambda results: None
+    # Files the stage writes
+    outputs: Callable[[dict], list[Path]] = lambda results: []
+    # Get the result of the stage without running it (if it's skipped or not
+    # selected to run). If it returns None, the stage needs to be run. Stages
+    # without a result don't need this.
+    load: Optional[Callable[[], Any]] = None
+    # Whether a result is complete. If not, the stage isn't stamped, so it
+    # will run again next time.
+    complete: Callable[[Any], bool] = lambda result: True
+
+class Pipeline:
+    '''
+    A set of Stages, with stamps recorded in stamp_file. If a profiler is
+    given (see profiling.py), each stage that runs is timed (and profiled)
+    with it.
+
+    After running, 'status' holds whether each stage 'ran', was 'skipped'
+    or 'failed'.
+    '''
+    def __init__(self, stages: list[Stage], stamp_file: Path, profiler = None):
+        self.stages = { stage.name: stage for stage in stages }
+        self.stamp_file = Path(stamp_file)
+        self.profiler = profiler
+        self.status = {}
+        self._lock = threading.Lock()
+
+        for stage in stages:
+            for dep in stage.after:
+                if dep not in self.stages:
+                    raise ValueError(f"Stage '{stage.name}' comes after unknown stage '{dep}'")
+        self.order = self._sort()
+
+    def _sort(self) -> list[str]:
+        # Topological sort, keeping the order stages were given in where possible
+        order = []
+        visiting = set()
+        def visit(name):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(f"Stages have a cycle through '{name}'")
+            visiting.add(name)
+            for dep in self.stages[name].after:
+                visit(dep)
+            order.append(name)
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def dependencies(self, name: str) -> list[str]:
+        '''
+        Get the names of all the stages the named one depends on (directly
+        or indirectly), in the order they run
+        '''
+        deps = set()
+        def visit(n):
+            for dep in self.stages[n].after:
+                if dep not in deps:
+                    deps.add(dep)
+                    visit(dep)
+        visit(name)
+        return [ n for n in self.order if n in deps ]
+
+    def select(self, only: Optional[list[str]] = None, until: Optional[str] = None) -> list[str]:
+        '''
+        Get the names of the stages to run: just the stages in 'only', or
+        'until' and every stage it depends on, or otherwise all of them
+        '''
+        for name in (only or []) + ([until] if until else []):
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage '{name}'. Must be one of: {', '.join(self.order)}")
+        if only:
+            return [ n for n in self.order if n in only ]
+        if until:
+            return self.dependencies(until) + [until]
+        return list(self.order)
+
+    def _load_stamps(self) -> dict:
+        try:
+            with open(self.stamp_file, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_stamp(self, name: str, stamp: Optional[str]):
+        with self._lock:
+            stamps = self._load_stamps()
+            if stamp is None:
+                stamps.pop(name, None)
+            else:
+                stamps[name] = stamp
+            tmp = self.stamp_file.with_suffix('.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(stamps, f, indent=2)
+            tmp.replace(self.stamp_file)
+
+    def stamp(self, stage: Stage, results: dict) -> str:
+        '''
+        Compute the stamp for a stage: a digest of its configuration and the
+        contents of its input files
+        '''
+        inputs = {}
+        for path in stage.inputs(results):
+            path = Path(path)
+            inputs[str(path)] = file_digest(path) if path.is_file() else None
+        stamp = json.dumps({ 'config': stage.config(results), 'inputs': inputs }, sort_keys=True, default=str)
+        return hashlib.sha256(stamp.encode()).hexdigest()
+
+    def _run_stage(self, stage: Stage, stamps: dict, results: dict, force: bool) -> tuple[Any, bool]:
+        # Run a stage (or skip it). Returns its result and whether it ran.
+        stamp = self.stamp(stage, results)
+        if not force and stamps.get(stage.name) == stamp \
+                and all( Path(p).exists() for p in stage.outputs(results) ):
+            if stage.load is None:
+                return (None, False)
+            result = stage.load()
+            if result is not None and stage.complete(result):
+                return (result, False)
+
+        # The stamp is removed while the stage runs, so if it's interrupted
+        # it won't be skipped next time
+        self._save_stamp(stage.name, None)
+        with self.profiler.step(stage.name, profile=True) if self.profiler is not None else nullcontext():
+            result = stage.run(results)
+        if stage.complete(result):
+            self._save_stamp(stage.name, stamp)
+        return (result, True)
+
+    def run(self, only: Optional[list[str]] = None, until: Optional[str] = None, force: bool = False) -> dict:
+        '''
+        Run the pipeline (or the selected stages, see select), skipping any
+        stages that are up to date (unless force is True). Returns a dict of
+        the results of each stage.
+
+        If a stage raises an exception, no more stages are started, and the
+        exception is raised once the stages already running have finished.
+        '''
+        selected = self.select(only, until)
+        stamps = self._load_stamps()
+        results = {}
+
+        # Stages which aren't selected, but are needed by ones that are,
+        # have to have been run before
+        for name in self.order:
+            if name in selected or not any( name in self.stages[s].after for s in selected ):
+                continue
+            stage = self.stages[name]
+            results[name] = stage.load() if stage.load is not None else None
+            if results[name] is None and stage.load is not None:
+                raise RuntimeError(f"Stage '{name}' must be built before the '{', '.join(selected)}' stage(s)")
+
+        pending = list(selected)
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=max(1, len(selected))) as executor:
+            while pending or running:
+                # Start the stages which are ready
+                if error is None:
+                    for name in list(pending):
+                        stage = self.stages[name]
+                        if any( dep in pending or dep in running.values() for dep in stage.after ):
+                            continue
+                        pending.remove(name)
+                        deps = { dep: results.get(dep) for dep in stage.after }
+                        running[ executor.submit(self._run_stage, stage, stamps, deps, force) ] = name
+                else:
+                    pending.clear()
+
+                if not running:
+                    break
+                (done, _) = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        (results[name], ran) = future.result()
+                        self.status[name] = 'ran' if ran else 'skipped'
+                        if not ran:
+                            print(f"\033[1m[\033[94m-\033[0m\033[1m]:\033[0m Skipping '{name}' (up to date)")
+                    except BaseException as e:
+                        self.status[name] = 'failed'
+                        error = error or e
+
+        if error is not None:
+            raise error
+        return results
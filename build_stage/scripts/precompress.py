@@ -0,0 +1,126 @@
+#
+# Precompressed copies of the output files of a build.
+#
+# The browser's server sends these to web browsers which accept them (see
+# view_stage/scripts/http_cache.py), rather than compressing the files every
+# time they're sent. Each file gets a gzip-compressed copy (FILE.gz) and, if
+# the brotli module is installed, a brotli-compressed one (FILE.br), unless
+# compressing it doesn't make it much smaller.
+#
+# The files are listed in a manifest (PRECOMPRESSED, in the output directory),
+# with the digests of their contents (which the server uses as their ETags)
+# and the copies they have:
+#
+#   { "tracks/x/track.json": { "digest": "...", "encodings": [ "br", "gzip" ], "tried": [ "br", "gzip" ] } }
+#
+# Files whose contents haven't changed since they were last compressed aren't
+# compressed again.
+#
+
+import gzip
+import json
+import os
+import shutil
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from build_cache import file_digest
+
+PRECOMPRESSED = '.precompressed.json'
+
+# Suffix of the copy for each encoding, in order of preference
+ENCODING_SUFFIXES = { 'br': '.br', 'gzip': '.gz' }
+
+# Files smaller than this aren't compressed, and copies are only kept if
+# they're smaller than this fraction of the file
+MIN_SIZE = 1024
+MAX_RATIO = 0.9
+
+# Files with these suffixes are compressed already
+COMPRESSED_SUFFIXES = ( '.npz', '.gz', '.br', '.zip', '.png', '.jpg' )
+
+CHUNK_SIZE = 1024**2
+
+def available_encodings() -> list[str]:
+    '''
+    Get the encodings files can be compressed with, in order of preference
+    '''
+    return [ 'br', 'gzip' ] if brotli is not None else [ 'gzip' ]
+
+def compressed_path(path: Path, encoding: str) -> Path:
+    return Path(str(path) + ENCODING_SUFFIXES[encoding])
+
+def compress_file(path: Path, encoding: str) -> Path:
+    '''
+    Write a compressed copy of a file, a chunk at a time (so large files
+    aren't read into memory). Returns the path to the copy.
+    '''
+    dest = compressed_path(path, encoding)
+    tmp = dest.with_name(dest.name + '.tmp')
+    with open(path, 'rb') as src, open(tmp, 'wb') as out:
+        if encoding == 'gzip':
+            with gzip.GzipFile(filename='', mode='wb', fileobj=out, compresslevel=6, mtime=0) as gz:
+                shutil.copyfileobj(src, gz, CHUNK_SIZE)
+        else:
+            compressor = brotli.Compressor(quality=6)
+            while chunk := src.read(CHUNK_SIZE):
+                out.write(compressor.process(chunk))
+            out.write(compressor.finish())
+    os.replace(tmp, dest)
+    return dest
+
+def precompress(root: Path, files: list[Path]) -> dict:
+    '''
+    Make the compressed copies of the given files (in the directory root,
+    which the manifest is written to) which are out of date, and remove any
+    for files that are no longer listed. Files which don't exist are left
+    out. Returns the manifest.
+    '''
+    root = Path(root)
+    manifest_path = root.joinpath(PRECOMPRESSED)
+    try:
+        with open(manifest_path, 'r') as f:
+            old = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        old = {}
+
+    encodings = available_encodings()
+    manifest = {}
+    for path in files:
+        path = Path(path)
+        if not path.is_file() or path.suffix in COMPRESSED_SUFFIXES:
+            continue
+        name = str(path.relative_to(root))
+        digest = file_digest(path)
+        entry = old.get(name)
+        if entry is not None and entry['digest'] == digest and entry['tried'] == encodings \
+                and all( compressed_path(path, e).is_file() for e in entry['encodings'] ):
+            manifest[name] = entry
+            continue
+
+        size = path.stat().st_size
+        kept = []
+        for encoding in (encodings if size >= MIN_SIZE else []):
+            copy = compress_file(path, encoding)
+            if copy.stat().st_size < size * MAX_RATIO:
+                kept.append(encoding)
+        for encoding in ENCODING_SUFFIXES:
+            if encoding not in kept:
+                compressed_path(path, encoding).unlink(missing_ok=True)
+        manifest[name] = { 'digest': digest, 'encodings': kept, 'tried': encodings }
+
+    # Copies of files which aren't listed any more
+    for name in old:
+        if name not in manifest:
+            for encoding in ENCODING_SUFFIXES:
+                compressed_path(root.joinpath(name), encoding).unlink(missing_ok=True)
+
+    tmp = manifest_path.with_name(manifest_path.name + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, manifest_path)
+    return manifest
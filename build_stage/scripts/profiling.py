@@ -0,0 +1,221 @@
+#
+# Instrumentation for the build: wall time, CPU time and peak memory use
+# (resident set size) of each stage of the build and each step of processing
+# a dataset, and optionally cProfile dumps of them.
+#
+# Memory use is either sampled while a step runs (peak_rss), which is only the
+# step's own if nothing else is running in the process at the time (as for a
+# dataset, in a worker process of its own), or the peak for the whole process
+# and its children up to the end of the step (process_peak_rss).
+#
+# The results go into the build report, and are summarized in a table at the
+# end of the build.
+#
+
+import sys
+import time
+import cProfile
+import resource
+import threading
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Callable, Optional
+
+def _rss(usage) -> int:
+    # ru_maxrss is in kilobytes on Linux, but bytes on macOS
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+def _children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def current_rss() -> Optional[int]:
+    '''
+    Get the current resident set size (in bytes) of this process, or None if
+    it can't be read (anywhere but Linux)
+    '''
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return None
+
+class RSSSampler:
+    '''
+    Context manager sampling the resident set size of this process (every
+    interval seconds, in a thread) in a with block, recording the peak. The
+    peak is None if the resident set size can't be read.
+    '''
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = current_rss()
+        if rss is not None:
+            self.peak = max(self.peak or 0, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        if self.peak is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+        self._sample()
+
+def peak_rss() -> int:
+    '''
+    Get the peak resident set size (in bytes) of this process, or of any of
+    its child processes which have finished, whichever is larger
+    '''
+    return max(
+        _rss( resource.getrusage(resource.RUSAGE_SELF) ),
+        _rss( resource.getrusage(resource.RUSAGE_CHILDREN) )
+    )
+
+class Profiler:
+    '''
+    Records timings for named steps. If profile_dir is given, steps can also
+    be profiled with cProfile, with the stats dumped to
+    profile_dir/PREFIX.STEP.prof
+
+    cpu_clock is the clock used for CPU time: time.process_time (all the
+    threads in this process) by default, or time.thread_time when steps run
+    in threads of their own. With sample_rss, the peak memory use of each
+    step is sampled while it runs (see the top of this file), where it can
+    be.
+    '''
+    def __init__(self, profile_dir: Optional[Path] = None, prefix: str = '',
+            cpu_clock: Callable[[], float] = time.process_time, sample_rss: bool = False):
+        self.profile_dir = Path(profile_dir) if profile_dir is not None else None
+        self.prefix = prefix
+        self.cpu_clock = cpu_clock
+        self.sample_rss = sample_rss
+        self.steps = {}
+        # The steps running, as lists of the thread each is in and whether
+        # it overlapped with a step in another thread
+        self._running = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def step(self, name: str, profile: bool = False):
+        '''
+        Time the code in a with block as the named step. The CPU time of
+        child processes (e.g. LAMMPS or db_pop) which finish in the step is
+        recorded separately, since it can't be attributed to a thread. For
+        the same reason, it's None for steps which ran at the same time as a
+        step in another thread.
+        '''
+        profiler = None
+        if profile and self.profile_dir is not None:
+            profiler = cProfile.Profile()
+        sampler = RSSSampler() if self.sample_rss else nullcontext()
+
+        running = [ threading.get_ident(), False ]
+        with self._lock:
+            for other in self._running:
+                if other[0] != running[0]:
+                    other[1] = running[1] = True
+            self._running.append(running)
+
+        (wall, cpu, children) = ( time.perf_counter(), self.cpu_clock(), _children_cpu() )
+        if profiler is not None:
+            profiler.enable()
+        try:
+            with sampler:
+                yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self.profile_dir.mkdir(parents=True, exist_ok=True)
+                prefix = f"{self.prefix}." if self.prefix else ''
+                profiler.dump_stats( self.profile_dir.joinpath(f"{prefix}{name}.prof") )
+            with self._lock:
+                self._running.remove(running)
+            timing = {
+                'wall': time.perf_counter() - wall,
+                'cpu': self.cpu_clock() - cpu,
+                'children_cpu': None if running[1] else _children_cpu() - children
+            }
+            if getattr(sampler, 'peak', None) is not None:
+                timing['peak_rss'] = sampler.peak
+            else:
+                timing['process_peak_rss'] = peak_rss()
+            self.steps[name] = timing
+
+    def report(self) -> dict:
+        return dict(self.steps)
+
+def format_size(size: int) -> str:
+    for unit in ('B', 'K', 'M', 'G'):
+        if size < 1024 or unit == 'G':
+            return f"{size:.0f}{unit}" if unit == 'B' else f"{size:.1f}{unit}"
+        size /= 1024
+
+def format_table(headers: list[str], rows: list[list[str]]) -> str:
+    '''
+    Format rows of strings as a table, with the first column left-aligned
+    and the others right-aligned
+    '''
+    widths = [ max( len(str(row[i])) for row in [headers, *rows] ) for i in range(len(headers)) ]
+    def line(row):
+        return "  ".join(
+            str(cell).ljust(width) if i == 0 else str(cell).rjust(width)
+            for (i, (cell, width)) in enumerate( zip(row, widths) )
+        )
+    return "\n".join([ line(headers), line([ '-' * w for w in widths ]), *map(line, rows) ])
+
+def summary(stages: dict, datasets: list[tuple[str, dict]]) -> str:
+    '''
+    Summarize the timings of the stages of a build (a dict of stage names to
+    their status and timings) and of each dataset (a list of tuples of its
+    name and the timings of its steps) as tables
+    '''
+    def seconds(t):
+        return f"{t:.1f}s"
+
+    def cpu(timing):
+        return seconds( timing['cpu'] + (timing['children_cpu'] or 0) )
+
+    # (peaks for the whole process are marked as such)
+    def rss(timing):
+        if 'peak_rss' in timing:
+            return format_size(timing['peak_rss'])
+        return format_size(timing['process_peak_rss']) + ' (process)'
+
+    rows = []
+    for (name, stage) in stages.items():
+        timing = stage.get('timing')
+        if timing is None:
+            rows.append([ name, stage['status'], '', '', '' ])
+        else:
+            rows.append([ name, stage['status'], seconds(timing['wall']), cpu(timing), rss(timing) ])
+    tables = [ format_table([ 'Stage', 'Status', 'Wall', 'CPU', 'Peak RSS' ], rows) ]
+
+    steps = []
+    for (_, profile) in datasets:
+        steps += [ s for s in profile if s not in steps and s != 'total' ]
+    if datasets and steps:
+        rows = []
+        for (name, profile) in datasets:
+            total = profile.get('total')
+            rows.append([
+                name,
+                *[ seconds(profile[s]['wall']) if s in profile else '' for s in steps ],
+                seconds(total['wall']) if total else '',
+                rss(total) if total else ''
+            ])
+        tables.append( format_table([ 'Dataset', *steps, 'Total', 'Peak RSS' ], rows) )
+
+    return "\n\n".join(tables)
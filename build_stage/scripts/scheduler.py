@@ -0,0 +1,213 @@
+#
+# Scheduling for the jobs run by the workflow (i.e. processing Hi-C files).
+#
+# The number of jobs run at once is sized to the resources actually available
+# to us: the CPUs we may run on and the memory that's free, taking into account
+# any limits placed on the container we're running in.
+#
+# Jobs run in a pool of worker processes (see WorkerPool), which may be kept
+# running between batches of jobs, so that the cost of starting the workers
+# (and importing everything they need) is only paid once.
+#
+
+import os
+import time
+import queue
+import multiprocessing
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+def _read(path: str) -> Optional[str]:
+    try:
+        return Path(path).read_text().strip()
+    except (OSError, ValueError):
+        return None
+
+def available_cpus() -> int:
+    '''
+    Get the number of CPUs this process may use, taking into account the
+    CPU affinity mask and any cgroup (i.e. container) CPU quota
+    '''
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    # cgroup v2
+    quota = _read('/sys/fs/cgroup/cpu.max')
+    if quota is not None and not quota.startswith('max'):
+        limit, period = map(int, quota.split())
+        cpus = min(cpus, max(1, limit // period))
+
+    # cgroup v1
+    limit, period = _read('/sys/fs/cgroup/cpu/cpu.cfs_quota_us'), _read('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if limit is not None and period is not None and int(limit) > 0:
+        cpus = min(cpus, max(1, int(limit) // int(period)))
+
+    return cpus
+
+def available_memory() -> Optional[int]:
+    '''
+    Get the amount of memory (in bytes) available for new processes, taking
+    into account any cgroup (i.e. container) memory limit. Returns None if
+    this can't be determined.
+    '''
+    memory = None
+
+    meminfo = _read('/proc/meminfo')
+    if meminfo is not None:
+        for line in meminfo.splitlines():
+            if line.startswith('MemAvailable:'):
+                memory = int(line.split()[1]) * 1024
+
+    # cgroup v2, then v1
+    for (limit_file, usage_file) in [
+        ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current'),
+        ('/sys/fs/cgroup/memory/memory.limit_in_bytes', '/sys/fs/cgroup/memory/memory.usage_in_bytes')
+    ]:
+        limit, usage = _read(limit_file), _read(usage_file)
+        if limit is not None and usage is not None and limit.isdigit():
+            free = int(limit) - int(usage)
+            memory = free if memory is None else min(memory, free)
+            break
+
+    return memory
+
+def worker_count(num_jobs: int, threads_per_job: int = 1, memory_per_job: int = 0,
+        max_workers: Optional[int] = None) -> int:
+    '''
+    Decide how many jobs to run at once, given how many CPU threads and how
+    much memory (in bytes) each job will use
+    '''
+    workers = min( num_jobs, available_cpus() // threads_per_job )
+
+    memory = available_memory()
+    if memory is not None and memory_per_job > 0:
+        workers = min( workers, memory // memory_per_job )
+
+    if max_workers is not None:
+        workers = min( workers, max_workers )
+
+    return max(1, workers)
+
+def _start_worker(created: float, threads_per_job: int, preload: Optional[Callable],
+        started: multiprocessing.Queue):
+    # Runs in each worker as it starts: do any expensive setup up front (an
+    # error is left to happen again when a job needs it), then report how
+    # long the worker took to be ready, since the pool was created.
+    # OpenMP (i.e. in LAMMPS) reads OMP_NUM_THREADS once, when it's loaded,
+    # which may be by preload, so it's set first
+    os.environ['OMP_NUM_THREADS'] = str(threads_per_job)
+    if preload is not None:
+        try:
+            preload()
+        except Exception:
+            pass
+    started.put( time.time() - created )
+
+def _timed_call(job: tuple[int, Callable, tuple]) -> tuple[int, object, float]:
+    (index, func, args) = job
+    start = time.perf_counter()
+    result = func(*args)
+    return ( index, result, time.perf_counter() - start )
+
+class WorkerPool:
+    '''
+    A pool of worker processes for running jobs (see run_jobs), which can be
+    kept running between batches of jobs.
+
+    Workers are started with the 'spawn' method, so they're safe to start
+    while other threads are running. Each job may use up to threads_per_job
+    threads (given to the workers through OMP_NUM_THREADS). preload (if
+    given) is called in each worker as it starts, e.g. to import modules the
+    jobs will need.
+    '''
+
+    def __init__(self, workers: int, preload: Optional[Callable] = None, threads_per_job: int = 1):
+        context = multiprocessing.get_context('spawn')
+        self.workers = workers
+        self.threads_per_job = threads_per_job
+        self._started = context.Queue()
+        self._startup = []
+        self._pool = context.Pool( processes=workers, initializer=_start_worker,
+            initargs=(time.time(), threads_per_job, preload, self._started) )
+
+    def startup(self) -> list[float]:
+        '''
+        Get how long (in seconds) each worker that has started so far took
+        to start, from when the pool was created
+        '''
+        while True:
+            try:
+                self._startup.append( self._started.get_nowait() )
+            except queue.Empty:
+                return list(self._startup)
+
+    def run(self, func: Callable, jobs: list[tuple], workers: Optional[int] = None
+            ) -> Iterator[tuple[int, object, float]]:
+        '''
+        Call func with each tuple of arguments in jobs, running up to
+        'workers' of them (or as many as there are workers in the pool) at
+        once. Yields results as run_jobs does.
+        '''
+        workers = min( workers or self.workers, self.workers )
+        finished = queue.Queue()
+        pending = [ (i, func, args) for (i, args) in enumerate(jobs) ]
+        pending.reverse()
+
+        def submit():
+            self._pool.apply_async(_timed_call, (pending.pop(),),
+                callback=finished.put, error_callback=finished.put)
+
+        for _ in range( min(workers, len(pending)) ):
+            submit()
+        for _ in range(len(jobs)):
+            result = finished.get()
+            if isinstance(result, BaseException):
+                raise result
+            if pending:
+                submit()
+            yield result
+
+    def close(self):
+        '''
+        Stop the workers, once they've finished the jobs they're running
+        '''
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        '''
+        Stop the workers right away
+        '''
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.terminate()
+
+def run_jobs(func: Callable, jobs: list[tuple], workers: int, threads_per_job: int = 1,
+        pool: Optional[WorkerPool] = None) -> Iterator[tuple[int, object, float]]:
+    '''
+    Call func with each tuple of arguments in jobs, running up to 'workers'
+    of them in parallel. Each job may use up to threads_per_job threads
+    (given to it through OMP_NUM_THREADS).
+
+    Jobs run in the given pool of workers (which must have been started with
+    the same threads_per_job), or if there isn't one, in a pool started for
+    them (and stopped once they're done).
+
+    Yields tuples of (index of the job, its result, wall time in seconds)
+    as each job finishes. If a job raises an exception, it's raised here.
+    '''
+    if pool is not None:
+        if pool.threads_per_job != threads_per_job:
+            raise ValueError(f"Pool was started with {pool.threads_per_job} thread(s) per job, not {threads_per_job}")
+        yield from pool.run(func, jobs, workers)
+        return
+
+    with WorkerPool(workers, threads_per_job=threads_per_job) as pool:
+        yield from pool.run(func, jobs, workers)
@@ -0,0 +1,120 @@
+#
+# Spatial-index methods for finding contacts in a structure.
+#
+# Checking the distance between every pair of beads is quadratic in the number
+# of beads, which is fine at low resolutions but not for structures with tens
+# of thousands of beads. The methods here only check pairs of beads which are
+# near each other, either with a uniform grid of cells (no dependencies beyond
+# numpy) or with a KD-tree (which needs scipy).
+#
+# Beads are numbered from 1 in the returned contacts, as they are in LAMMPS
+# and in the contact sets from hic2structure. As with hic2structure's
+# (pairwise) find_contacts, beads are in contact if they're closer than the
+# threshold, i.e. beads exactly the threshold apart aren't.
+#
+
+import numpy as np
+
+# Offsets to half of the 26 cells neighboring a cell in a grid. Along with the
+# cell itself, checking these covers every pair of neighboring cells once.
+HALF_NEIGHBORHOOD = np.array([
+    (dx, dy, dz)
+    for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+    if (dx, dy, dz) > (0, 0, 0)
+], dtype=np.int64)
+
+METHODS = ('grid', 'kdtree')
+
+def contact_pairs_grid(positions: np.ndarray, threshold: float) -> np.ndarray:
+    '''
+    Find all pairs of beads closer than threshold to each other, by binning
+    them into a grid of cells with sides of length threshold. Only pairs of
+    beads in the same or neighboring cells need to be checked.
+
+    Returns an array of shape (contacts, 2) of pairs of (zero-based) indices
+    of beads, with the lower index first
+    '''
+    positions = np.asarray(positions, dtype=np.float64)
+
+    # Assign each bead a cell. Cell coordinates are shifted by one, so that
+    # neighbors of the cells on the edge of the grid still have valid ids
+    cells = np.floor( (positions - positions.min(axis=0)) / threshold ).astype(np.int64) + 1
+    dims = cells.max(axis=0) + 2
+
+    def cell_id(c):
+        return ( c[:, 0] * dims[1] + c[:, 1] ) * dims[2] + c[:, 2]
+
+    # Sort beads by cell, so the beads in each cell are contiguous
+    ids = cell_id(cells)
+    order = np.argsort(ids, kind='stable')
+    (unique_ids, starts, counts) = np.unique(ids[order], return_index=True, return_counts=True)
+
+    pairs = []
+    for offset in [ np.zeros(3, dtype=np.int64), *HALF_NEIGHBORHOOD ]:
+        # Find the neighboring cell of each bead (if it has any beads in it)
+        neighbor = cell_id(cells + offset)
+        slot = np.searchsorted(unique_ids, neighbor)
+        slot[slot == len(unique_ids)] = 0
+        occupied = unique_ids[slot] == neighbor
+
+        # Pair each bead with every bead in its neighboring cell
+        a = np.nonzero(occupied)[0]
+        n = counts[ slot[a] ]
+        a = np.repeat(a, n)
+        within = np.arange(len(a)) - np.repeat(np.cumsum(n) - n, n)
+        b = order[ np.repeat(starts[ slot[occupied] ], n) + within ]
+
+        # Pairs in the same cell would otherwise be counted twice
+        if not offset.any():
+            keep = a < b
+            a, b = a[keep], b[keep]
+
+        close = np.einsum('ij,ij->i', positions[a] - positions[b], positions[a] - positions[b]) < threshold**2
+        pairs.append( np.stack([ a[close], b[close] ], axis=1) )
+
+    pairs = np.concatenate(pairs)
+    return np.sort(pairs, axis=1)
+
+def contact_pairs_kdtree(positions: np.ndarray, threshold: float) -> np.ndarray:
+    '''
+    Find all pairs of beads closer than threshold to each other, using a
+    KD-tree. Requires scipy.
+
+    Returns an array of shape (contacts, 2) of pairs of (zero-based) indices
+    of beads, with the lower index first
+    '''
+    from scipy.spatial import cKDTree
+
+    tree = cKDTree( np.asarray(positions, dtype=np.float64) )
+    # (query_pairs includes pairs exactly r apart, so r is the largest
+    # distance below the threshold)
+    return tree.query_pairs(np.nextafter(threshold, 0), output_type='ndarray')
+
+def contact_pairs(positions: np.ndarray, threshold: float, method: str = 'grid') -> np.ndarray:
+    '''
+    Find all pairs of beads closer than threshold to each other, using the
+    given method ('grid' or 'kdtree')
+    '''
+    if method == 'grid':
+        return contact_pairs_grid(positions, threshold)
+    elif method == 'kdtree':
+        return contact_pairs_kdtree(positions, threshold)
+    else:
+        raise ValueError(f"Unknown contact method '{method}'. Must be one of: {', '.join(METHODS)}")
+
+def find_contacts(positions: np.ndarray, threshold: float, method: str = 'grid') -> set[tuple[int,int]]:
+    '''
+    Find the contacts in a structure (pairs of beads closer than threshold to
+    each other) using the given method ('grid' or 'kdtree'). Returns a set of
+    contacts in the same form as hic2structure's find_contacts.
+    '''
+    pairs = contact_pairs(positions, threshold, method) + 1
+    return set( zip( pairs[:, 0].tolist(), pairs[:, 1].tolist() ) )
+
+def jaccard(a: set, b: set) -> float:
+    '''
+    Similarity between two sets of contacts (1.0 if they're the same)
+    '''
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
@@ -0,0 +1,216 @@
+#
+# The stages of a build (see pipeline.py): what each one does, what it comes
+# after, and what its inputs, outputs and configuration are.
+#
+# The work of each stage is done by the workflow (see workflow.py), which is
+# passed in as 'wf', configured for the build. (It isn't imported here, since
+# it's usually run as a script, i.e. as __main__, and the state of the build
+# is in that module.)
+#
+
+import json
+from pathlib import Path
+from types import ModuleType
+
+import csv2tracks
+import precompress
+from build_cache import BuildCache
+from pipeline import Stage, Pipeline
+from profiling import Profiler, summary
+from sweep import sweep_grid
+
+def make_stages(wf: ModuleType, project: dict) -> list[Stage]:
+    '''
+    Get the stages of the build for a project (see pipeline.py), for the
+    build wf is configured for:
+
+      structures:  process the Hi-C files into structures, etc.
+      ensemble:    generate tracks summarizing the replicates of each
+                   dataset, if there are several (after 'structures')
+      tracks:      generate track data
+      annotations: copy annotation files, and index them
+      timeseries:  generate tracks of the changes between datasets, if the
+                   project's 'timeseries' option is on (after 'structures')
+      project:     write the project.json (after 'structures' and 'annotations')
+      database:    populate the project database (after all the others)
+      precompress: write compressed copies of the files the browser is sent
+                   (after all the others)
+      sweep:       process the datasets with every combination of the
+                   settings in the project's 'sweep', if it has one
+    '''
+    settings = wf.settings_from_project(project)
+    options = wf.options_from_project(project)
+    wf.track_format_from_project(project)
+    if 'sweep' in project:
+        sweep_grid(project['sweep'])
+    jobs = wf.make_jobs(project, wf.OUTDIR)
+    inputs = project['datasets']
+
+    def build_structures(results: dict) -> list[dict]:
+        cache = BuildCache(wf.CACHE_DIR, wf.ARGS.cache_size)
+        # When watching, datasets which haven't changed since the last
+        # build are reused, as when resuming
+        previous = wf.load_previous_outcomes(settings, options, inputs, jobs) if wf.ARGS.resume or wf.ARGS.watch else {}
+        outcomes = wf.process_datasets(settings, options, inputs, jobs, cache, previous)
+        wf.write_build_report(settings, options, inputs, jobs, outcomes)
+
+        failed = sum( 1 for outcome in outcomes if outcome['status'] != 'ok' )
+        if failed > 0:
+            report_path = wf.BUILD_REPORT.relative_to(wf.OUTDIR)
+            if failed == len(outcomes):
+                print(f"\033[1m[\033[31mX\033[0m\033[1m]:\033[0m All datasets failed! See {report_path} in the output directory for details")
+                exit(1)
+            print(f"\033[1m[\033[93m!\033[0m\033[1m]:\033[0m {failed} dataset(s) failed and will be left out of the project."
+                f" See {report_path} in the output directory for details, and build with --resume to retry them")
+        return outcomes
+
+    def load_structures() -> list[dict]:
+        # The outcomes from the last build, if any datasets succeeded
+        previous = wf.load_previous_outcomes(settings, options, inputs, jobs)
+        if len(previous) == 0:
+            return None
+        return [ previous.get(j, { 'status': 'failed', 'error': "Not built" }) for j in range(len(jobs)) ]
+
+    def dataset_results(outcomes: list[dict]) -> list[tuple[int,dict,dict]]:
+        # Only datasets that were processed successfully make it into the
+        # project. (Tracks still have a column for every dataset, or job, so
+        # a dataset's column is the same whether or not others failed.) This
+        # is a list of tuples matching ids and input datasets with the paths
+        # to their output files.
+        succeeded_jobs = [ j for (j, outcome) in enumerate(outcomes) if outcome['status'] == 'ok' ]
+        return [
+            ( id, wf.dataset_for_job(project, jobs, j), outcomes[j]['results'] )
+            for (id, j) in enumerate(succeeded_jobs)
+        ]
+
+    def build_project_json(results: dict) -> list[tuple[int,dict,dict]]:
+        # Save browser project.json
+        datasets = dataset_results(results['structures'])
+        out_project = wf.make_project_json(project, datasets)
+        with open(wf.OUTDIR.joinpath("project.json"), 'w') as f:
+            json.dump(out_project, f)
+        return datasets
+
+    def load_project_json() -> list[tuple[int,dict,dict]]:
+        outcomes = load_structures()
+        return dataset_results(outcomes) if outcomes is not None else None
+
+    def timeseries_files(results: dict) -> list[Path]:
+        # The structures and contact sets compared between datasets
+        if not wf.timeseries_tracks(project):
+            return []
+        return [
+            paths[name] for (_, _, paths) in dataset_results(results['structures'])
+            for name in ('structure', 'inputset', 'outputset')
+        ]
+
+    def annotation_index_files() -> list[Path]:
+        return [ wf.OUTDIR.joinpath(wf.ANNOTATION_INDEX) ] if wf.annotation_sources(project) else []
+
+    def result_files(results: dict) -> list[Path]:
+        # The output files for each dataset in the project
+        return [ path for (_, _, paths) in dataset_results(results['structures']) for path in paths.values() if path.is_file() ]
+
+    def ensemble_files(results: dict) -> list[Path]:
+        # The summaries of the replicates for each dataset in the project
+        return [
+            paths[name] for (_, _, paths) in dataset_results(results['structures'])
+            for name in ('variance', 'contact_frequency') if name in paths
+        ]
+
+    stages = [
+        Stage('structures', build_structures,
+            inputs=lambda results: [ wf.INDIR.joinpath(d['data']) for d in inputs ],
+            config=lambda results: {
+                'settings': settings, 'options': options,
+                'jobs': [ { **job, 'outdir': str(job['outdir']) } for job in jobs ]
+            },
+            load=load_structures,
+            complete=lambda outcomes: all( outcome['status'] == 'ok' for outcome in outcomes )
+        ),
+        Stage('ensemble', lambda results: wf.make_ensemble_tracks(project, dataset_results(results['structures'])),
+            after=['structures'],
+            inputs=ensemble_files,
+            config=lambda results: wf.tracks_config(project, wf.ensemble_tracks(project)),
+            outputs=lambda results: [ path for files in wf.ensemble_track_files(project).values() for path in files ]
+        ),
+        Stage('timeseries', lambda results: wf.make_timeseries_tracks(project, dataset_results(results['structures'])),
+            after=['structures'],
+            inputs=timeseries_files,
+            config=lambda results: wf.tracks_config(project, wf.timeseries_tracks(project)),
+            outputs=lambda results: [ path for files in wf.timeseries_track_files(project).values() for path in files ]
+        ),
+        # (after 'annotations', since bookmarks are checked against their index)
+        Stage('project', build_project_json, after=['structures', 'annotations'],
+            inputs=lambda results: result_files(results) + annotation_index_files(),
+            config=lambda results: project,
+            outputs=lambda results: [ wf.OUTDIR.joinpath('project.json') ],
+            load=load_project_json
+        ),
+        Stage('annotations', lambda results: wf.copy_annotations(project),
+            inputs=lambda results: [ src for (src, _) in wf.annotation_copies(project) ],
+            config=lambda results: project.get('annotations'),
+            outputs=lambda results: [ dest for (_, dest) in wf.annotation_copies(project) ] + annotation_index_files()
+        )
+    ]
+
+    if ('tracks' in project) and len(project['tracks']) > 0:
+        def tracks_outputs(results: dict) -> list[Path]:
+            tracks = wf.OUTDIR.joinpath('tracks')
+            return [ tracks.joinpath('array_results.json') ] + [
+                path for track in wf.project_tracks(project) for path in wf.track_files(project, track, tracks)
+            ]
+        force_tracks = wf.ARGS.only is not None and 'tracks' in wf.ARGS.only
+        stages.append( Stage('tracks', lambda results: wf.make_tracks(project, force_tracks),
+            inputs=lambda results: [ Path(f) for f in csv2tracks.needed_columns(project['tracks'], wf.INDIR) ],
+            config=lambda results: wf.tracks_config(project),
+            outputs=tracks_outputs
+        ) )
+
+    after = [ stage.name for stage in stages ]
+    stages.append( Stage('database', lambda results: wf.run_db_pop(), after=after,
+        inputs=lambda results: wf.database_files(project, results['project']),
+        outputs=lambda results: [ wf.OUTDIR.joinpath('generated-project.db') ]
+    ) )
+    stages.append( Stage('precompress', lambda results: wf.precompress_outputs(project, results['project']), after=after,
+        inputs=lambda results: wf.database_files(project, results['project']),
+        config=lambda results: precompress.available_encodings(),
+        outputs=lambda results: [ wf.OUTDIR.joinpath(precompress.PRECOMPRESSED) ]
+    ) )
+
+    # Nothing else depends on the sweep
+    stages.append( Stage('sweep', lambda results: wf.run_sweep(project),
+        inputs=lambda results: [ wf.INDIR.joinpath(d['data']) for d in inputs ] if 'sweep' in project else [],
+        config=lambda results: { 'settings': settings, 'options': options, 'sweep': project.get('sweep') },
+        outputs=lambda results: [ wf.SWEEP_DIR.joinpath('summary.tsv') ] if 'sweep' in project else []
+    ) )
+
+    return stages
+
+def report_profile(wf: ModuleType, pipeline: Pipeline, profiler: Profiler):
+    '''
+    Add the status and timings of each stage to the build report, and print
+    a summary of them (and of the timings for each dataset)
+    '''
+    stages = {
+        name: { 'status': pipeline.status.get(name, 'not run'), 'timing': profiler.steps.get(name) }
+        for name in pipeline.order
+    }
+
+    try:
+        with open(wf.BUILD_REPORT, 'r') as f:
+            report = json.load(f)
+    except FileNotFoundError:
+        report = {}
+    report['stages'] = stages
+    report['workers'] = wf.WORKER_BATCHES
+    with open(wf.BUILD_REPORT, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    # Datasets are labeled by chromosome too, if there are several
+    entries = [ d for d in report.get('datasets', []) if d.get('profile') ]
+    multiple = len(set( d['chromosome'] for d in entries )) > 1
+    datasets = [ ( d['name'] + (f" ({d['chromosome']})" if multiple else ''), d['profile'] ) for d in entries ]
+
+    print(f"\033[1m[\033[94m>\033[0m\033[1m]:\033[0m Build profile:")
+    print(summary(stages, datasets))
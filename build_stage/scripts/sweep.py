@@ -0,0 +1,70 @@
+#
+# Parameter sweeps: processing each dataset with every combination of values
+# from grids of settings given in the project, e.g.
+#
+#   sweep:
+#     count_threshold: [ 1.0, 2.0, 3.0 ]
+#     bond_coeff: [ 55, 75 ]
+#
+# The results for each combination go in a directory of their own (named for
+# the combination), and a summary table compares the contacts input to and
+# output from the simulation for each one.
+#
+
+import itertools
+from pathlib import Path
+
+# Settings which can be swept
+SWEEP_SETTINGS = ('count_threshold', 'bond_coeff', 'distance_threshold')
+
+# Columns in the summary table, after the dataset and the swept settings
+SUMMARY_COLUMNS = ('status', 'input_contacts', 'output_contacts', 'shared_contacts', 'agreement', 'elapsed', 'error')
+
+def sweep_grid(sweep: dict) -> list[dict]:
+    '''
+    Get every combination of the values in a sweep (a dict of setting names
+    to lists of values), as a list of dicts of setting names to values
+    '''
+    for (name, values) in sweep.items():
+        if name not in SWEEP_SETTINGS:
+            raise ValueError(f"Can't sweep '{name}'. Must be one of: {', '.join(SWEEP_SETTINGS)}")
+        if not isinstance(values, list) or len(values) == 0:
+            raise ValueError(f"The values to sweep '{name}' over must be a list of at least one value")
+
+    names = [ name for name in SWEEP_SETTINGS if name in sweep ]
+    return [ dict(zip(names, values)) for values in itertools.product(*[ sweep[name] for name in names ]) ]
+
+def combination_name(combination: dict) -> str:
+    '''
+    Get a name for a combination of settings (used for its directory)
+    '''
+    return "_".join( f"{name}={value}" for (name, value) in combination.items() )
+
+def simulation_settings(settings: dict) -> str:
+    '''
+    Get the settings which affect the simulation itself (i.e. all of them
+    except distance_threshold, which is only used to find contacts in the
+    structure afterwards), as a string to compare them by
+    '''
+    return repr(sorted( (k, v) for (k, v) in settings.items() if k != 'distance_threshold' ))
+
+def write_summary(path: Path, names: list[str], rows: list[dict]):
+    '''
+    Write the summary of a sweep as a tab-separated table, with a row for
+    each dataset and combination of settings (named by 'names')
+    '''
+    columns = [ 'dataset', 'chromosome', *names, *SUMMARY_COLUMNS ]
+    with open(path, 'w') as f:
+        f.write("\t".join(columns) + "\n")
+        for row in rows:
+            f.write("\t".join( format_value(row.get(column), column in names) for column in columns ) + "\n")
+
+def format_value(value, exact: bool = False) -> str:
+    # Values of the settings are written exactly as they were given, and
+    # other numbers to 4 significant figures
+    if value is None:
+        return ''
+    if isinstance(value, float) and not exact:
+        return f"{value:.4g}"
+    # Keep each row on one line
+    return " ".join(str(value).split())
@@ -0,0 +1,120 @@
+#
+# Changes between the structures of a series of datasets (e.g. timepoints).
+#
+# Each structure comes out of its simulation in a frame of its own, so before
+# they can be compared, they're rigidly aligned to a reference (the first
+# structure) with the Kabsch algorithm, all at once. Then, for each dataset
+# after the first, we find:
+#
+#   displacement      the distance each bead moved since the dataset before
+#   contacts gained   the number of contacts each bead has which it didn't
+#                     have in the dataset before
+#   contacts lost     the number of contacts each bead had in the dataset
+#                     before, but doesn't any more
+#
+# Contact sets are compared as sorted arrays of integer keys (one for each
+# pair of beads), so this is a handful of array operations however many
+# contacts there are.
+#
+
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+import columnar
+
+def kabsch_rotations(mobile: np.ndarray, reference: np.ndarray) -> np.ndarray:
+    '''
+    Find the rotations which best align each of a batch of structures (an
+    array of shape (structures, beads, 3)) to a reference (shape (beads,
+    3)). Both must be centered on the origin. Returns an array of shape
+    (structures, 3, 3): each structure is aligned by multiplying it by its
+    rotation (on the right).
+    '''
+    covariance = np.einsum('sbi,bj->sij', mobile, reference)
+    (u, _, vt) = np.linalg.svd(covariance)
+    # Correct for a reflection, where the best fit is one
+    d = np.sign( np.linalg.det(u @ vt) )
+    d[d == 0] = 1.0
+    u[:, :, -1] *= d[:, np.newaxis]
+    return u @ vt
+
+def align_structures(structures: list[np.ndarray], reference: int = 0) -> np.ndarray:
+    '''
+    Rigidly align structures (arrays of bead positions, of shape (beads, 3))
+    to the one at index reference, which is centered on the origin. Returns
+    an array of shape (structures, beads, 3) of the aligned positions.
+
+    If the structures have different numbers of beads, they're aligned on
+    the beads they all have, and positions of beads a structure doesn't have
+    are NaN.
+    '''
+    common = min( len(s) for s in structures )
+    stacked = np.full( (len(structures), max( len(s) for s in structures ), 3), np.nan )
+    for (i, positions) in enumerate(structures):
+        stacked[i, :len(positions)] = positions
+
+    centers = stacked[:, :common].mean(axis=1, keepdims=True)
+    centered = stacked - centers
+    rotations = kabsch_rotations(centered[:, :common], centered[reference, :common])
+    return centered @ rotations
+
+def displacement(aligned: np.ndarray) -> np.ndarray:
+    '''
+    Get the distance each bead moved between each pair of consecutive
+    aligned structures (see align_structures), as an array of shape
+    (structures - 1, beads)
+    '''
+    return np.linalg.norm(aligned[1:] - aligned[:-1], axis=2)
+
+def contact_keys(pairs: np.ndarray, beads: int) -> np.ndarray:
+    '''
+    Get a sorted array of unique integer keys for a set of contacts (an
+    array of pairs of bead numbers, from 1), whichever way round each pair is
+    '''
+    pairs = np.sort( np.asarray(pairs, dtype=np.int64).reshape(-1, 2), axis=1 ) - 1
+    return np.unique( pairs[:, 0] * beads + pairs[:, 1] )
+
+def bead_counts(keys: np.ndarray, beads: int) -> np.ndarray:
+    '''
+    Count the contacts (given by their keys, see contact_keys) each bead is
+    part of
+    '''
+    return ( np.bincount(keys // beads, minlength=beads) + np.bincount(keys % beads, minlength=beads) )[:beads]
+
+def contact_changes(before: np.ndarray, after: np.ndarray, beads: int) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Compare two sets of contacts (arrays of pairs of bead numbers, from 1).
+    Returns the number of contacts each bead gained and lost.
+    '''
+    (before, after) = ( contact_keys(before, beads), contact_keys(after, beads) )
+    gained = np.setdiff1d(after, before, assume_unique=True)
+    lost = np.setdiff1d(before, after, assume_unique=True)
+    return ( bead_counts(gained, beads), bead_counts(lost, beads) )
+
+def read_structure(path: Path) -> Optional[np.ndarray]:
+    '''
+    Read the positions of the beads from a structure output by the workflow
+    (either the text structure.csv or the binary structure.npy). Returns None
+    if there's no such file.
+    '''
+    path = Path(path)
+    if not path.is_file():
+        return None
+    if path.suffix == '.npy':
+        return np.array( columnar.read_structure(path), dtype=np.float64 )
+    # The positions are the last three columns, after a header
+    return np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2)[:, -3:]
+
+def read_contact_pairs(path: Path) -> np.ndarray:
+    '''
+    Read a contact set output by the workflow (either the text .tsv file or
+    the binary .npy file), as an array of pairs of bead numbers
+    '''
+    path = Path(path)
+    if path.suffix == '.npy':
+        return np.asarray( columnar.read_contact_set(path) ).reshape(-1, 2)
+    if path.stat().st_size == 0:
+        return np.empty( (0, 2), dtype=np.int64 )
+    return np.loadtxt(path, dtype=np.int64, ndmin=2).reshape(-1, 2)
@@ -0,0 +1,61 @@
+#
+# Handling of the trajectories output by LAMMPS simulations
+#
+# hic2structure hands us the whole trajectory as a dict mapping timesteps to
+# arrays of bead positions, but only the last frame is needed to make the
+# outputs. These functions let us save (some of) the trajectory to disk in a
+# compact binary form, releasing the memory for each frame as it's written.
+#
+
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+
+def final_frame(lammps_data: dict) -> np.ndarray:
+    '''
+    Get the positions from the last timestep of a trajectory
+    '''
+    return lammps_data[ max(lammps_data.keys()) ]
+
+def select_timesteps(lammps_data: dict, frames: Union[int, str]) -> list[int]:
+    '''
+    Get the (sorted) timesteps in a trajectory to keep, given the 'trajectory'
+    option from the project: either 'all', or the number of frames (counting
+    back from the last one) to keep
+    '''
+    timesteps = sorted(lammps_data.keys())
+    if frames == 'all':
+        return timesteps
+    return timesteps[ -int(frames): ]
+
+def save_trajectory(lammps_data: dict, frames: Union[int, str], positions_file: Path, timesteps_file: Path):
+    '''
+    Save frames from a trajectory into a single .npy file (positions_file) as
+    an array of float32 with the shape (frames, beads, 3). The corresponding
+    timesteps are saved in timesteps_file.
+
+    Frames are removed from lammps_data as they are written, so the memory
+    for each frame can be released as soon as possible.
+    '''
+    timesteps = select_timesteps(lammps_data, frames)
+    shape = np.shape( lammps_data[timesteps[0]] )
+
+    positions = np.lib.format.open_memmap(positions_file,
+        mode='w+', dtype=np.float32, shape=(len(timesteps), *shape)
+    )
+    for (i, timestep) in enumerate(timesteps):
+        positions[i] = lammps_data.pop(timestep)
+    positions.flush()
+    del positions
+
+    np.save(timesteps_file, np.array(timesteps, dtype=np.int64))
+
+def load_trajectory(positions_file: Path, timesteps_file: Path) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Load a trajectory saved with save_trajectory. The positions are memory-mapped,
+    rather than read into memory all at once.
+
+    Returns a tuple of the timesteps and the positions
+    '''
+    return ( np.load(timesteps_file), np.load(positions_file, mmap_mode='r') )
@@ -0,0 +1,82 @@
+#
+# Watching a directory for changes, to rebuild whatever's made from it (see
+# the --watch option of workflow.py).
+#
+# The directory is polled: a snapshot of the size and modification time of
+# each file in it is taken every so often, and compared with the last one.
+# Once the files have stopped changing (e.g. a large file being copied in),
+# the build is run again.
+#
+
+import os
+import time
+from pathlib import Path
+from typing import Callable, Iterable
+
+# How often (in seconds) to check the directory for changes
+WATCH_INTERVAL = 1.0
+
+def snapshot(directory: Path, exclude: Iterable[Path] = ()) -> dict[str, tuple[int, int]]:
+    '''
+    Get the size and modification time of each file in a directory, keyed on
+    their paths relative to it. Hidden files and directories (such as the
+    .build directory a build's output usually goes in) are left out, as are
+    the (resolved) directories in exclude.
+    '''
+    exclude = set(exclude)
+    files = {}
+    for (root, dirs, names) in os.walk(directory):
+        dirs[:] = [
+            d for d in dirs
+            if not d.startswith('.') and Path(root, d).resolve() not in exclude
+        ]
+        for name in names:
+            if name.startswith('.'):
+                continue
+            path = Path(root, name)
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # removed since the directory was listed
+                continue
+            files[str(path.relative_to(directory))] = ( stat.st_size, stat.st_mtime_ns )
+    return files
+
+def changed_files(before: dict, after: dict) -> list[str]:
+    '''
+    Get the files which were added, removed or modified between two
+    snapshots of a directory (see snapshot)
+    '''
+    return sorted( name for name in before.keys() | after.keys() if before.get(name) != after.get(name) )
+
+def watch(directory: Path, build: Callable[[], bool], exclude: Iterable[Path] = (),
+        interval: float = WATCH_INTERVAL):
+    '''
+    Call build, then keep watching the directory (leaving out the directories
+    in exclude, see snapshot), calling it again whenever anything in it
+    changes (until interrupted). build returns whether it succeeded.
+    '''
+    exclude = list(exclude)
+    last = snapshot(directory, exclude)
+    build()
+    print(f"\033[1m[\033[94m>\033[0m\033[1m]:\033[0m Watching {directory} for changes. Press [Ctrl-C] to stop")
+    while True:
+        time.sleep(interval)
+        current = snapshot(directory, exclude)
+        if current == last:
+            continue
+
+        # Wait for the files to stop changing (e.g. a .hic file being copied in)
+        while True:
+            time.sleep(interval)
+            latest = snapshot(directory, exclude)
+            if latest == current:
+                break
+            current = latest
+
+        changed = changed_files(last, current)
+        last = current
+        print(f"\033[1m[\033[94m>\033[0m\033[1m]:\033[0m Changed: {', '.join(changed)}")
+        start = time.perf_counter()
+        if build():
+            print(f"\033[1m[\033[32m✓\033[0m\033[1m]:\033[0m Rebuilt in {time.perf_counter() - start:.1f}s")
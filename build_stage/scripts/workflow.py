@@ -7,31 +7,61 @@
 # in the format the 4DGB Browser expects.
 #
 # Usage:
-#   ./workflow.py INPUT_DIR OUTPUT_DIR [PATH_TO_BROWSER_REPO]
+#   ./workflow.py [OPTIONS] INPUT_DIR OUTPUT_DIR [PATH_TO_BROWSER_REPO]
 #
 #   (if 'db_pop' is in the PATH, then the last argument is not needed)
+#   (run with '--help' for a description of the options)
+#
+# It can also be imported as a module, which does nothing until it's
+# configured with the same arguments:
+#
+#   import workflow
+#   workflow.configure([ 'INPUT_DIR', 'OUTPUT_DIR', '--keep-going' ])
+#   workflow.build()
+#
+# hic2structure (which is slow to import) is only imported once it's needed,
+# so the worker processes datasets are processed in start quickly.
 #
 
-from asyncio.subprocess import STDOUT
 import sys
 import os
 import copy
+import argparse
 import json
+import hashlib
 import shlex
 import subprocess
-import multiprocessing
 import tempfile
 import shutil
+import traceback
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache, partial
 from pathlib import Path
-
-import yaml
-from yaml import Loader
-
-from hic2structure.types import Settings
-from hic2structure.hic import HIC
-from hic2structure.lammps import run_lammps
-from hic2structure.contacts import find_contacts, contact_records_to_set
-from hic2structure.out import write_contact_records, write_structure, write_contact_set
+from typing import Optional
+
+from types import SimpleNamespace
+
+import numpy as np
+
+from build_cache import BuildCache, parse_size, file_digest
+from scheduler import worker_count, run_jobs, WorkerPool
+from trajectory import final_frame, save_trajectory
+import spatial
+import columnar
+import csv2tracks
+from pipeline import Pipeline
+import stages
+import watcher
+from profiling import Profiler, format_table
+from ensemble import Ensemble, bead_contacts, read_contact_frequency
+import timeseries
+import precompress
+from hic_contacts import CONTACT_FILES, extract_contacts, save_contacts, read_contacts, filter_contacts, arrays_to_records
+from sweep import sweep_grid, combination_name, simulation_settings, write_summary
+from contact_tiles import TILE_SIZE, TILE_FILES, save_tiles
+from annotation_index import build_index, AnnotationIndex
 
 ####################################
 #
@@ -42,8 +72,9 @@ from hic2structure.out import write_contact_records, write_structure, write_cont
 # Path to template for output project.json
 TEMPLATE_FILE = Path(__file__).parents[0].joinpath('project_template.json')
 
-with open(TEMPLATE_FILE, 'r') as f:
-    BROWSER_PROJECT_TEMPLATE: dict = json.load(f)
+# Settings for processing a Hi-C file, as passed to hic2structure (a
+# hic2structure.types.Settings, which isn't imported until it's needed)
+Settings = dict
 
 # Default values for input project specification
 DEFAULT_PROJECT = {
@@ -55,38 +86,192 @@ DEFAULT_PROJECT = {
         'distance_threshold': 3.3,
         'blackout': [],
         'timesteps': 1000000,
-        'bond_coeff': 55
+        'bond_coeff': 55,
+        'trajectory': False,
+        'contact_method': 'pairwise',
+        'output_format': 'text',
+        'replicates': 1,
+        'blackout_contacts': False,
+        'track_format': 'npz',
+        'contact_map_tiles': False,
+        'timeseries': False
     },
     'datasets': [],
     'tracks': []
 }
 
-# Parse arguments
-if len(sys.argv) < 3:
-    print("Usage: ./workflow.py INPUT_DIR OUTPUT_DIR [PATH_TO_BROWSER_REPO]")
-    exit(1)
+# Stages of the build (see make_stages)
+STAGES = [ 'structures', 'ensemble', 'timeseries', 'tracks', 'annotations', 'project', 'database', 'precompress', 'sweep' ]
+
+# Structures with more beads than this don't get a mean distance matrix
+# from their replicates, since it's quadratic in the number of beads
+MAX_DISTANCE_MATRIX_BEADS = 20000
+
+####################################
+#
+#    CONFIGURATION
+#
+###################################
+
+# Names the project file may have, in order of preference
+PROJECT_FILENAMES = ['workflow.yaml', 'project.yaml', 'workflow.yml', 'project.yml']
+
+def make_parser() -> argparse.ArgumentParser:
+    '''
+    Get the parser for the workflow's command-line arguments
+    '''
+    parser = argparse.ArgumentParser(
+        description="Build a 4DGB Browser project from an input project directory"
+    )
+    parser.add_argument("indir", metavar="INPUT_DIR", help="Input project directory")
+    parser.add_argument("outdir", metavar="OUTPUT_DIR", help="Directory to write the output project to")
+    parser.add_argument(
+        "browser_dir", metavar="PATH_TO_BROWSER_REPO", nargs='?', default=None,
+        help="Path to the 4DGB Browser repository (not needed if 'db_pop' is in the PATH)"
+    )
+    parser.add_argument(
+        "--cache-dir", metavar="DIR", default=None,
+        help="Directory for the cache of Hi-C processing results. This may be shared between"
+            " projects. (Default: OUTPUT_DIR/.cache)"
+    )
+    parser.add_argument(
+        "--cache-size", metavar="SIZE", default="20G", type=parse_size,
+        help="Maximum size of the cache. The least-recently-used results are removed"
+            " when it grows larger than this. (Default: 20G)"
+    )
+    parser.add_argument(
+        "--jobs", metavar="N", default=None, type=int,
+        help="Maximum number of datasets (or replicates of them) to process at once. (Default:"
+            " as many as the available CPUs and memory allow)"
+    )
+    parser.add_argument(
+        "--threads-per-job", metavar="N", default=1, type=int,
+        help="Number of threads to give each LAMMPS simulation. (Default: 1)"
+    )
+    parser.add_argument(
+        "--memory-per-job", metavar="SIZE", default="2G", type=parse_size,
+        help="Amount of memory to reserve for each dataset being processed. Fewer datasets"
+            " are processed at once if there isn't enough memory available. (Default: 2G)"
+    )
+    parser.add_argument(
+        "--keep-going", action="store_true", default=False,
+        help="Don't stop if processing a dataset fails. The project is built from the datasets"
+            " that succeeded, and the failures are recorded in the build report"
+    )
+    parser.add_argument(
+        "--profile", action="store_true", default=False,
+        help="Profile each stage of the build and each dataset with cProfile, saving the stats"
+            " in OUTPUT_DIR/profile"
+    )
+    parser.add_argument(
+        "--only", metavar="STAGES", default=None, type=lambda s: s.split(','),
+        help="Only run these stages of the build (a comma-separated list of: " + ", ".join(STAGES) + "),"
+            " even if they're up to date. The stages they depend on must have been built before"
+    )
+    parser.add_argument(
+        "--until", metavar="STAGE", default=None, choices=STAGES,
+        help="Only run the build up to (and including) this stage, and the stages it depends on"
+    )
+    parser.add_argument(
+        "--resume", action="store_true", default=False,
+        help="Only process the datasets that failed (or weren't processed) in the previous"
+            " build, according to its build report. Implies --keep-going"
+    )
+    parser.add_argument(
+        "--persistent-workers", action="store_true", default=False,
+        help="Keep the worker processes datasets are processed in running for as long as"
+            " this process is, rather than starting them for each batch of datasets. They're"
+            " reused for the sweep, and for any builds after this one (i.e. when the workflow"
+            " is imported as a module)"
+    )
+    parser.add_argument(
+        "--watch", action="store_true", default=False,
+        help="After building, keep running and watch the input directory, rebuilding whatever"
+            " is affected by each change (e.g. only the project.json for a bookmark, only the"
+            " changed tracks for a tracks file, only the changed datasets for a .hic file)."
+            " Implies --persistent-workers"
+    )
+    return parser
+
+# The build being run, as set by configure(). None of these are set when the
+# module is imported, so importing it is cheap (and has no side-effects).
+ARGV: Optional[list[str]] = None
+ARGS: Optional[argparse.Namespace] = None
 
 # Input/Output directories
-[ INDIR, OUTDIR ] = map(
-    lambda dir: Path(dir).resolve(),
-    sys.argv[1:3]
-)
-if len(sys.argv) > 3:
-    BROWSER_DIR = Path(sys.argv[3])
-else:
-    BROWSER_DIR = None
-
-# Find project input file
-filenames = ['workflow.yaml', 'project.yaml', 'workflow.yml', 'project.yml']
-search = [ INDIR.joinpath(f) for f in filenames ]
-# Find and load file
-try:
-    INPUT_FILE = next( f for f in search if f.is_file() )
-except StopIteration:
-    print("Could not find project file. Please make sure your project directory has one of these files:")
-    for file in filenames:
-        print(f"  - {file}")
-    exit(1)
+INDIR: Optional[Path] = None
+OUTDIR: Optional[Path] = None
+BROWSER_DIR: Optional[Path] = None
+
+# Cache directory
+CACHE_DIR: Optional[Path] = None
+
+# Machine-readable report on the outcome of the build
+BUILD_REPORT: Optional[Path] = None
+
+# Directory for cProfile stats (if profiling)
+PROFILE_DIR: Optional[Path] = None
+
+# Record of the inputs to each stage of the build, when it last ran (and to
+# each track, when it was last written)
+STAGES_FILE: Optional[Path] = None
+TRACK_STAMPS: Optional[Path] = None
+
+# Directory (in the output directory) for the results of a sweep
+SWEEP_DIR: Optional[Path] = None
+
+# The project input file
+INPUT_FILE: Optional[Path] = None
+
+# Updated after each build in watch mode, to tell the browser to reload the
+# project (see view_stage/scripts/entrypoint.sh)
+RELOAD_FILE: Optional[Path] = None
+
+def find_project_file(indir: Path) -> Path:
+    '''
+    Find the project file in an input project directory. Raises a
+    FileNotFoundError if there isn't one.
+    '''
+    for name in PROJECT_FILENAMES:
+        if indir.joinpath(name).is_file():
+            return indir.joinpath(name)
+    raise FileNotFoundError(f"No project file in {indir}")
+
+def configure(argv: Optional[list[str]] = None):
+    '''
+    Set up the build from the given command-line arguments (or sys.argv):
+    parse them, and find the input and output files. This must be called
+    before anything else in the module that runs (part of) a build. Raises
+    a FileNotFoundError if the input directory has no project file.
+    '''
+    global ARGV, ARGS, INDIR, OUTDIR, BROWSER_DIR, CACHE_DIR, BUILD_REPORT, PROFILE_DIR, STAGES_FILE, \
+        TRACK_STAMPS, SWEEP_DIR, INPUT_FILE, RELOAD_FILE
+
+    argv = list(sys.argv[1:] if argv is None else argv)
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.resume:
+        args.keep_going = True
+    if args.watch:
+        args.persistent_workers = True
+    for stage in (args.only or []):
+        if stage not in STAGES:
+            parser.error(f"Unknown stage '{stage}'. Must be one of: {', '.join(STAGES)}")
+
+    [ INDIR, OUTDIR ] = map(
+        lambda dir: Path(dir).resolve(),
+        [ args.indir, args.outdir ]
+    )
+    BROWSER_DIR = Path(args.browser_dir) if args.browser_dir is not None else None
+    CACHE_DIR = Path(args.cache_dir).resolve() if args.cache_dir is not None else OUTDIR.joinpath('.cache')
+    BUILD_REPORT = OUTDIR.joinpath('build_report.json')
+    PROFILE_DIR = OUTDIR.joinpath('profile') if args.profile else None
+    STAGES_FILE = OUTDIR.joinpath('.stages.json')
+    TRACK_STAMPS = OUTDIR.joinpath('.track_stamps.json')
+    SWEEP_DIR = OUTDIR.joinpath('sweep')
+    INPUT_FILE = find_project_file(INDIR)
+    RELOAD_FILE = OUTDIR.joinpath('.reload')
+    (ARGV, ARGS) = (argv, args)
 
 ####################################
 #
@@ -94,6 +279,35 @@ except StopIteration:
 #
 ###################################
 
+@lru_cache(maxsize=None)
+def h2s() -> SimpleNamespace:
+    '''
+    Import the parts of hic2structure the workflow uses. Importing it (and
+    the LAMMPS bindings) is slow, so this is only done the first time
+    they're needed, or as a worker process starts (see workers_for).
+    '''
+    from hic2structure.hic import HIC
+    from hic2structure.lammps import run_lammps
+    from hic2structure.contacts import find_contacts, contact_records_to_set
+    from hic2structure.out import write_contact_records, write_structure, write_contact_set
+    return SimpleNamespace(
+        HIC=HIC,
+        run_lammps=run_lammps,
+        find_contacts=find_contacts,
+        contact_records_to_set=contact_records_to_set,
+        write_contact_records=write_contact_records,
+        write_structure=write_structure,
+        write_contact_set=write_contact_set
+    )
+
+@lru_cache(maxsize=None)
+def browser_project_template() -> dict:
+    '''
+    Load the template for the output project.json (don't modify it!)
+    '''
+    with open(TEMPLATE_FILE, 'r') as f:
+        return json.load(f)
+
 def deep_update(a: dict, b: dict) -> dict:
     '''
     Recrusive update on two dicts. The first argument (a) is modified
@@ -116,8 +330,9 @@ def load_project_spec() -> dict:
     Load the project.yaml or workflow.yaml (either filename is acceptable)
     for the input project
     '''
+    import yaml
     with open(INPUT_FILE, 'r') as f:
-        project_input = yaml.load(f, Loader=Loader)
+        project_input = yaml.load(f, Loader=yaml.Loader)
     
     # Resolve default settings
     return deep_update(
@@ -136,20 +351,328 @@ def settings_from_project(project_spec: dict) -> Settings:
         'timesteps':  project['timesteps']
     }
 
+def options_from_project(project_spec: dict) -> dict:
+    '''
+    Get the options from the project which affect the output of processing
+    a Hi-C file, but which aren't settings passed to hic2structure
+    '''
+    project: dict = project_spec['project']
+
+    methods = ('pairwise', *spatial.METHODS)
+    if project['contact_method'] not in methods:
+        raise ValueError(f"Unknown contact_method '{project['contact_method']}'. Must be one of: {', '.join(methods)}")
+
+    formats = ('text', 'binary', 'both')
+    if project['output_format'] not in formats:
+        raise ValueError(f"Unknown output_format '{project['output_format']}'. Must be one of: {', '.join(formats)}")
+
+    # (bools are ints too, but e.g. 'true' isn't a number of replicates or
+    # frames)
+    replicates = project['replicates']
+    if isinstance(replicates, bool) or not isinstance(replicates, int) or replicates < 1:
+        raise ValueError(f"replicates must be a whole number, at least 1 (not '{replicates}')")
+
+    trajectory = project['trajectory']
+    if trajectory is not False and trajectory != 'all' and (
+            isinstance(trajectory, bool) or not isinstance(trajectory, int) or trajectory < 1):
+        raise ValueError(f"trajectory must be false, 'all' or a whole number of frames, at least 1 (not '{trajectory}')")
+
+    options = {
+        'trajectory': trajectory,
+        'contact_method': project['contact_method'],
+        'output_format': project['output_format']
+    }
+    # Only included if they're not the default, so that results from before
+    # these were options are still found in the cache
+    if replicates > 1:
+        options['replicates'] = replicates
+    # The blacked-out segments are only an option (rather than just for
+    # display) if contacts with them are removed
+    if project['blackout_contacts']:
+        options['blackout'] = project['blackout']
+    if project['contact_map_tiles']:
+        options['contact_map_tiles'] = True
+    return options
+
+def track_format_from_project(project_spec: dict) -> str:
+    '''
+    Get the format track data is written in (see csv2tracks.py)
+    '''
+    format = project_spec['project']['track_format']
+    if format not in csv2tracks.TRACK_FORMATS:
+        raise ValueError(f"Unknown track_format '{format}'. Must be one of: {', '.join(csv2tracks.TRACK_FORMATS)}")
+    return format
+
+def hic_chromosomes(input: Path) -> list[str]:
+    '''
+    Get the names of the chromosomes in a Hi-C file
+    '''
+    import hicstraw
+    return [
+        chrom.name for chrom in hicstraw.HiCFile(str(input)).getChromosomes()
+        if chrom.name.lower() != 'all'
+    ]
+
+def project_chromosomes(project_spec: dict) -> list:
+    '''
+    Get the list of chromosomes to process for the project. The 'chromosome'
+    setting may be the name of a single chromosome, a list of them, or 'all'
+    (meaning every chromosome found in all of the datasets' Hi-C files)
+    '''
+    spec = project_spec['project']['chromosome']
+
+    if spec == 'all':
+        chromosomes = None
+        for dataset in project_spec['datasets']:
+            found = hic_chromosomes( INDIR.joinpath(dataset['data']) )
+            chromosomes = found if chromosomes is None else [ c for c in chromosomes if c in found ]
+        return chromosomes or []
+    elif isinstance(spec, list):
+        return spec
+    else:
+        return [ spec ]
+
+def multiple_chromosomes(project_spec: dict) -> bool:
+    '''
+    Whether the project is for multiple chromosomes (rather than one)
+    '''
+    spec = project_spec['project']['chromosome']
+    return isinstance(spec, list) or spec == 'all'
+
+def make_jobs(project_spec: dict, outdir: Path) -> list[dict]:
+    '''
+    Split the processing of the project's datasets into jobs, one for each
+    pair of dataset and chromosome. Each job is a dict with the index of its
+    'dataset', its 'chromosome', a 'label' to refer to it by, and the 'outdir'
+    its results go in.
+
+    If the project is for a single chromosome, results go in 'lammps_{i}'
+    for each dataset. Otherwise, they go in 'lammps_{i}/{chromosome}'.
+    '''
+    chromosomes = project_chromosomes(project_spec)
+    single = not multiple_chromosomes(project_spec)
+
+    jobs = []
+    for (i, dataset) in enumerate(project_spec['datasets']):
+        for chrom in chromosomes:
+            jobs.append({
+                'dataset': i,
+                'chromosome': chrom,
+                'label': dataset['name'] if single else f"{dataset['name']} ({chrom})",
+                'outdir': outdir.joinpath(f'lammps_{i}') if single else outdir.joinpath(f'lammps_{i}', str(chrom))
+            })
+    return jobs
+
 ########################
 # Hi-C Processing
 ########################
 
-def process_hic(settings: Settings, input: Path, outdir: Path):
+# Results for each dataset that go into the project database
+DATABASE_RESULTS = ('structure', 'contactmap', 'inputset', 'outputset')
+
+# Output files from processing a Hi-C file which may not be present
+OPTIONAL_RESULTS = ('log', 'trajectory', 'timesteps', 'mean_distance')
+
+def result_paths(outdir: Path, output_format: str = 'text', replicates: int = 1, tiles: bool = False) -> dict:
+    '''
+    Get a dict of Paths to the output files from processing a Hi-C file into
+    the given output directory. The structure, contact map and contact sets
+    are either 'text' or 'binary' files (see columnar.py) depending on the
+    output_format. If it's 'both', the binary files are included as
+    'structure_binary', etc.
+
+    If there are several replicates, the structures from all of them and the
+    summaries of them (see ensemble.py) are included too. If tiles is True,
+    so are the files of the tiled contact map (see contact_tiles.py).
     '''
-    Process a Hi-C file. The run is
-    performed in a temporary directory, with the results being copied to
-    the provided output directory. If the output directory has a later
-    last-modified time than the input file, it won't be run, though a
-    change in the settings can override that.
+    def outfile(name):
+        return (outdir/name).resolve()
+
+    text = {
+        'structure':  outfile('structure.csv'),
+        'contactmap': outfile('contactmap.tsv'),
+        'inputset':   outfile('inputset.tsv'),
+        'outputset':  outfile('outputset.tsv'),
+    }
+    binary = {
+        'structure':  outfile('structure.npy'),
+        'contactmap': outfile('contactmap.npz'),
+        'inputset':   outfile('inputset.npy'),
+        'outputset':  outfile('outputset.npy'),
+    }
+
+    results = {
+        'settings':   outfile('settings.json'),
+        'metadata':   outfile('metadata.json'),
+        **( binary if output_format == 'binary' else text )
+    }
+    if output_format == 'both':
+        results.update({ f"{name}_binary": path for (name, path) in binary.items() })
+    if replicates > 1:
+        results.update({
+            'replicates':        outfile('replicates.npy'),
+            'variance':          outfile('variance.npy'),
+            'contact_frequency': outfile('contact_frequency.npz'),
+            'mean_distance':     outfile('mean_distance.npy'),
+        })
+    if tiles:
+        results.update({ name.removesuffix('.npy'): outfile(name) for name in TILE_FILES })
+
+    return {
+        **results,
+        'log':        outfile('sim.log'),
+        'trajectory': outfile('trajectory.npy'),
+        'timesteps':  outfile('trajectory_timesteps.npy'),
+    }
+
+@lru_cache(maxsize=4)
+def open_hic(input: Path):
+    '''
+    Open a Hi-C file (as a hic2structure HIC). Files are kept open, so a
+    worker processing several chromosomes from the same file only reads its
+    header and index once.
+    '''
+    return h2s().HIC(input)
+
+def cached_contacts(cache: BuildCache, input: Path, settings: Settings) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Get all the contact records from a Hi-C file for the chromosome and
+    resolution in the settings, as arrays of bins and counts (see
+    hic_contacts.py). They're extracted from the file the first time, and
+    kept in the build cache (and memory-mapped from there) after that.
+    '''
+    key = cache.key(input, { 'contacts': { 'chromosome': settings['chromosome'], 'resolution': settings['resolution'] } })
+    with cache.lock(key):
+        paths = cache.entry_files(key, CONTACT_FILES)
+        if paths is not None:
+            return read_contacts(paths[0].parent)
+
+        (bins, counts) = extract_contacts(open_hic(input), settings)
+        with tempfile.TemporaryDirectory() as tmp:
+            cache.store(key, save_contacts(Path(tmp), bins, counts),
+                input=input.name, chromosome=settings['chromosome'], resolution=settings['resolution']
+            )
+        return (bins, counts)
+
+def results_key(cache: BuildCache, input: Path, settings: Settings, options: dict) -> str:
+    '''
+    Get the cache key for the results of processing a Hi-C file
+    '''
+    return cache.key(input, { 'settings': settings, 'options': options })
+
+def results_up_to_date(outdir: Path, results: dict, key: str) -> bool:
+    '''
+    Check whether an output directory holds the results (as given by
+    result_paths) for the given cache key. The key is saved alongside the
+    results, last, so it's only there if all the results were written.
+    '''
+    try:
+        return outdir.joinpath('.cache_key').read_text() == key and \
+            all( file.exists() for (name, file) in results.items() if name not in OPTIONAL_RESULTS )
+    except FileNotFoundError:
+        return False
+
+def find_output_contacts(positions: np.ndarray, settings: Settings, options: dict) -> set:
+    '''
+    Find the contacts in a structure, with the project's contact_method
+    '''
+    if options['contact_method'] == 'pairwise':
+        return h2s().find_contacts(positions, settings)
+    return spatial.find_contacts(positions, settings['distance_threshold'], options['contact_method'])
+
+def replicate_file(outdir: Path, replicate: int) -> Path:
+    '''
+    Get the file a replicate's final frame and contacts are saved in, when
+    it's simulated ahead of process_hic (see simulate_replicate)
+    '''
+    return outdir.joinpath(f".replicate.{replicate}.npz")
+
+def read_replicate(outdir: Path, replicate: int, key: str) -> Optional[tuple[np.ndarray, set]]:
+    '''
+    Read the final frame and contacts of a replicate simulated ahead of
+    process_hic, if it was simulated for the results with the given key
+    '''
+    try:
+        with np.load(replicate_file(outdir, replicate)) as saved:
+            if str(saved['key']) != key:
+                return None
+            return ( saved['positions'], set(map(tuple, saved['contacts'].tolist())) )
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+
+def save_replicate(outdir: Path, replicate: int, key: str, positions: np.ndarray, contacts: set):
+    '''
+    Save the final frame and contacts of a replicate, for process_hic to
+    pick up (see read_replicate)
+    '''
+    path = replicate_file(outdir, replicate)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as f:
+        np.savez(f, key=np.array(key), positions=positions, contacts=columnar.contact_set_to_array(contacts))
+    os.replace(tmp, path)
+
+def simulate_replicate(settings: Settings, options: dict, input: Path, outdir: Path, cache: BuildCache,
+        replicate: int) -> Optional[str]:
+    '''
+    Run the simulation for one of the replicates of a dataset (other than
+    the first), saving its final frame and contacts for process_hic to pick
+    up. This runs as a job of its own in a worker process (see
+    process_datasets), so a dataset's replicates run in parallel. Nothing is
+    done if process_hic won't need it, i.e. its results are up to date or
+    in the cache.
+
+    Returns an error message if the simulation fails, otherwise None.
+    '''
+    try:
+        key = results_key(cache, input, settings, options)
+        results = result_paths(outdir, options['output_format'], options['replicates'], options.get('contact_map_tiles', False))
+        if results_up_to_date(outdir, results, key) or cache.entry_files(key, []) is not None:
+            return None
+
+        (bins, counts) = filter_contacts( *cached_contacts(cache, input, settings),
+            settings['count_threshold'], settings['resolution'],
+            options.get('blackout')
+        )
+        input_set = h2s().contact_records_to_set(arrays_to_records(bins, counts))
+        outdir.mkdir(parents=True, exist_ok=True)
+        lammps_data = h2s().run_lammps(input_set, { **settings, 'seed': replicate },
+            copy_log_to=outdir.joinpath(f"sim.{replicate}.log"))
+        positions = final_frame(lammps_data)
+        del lammps_data
+        save_replicate(outdir, replicate, key, positions, find_output_contacts(positions, settings, options))
+        return None
+    except Exception as e:
+        return str(e) or type(e).__name__
+
+def process_hic(settings: Settings, options: dict, input: Path, outdir: Path, cache: BuildCache,
+        simulations: dict = None, profiler: Profiler = None):
+    '''
+    Process a Hi-C file, with the results being written to the provided
+    output directory. Results are looked up in the build cache (by the
+    contents of the input file and the settings) first, so LAMMPS is only
+    run if this exact input has never been processed before. If the output
+    directory already holds the results for this input, nothing is done.
+
+    If the options ask for several replicates, that many simulations are run
+    from the same contacts, with different seeds. The first is used for the
+    outputs, and all of them are summarized (see ensemble.py). Replicates
+    which were already simulated as jobs of their own (see
+    simulate_replicate) are picked up from there; any others are run here,
+    one after another.
+
+    The contact records are read from the build cache if they've been
+    extracted from the file before (see cached_contacts).
+
+    When processing the same file with several settings (see run_sweep),
+    final frames of simulations are saved in the 'simulations' dict, if
+    given, so that settings which differ only in their distance_threshold
+    reuse them.
+
+    Each step of the processing is timed with the profiler, if given.
 
     Returns a dict of Paths to the various output files
     '''
+    profiler = profiler or Profiler()
 
     # Create path for an output file
     def outfile(name):
@@ -159,101 +682,462 @@ def process_hic(settings: Settings, input: Path, outdir: Path):
     def info(message):
         print(f"  \033[1m[\033[94m!\033[0m\033[1m {input.name}]:\033[0m {message}")
 
+    # Print warning for current processing run
+    def warn(message):
+        print(f"  \033[1m[\033[93m!\033[0m\033[1m {input.name}]:\033[0m {message}")
+
     # Print error for current processing run
     def error(message):
         print(f"  \033[1m[\033[31mX\033[0m\033[1m {input.name}]:\033[0m {message}")
 
     # Result/output files
-    results = {
-        'settings':   outfile('settings.json'),
-        'structure':  outfile('structure.csv'),
-        'contactmap': outfile('contactmap.tsv'),
-        'inputset':   outfile('inputset.tsv'),
-        'outputset':  outfile('outputset.tsv'),
-        'log':        outfile('sim.log'),
-    }
+    replicates = options.get('replicates', 1)
+    results = result_paths(outdir, options['output_format'], replicates, options.get('contact_map_tiles', False))
 
     # Process a single Hi-C file
     def run():
         outdir.mkdir(parents=True, exist_ok=True)
 
         # Read Hi-C and run LAMMPS
-        hic = HIC(input)
-        input_records = hic.get_contact_records(settings)
-        input_set = contact_records_to_set(input_records)
-        lammps_data = run_lammps(input_set, settings, copy_log_to=results['log'])
-        last_timestep = lammps_data[ sorted(lammps_data.keys())[-1] ]
-        output_set = find_contacts(last_timestep, settings)
+        with profiler.step('read_hic'):
+            (bins, counts) = filter_contacts( *cached_contacts(cache, input, settings),
+                settings['count_threshold'], settings['resolution'],
+                options.get('blackout')
+            )
+            input_records = arrays_to_records(bins, counts)
+        with profiler.step('contact_set'):
+            input_set = h2s().contact_records_to_set(input_records)
+        reusable = simulations is not None and replicates == 1 and not options['trajectory']
+        if reusable and simulation_settings(settings) in simulations:
+            last_timestep = simulations[ simulation_settings(settings) ]
+            with profiler.step('find_contacts'):
+                output_set = output_contacts(last_timestep)
+        elif replicates == 1:
+            with profiler.step('lammps'):
+                lammps_data = h2s().run_lammps(input_set, settings, copy_log_to=results['log'])
+                last_timestep = final_frame(lammps_data)
+            if options['trajectory']:
+                with profiler.step('trajectory'):
+                    save_trajectory(lammps_data, options['trajectory'], results['trajectory'], results['timesteps'])
+            # Only the last frame is needed from here on, so let go of the rest
+            # of the trajectory
+            del lammps_data
+            if reusable:
+                simulations[ simulation_settings(settings) ] = last_timestep
+            with profiler.step('find_contacts'):
+                output_set = output_contacts(last_timestep)
+        else:
+            with profiler.step('replicates'):
+                (last_timestep, output_set) = run_replicates(input_set)
 
-        # Save output data
-        write_structure(results['structure'], last_timestep)
-        write_contact_records(results['contactmap'], input_records)
-        write_contact_set(results['inputset'], input_set)
-        write_contact_set(results['outputset'], output_set)
-        pass
+        with profiler.step('write'):
+            write_outputs(input_records, (bins, counts), input_set, last_timestep, output_set)
 
-    # Load the settings used for the last run (if there are any)
-    try:
-        with open(results['settings'], 'r') as f:
-            previous_settings = json.load(f)
-    except:
-        previous_settings = None
-
-    # The run is considered "out-of-date" and needs to be run again
-    # if the input was modified more recently, or if the settings
-    # have changed
-    out_of_date = (not outdir.exists()) or \
-       ( os.path.getmtime(input) > os.path.getmtime(outdir) ) or \
-       ( settings != previous_settings )
-
-    if out_of_date:
-        try:
-            info("Processing Hi-C file...")
-            outdir.mkdir(parents=False, exist_ok=True)
+    def output_contacts(positions):
+        return find_output_contacts(positions, settings, options)
+
+    # Run the simulation for one replicate, returning its final frame and
+    # the contacts in it. The first replicate keeps the settings as they
+    # are, so its outputs are the same as with no replicates at all.
+    def simulate(replicate: int, input_set: set):
+        if replicate == 0:
+            (seeded, log) = (settings, results['log'])
+        else:
+            (seeded, log) = ({ **settings, 'seed': replicate }, outfile(f"sim.{replicate}.log"))
+        lammps_data = h2s().run_lammps(input_set, seeded, copy_log_to=log)
+        last_timestep = final_frame(lammps_data)
+        if replicate == 0 and options['trajectory']:
+            save_trajectory(lammps_data, options['trajectory'], results['trajectory'], results['timesteps'])
+        del lammps_data
+        return ( last_timestep, output_contacts(last_timestep) )
+
+    # Run the first replicate, and summarize it with the others (in order,
+    # so the summaries don't depend on which finished first). Returns the
+    # first replicate's final frame and contacts.
+    def run_replicates(input_set):
+        info(f"Running {replicates} replicates...")
+        identical = []
+        for r in range(replicates):
+            (positions, contacts) = ( read_replicate(outdir, r, key) if r > 0 else None ) or simulate(r, input_set)
+            if r == 0:
+                first = (positions, contacts)
+                beads = len(positions)
+                ensemble = Ensemble(results['mean_distance'] if beads <= MAX_DISTANCE_MATRIX_BEADS else None)
+                structures = np.lib.format.open_memmap(results['replicates'],
+                    mode='w+', dtype=np.float32, shape=(replicates, beads, 3)
+                )
+            elif np.array_equal(positions, first[0]):
+                identical.append(r)
+            ensemble.add(positions, contacts)
+            structures[r] = positions
+
+        structures.flush()
+        del structures
+        ensemble.save(results['variance'], results['contact_frequency'])
+        for r in range(1, replicates):
+            replicate_file(outdir, r).unlink(missing_ok=True)
+        if beads > MAX_DISTANCE_MATRIX_BEADS:
+            info(f"Not saving the mean distance matrix of the replicates (more than {MAX_DISTANCE_MATRIX_BEADS} beads)")
+        # Replicates only differ by their 'seed' setting, which hic2structure
+        # may not use
+        if identical:
+            warn(f"{len(identical)} of the replicates came out identical to the first, so they don't show any"
+                " variation. This version of hic2structure may not use the 'seed' setting")
+        return first
+
+    def write_outputs(input_records, input_arrays, input_set, last_timestep, output_set):
+        # Save output data
+        if options['output_format'] != 'binary':
+            files = result_paths(outdir, 'text')
+            h2s().write_structure(files['structure'], last_timestep)
+            h2s().write_contact_records(files['contactmap'], input_records)
+            h2s().write_contact_set(files['inputset'], input_set)
+            h2s().write_contact_set(files['outputset'], output_set)
+        if options['output_format'] != 'text':
+            files = result_paths(outdir, 'binary')
+            columnar.write_structure(files['structure'], last_timestep)
+            columnar.write_contact_arrays(files['contactmap'], *input_arrays)
+            columnar.write_contact_set(files['inputset'], input_set)
+            columnar.write_contact_set(files['outputset'], output_set)
+        if options.get('contact_map_tiles'):
+            levels = save_tiles([ results[name.removesuffix('.npy')] for name in TILE_FILES ],
+                *input_arrays, settings['resolution'])
+
+        # Save metadata about the outputs, so that nothing needs to read
+        # them back in just to find out how big they are
+        metadata = {
+            'num_segments': len(last_timestep),
+            'num_records':  len(input_records),
+            'num_input_contacts':  len(input_set),
+            'num_output_contacts': len(output_set),
+            # How well the structure reproduces the contacts it was made from
+            'num_shared_contacts': len(input_set & output_set),
+            'contact_agreement': spatial.jaccard(input_set, output_set)
+        }
+        if options.get('contact_map_tiles'):
+            metadata['contact_map_tiles'] = { 'tile_size': TILE_SIZE, 'levels': levels }
+        with open(results['metadata'], 'w') as f:
+            json.dump(metadata, f)
+
+        # Save settings that were used
+        with open(results['settings'], 'w') as f:
+            json.dump(settings, f)
+
+    # The cache key for this run is saved alongside the results, so we can
+    # tell whether the output directory is already up-to-date (see
+    # results_up_to_date)
+    key = results_key(cache, input, settings, options)
+    key_file = outfile('.cache_key')
+    if results_up_to_date(outdir, results, key):
+        return results
+
+    # Hold the lock for this key while we work, so that another process
+    # wanting the same results waits for them instead of running LAMMPS too
+    with cache.lock(key):
+        outdir.mkdir(parents=True, exist_ok=True)
 
-            # Remove any previous output files
-            for file in results.values():
-                file.unlink(missing_ok=True)
+        # Remove any previous output files
+        key_file.unlink(missing_ok=True)
+        for file in results.values():
+            file.unlink(missing_ok=True)
 
+        with profiler.step('cache_fetch'):
+            fetched = cache.fetch(key, outdir)
+        if fetched:
+            info("Using cached results")
+        else:
             try:
-                run()
+                info("Processing Hi-C file...")
+
+                try:
+                    run()
+                except Exception as e:
+                    log_path = results['log'].relative_to(OUTDIR)
+                    error(f"Error running LAMMPS! A log may be available in the output directory in {log_path}")
+                    raise e
+
+                cache.store(key,
+                    [ file for file in results.values() if file.exists() ],
+                    input=input.name, settings=settings
+                )
+
             except Exception as e:
-                log_path = results['log'].relative_to(OUTDIR)
-                error(f"Error running LAMMPS! A log may be available in the output directory in {log_path}")
+                error(f"An error occured processing the Hi-C file: {e}")
                 raise e
 
-            # Save settings that were used
-            with open(results['settings'], 'w') as f:
-                json.dump(settings, f)
+        key_file.write_text(key)
 
-            # Update last-modified time on output directory
-            outdir.touch(exist_ok=True)
+    return results
 
-        except Exception as e:
-            error(f"An error occured processing the Hi-C file: {e}")
-            # If an error occured, we delete the settings file so that
-            # the next run will always be attempted
-            results['settings'].unlink(missing_ok=True)
-            raise e
+def try_process_hic(*args, **kwargs) -> tuple[dict, dict, dict]:
+    '''
+    Call process_hic with the given arguments, catching any error so that one
+    failing dataset doesn't bring down the others being processed with it.
 
-    return results
+    Returns a tuple of the results from process_hic, a dict describing the
+    error (either of which is None) and the timings of each step. Each call
+    is a job of its own in a worker process, so memory use is sampled while
+    it runs (see profiling.py).
+    '''
+    outdir = args[3]
+    profiler = Profiler(PROFILE_DIR, prefix=str(outdir.relative_to(OUTDIR)).replace('/', '_'), sample_rss=True)
+    try:
+        with profiler.step('total', profile=True):
+            results = process_hic(*args, **kwargs, profiler=profiler)
+        return ( results, None, profiler.report() )
+    except Exception as e:
+        return ( None, {
+            'error': str(e) or type(e).__name__,
+            'traceback': traceback.format_exc()
+        }, profiler.report() )
+
+# The pool of workers kept running between batches of jobs (with
+# --persistent-workers), and how many batches are using it. Stages run in
+# threads, so this is only changed with WORKERS_LOCK held.
+PERSISTENT_WORKERS: Optional[WorkerPool] = None
+PERSISTENT_WORKERS_USERS = 0
+WORKERS_LOCK = threading.Lock()
+
+# The batches of jobs run in this build, with how long the workers for each
+# took to start (for the build report)
+WORKER_BATCHES: list[dict] = []
+
+def in_worker(argv: list[str], func, *args):
+    '''
+    Call func with the given arguments in a worker process, configuring the
+    worker for the build with the given arguments first (if it isn't
+    already, i.e. it was started for an earlier build)
+    '''
+    if argv != ARGV:
+        configure(argv)
+    return func(*args)
+
+@contextmanager
+def workers_for(workers: int):
+    '''
+    Context manager giving a pool of workers to run a batch of jobs in, and
+    whether it was already running (for an earlier or concurrent batch). With
+    --persistent-workers, it's the pool kept running between batches (which
+    is started, or restarted with more workers if it has fewer than asked for
+    and no other batch is using it). Otherwise, it's a new pool, which is
+    stopped afterwards. Workers import hic2structure as they start.
+    '''
+    global PERSISTENT_WORKERS, PERSISTENT_WORKERS_USERS
+    if not ARGS.persistent_workers:
+        with WorkerPool(workers, preload=h2s, threads_per_job=ARGS.threads_per_job) as pool:
+            yield (pool, False)
+        return
+
+    with WORKERS_LOCK:
+        if PERSISTENT_WORKERS is not None and PERSISTENT_WORKERS.workers < workers and PERSISTENT_WORKERS_USERS == 0:
+            PERSISTENT_WORKERS.close()
+            PERSISTENT_WORKERS = None
+        running = PERSISTENT_WORKERS is not None
+        if not running:
+            PERSISTENT_WORKERS = WorkerPool(workers, preload=h2s, threads_per_job=ARGS.threads_per_job)
+        PERSISTENT_WORKERS_USERS += 1
+        pool = PERSISTENT_WORKERS
+    try:
+        yield (pool, running)
+    finally:
+        with WORKERS_LOCK:
+            PERSISTENT_WORKERS_USERS -= 1
 
-def process_datasets(settings: Settings, inputs: list[dict], outdir: Path) -> list[dict]:
+def stop_workers(terminate: bool = False):
+    '''
+    Stop the pool of workers kept running between batches of jobs, if any,
+    once they've finished their jobs (or right away, if terminate is True)
+    '''
+    global PERSISTENT_WORKERS
+    with WORKERS_LOCK:
+        if PERSISTENT_WORKERS is not None:
+            if terminate:
+                PERSISTENT_WORKERS.terminate()
+            else:
+                PERSISTENT_WORKERS.close()
+            PERSISTENT_WORKERS = None
+
+def run_in_workers(func, jobs: list[tuple], workers: int):
     '''
-    Process the given datasets from the project. Datasets are processed in
-    parallel.
+    Run func with each of the tuples of arguments in jobs in worker
+    processes, up to 'workers' at once (see run_jobs, which this yields the
+    results of), in a pool from workers_for.
 
-    Returns a dict with the paths to the output files for each input dataset.
+    How long the workers took to start (or that they were already running)
+    is printed, and recorded in WORKER_BATCHES for the build report.
+    '''
+    with workers_for(workers) as (pool, reused):
+        try:
+            yield from run_jobs(partial(in_worker, ARGV, func), jobs, workers, ARGS.threads_per_job, pool=pool)
+        finally:
+            if reused:
+                batch = { 'workers': pool.workers, 'reused': True }
+                print(f"  \033[1m[\033[94m-\033[0m\033[1m Workers]:\033[0m Reused {pool.workers} running worker(s)")
+            else:
+                startup = pool.startup()
+                batch = { 'workers': len(startup), 'reused': False, 'startup': startup }
+                if startup:
+                    print(f"  \033[1m[\033[94m-\033[0m\033[1m Workers]:\033[0m Started {len(startup)} worker(s)"
+                        f" in {max(startup):.2f}s ({sum(startup) / len(startup):.2f}s each on average)")
+            WORKER_BATCHES.append(batch)
+
+def process_datasets(settings: Settings, options: dict, inputs: list[dict], jobs: list[dict],
+        cache: BuildCache, previous: dict = None) -> list[dict]:
     '''
+    Process the given datasets from the project, split into jobs (see
+    make_jobs). Jobs are run in parallel, with as many at once as the
+    available CPUs and memory allow. If there are several replicates for
+    each job, the replicates after the first are run first, as jobs of
+    their own (see simulate_replicate); a job whose replicates fail fails
+    too.
+
+    'previous' may map the indices of jobs to their outcomes from an
+    earlier build, in which case they are reused rather than run again.
+
+    Returns a list with the outcome of each job. Each is a dict with its
+    'status' ('ok' or 'failed'), and either the paths to its output files
+    ('results') or the reason it failed ('error'). Unless --keep-going was
+    given, the first failure is raised as an exception.
+    '''
+    previous = previous or {}
+    outcomes = [ previous.get(j) for j in range(len(jobs)) ]
+    todo = [ j for (j, outcome) in enumerate(outcomes) if outcome is None ]
+
+    # Each replicate is a simulation of its own, so it counts as a job when
+    # deciding how many to run at once
+    replicates = options.get('replicates', 1)
+    slots = worker_count( len(todo) * replicates,
+        threads_per_job=ARGS.threads_per_job,
+        memory_per_job=ARGS.memory_per_job,
+        max_workers=ARGS.jobs
+    )
+    workers = min( max(1, len(todo)), slots )
+
+    def job_args(j):
+        return (
+            { **settings, 'chromosome': jobs[j]['chromosome'] },
+            options,
+            INDIR.joinpath( inputs[ jobs[j]['dataset'] ]['data'] ),
+            jobs[j]['outdir'],
+            cache
+        )
+
+    def fail(j, error, elapsed, profile = None):
+        label = jobs[j]['label']
+        minutes, seconds = divmod(round(elapsed), 60)
+        print(f"  \033[1m[\033[31mX\033[0m\033[1m {label}]:\033[0m Failed after {minutes}m{seconds:02d}s")
+        outcomes[j] = { 'status': 'failed', **error, 'elapsed': elapsed, 'profile': profile }
+        if not ARGS.keep_going:
+            write_build_report(settings, options, inputs, jobs, outcomes)
+            raise RuntimeError(f"Processing dataset '{label}' failed: {error['error']}")
+
+    # The replicates after the first (the LAMMPS bindings run in-process, so
+    # they can't share a worker)
+    replicate_jobs = [ (j, r) for j in todo for r in range(1, replicates) ]
+    if replicate_jobs:
+        print(f"\033[1m[\033[94m>\033[0m\033[1m]:\033[0m Running {len(replicate_jobs)} replicate(s),"
+            f" {min(slots, len(replicate_jobs))} at a time...")
+        replicate_time = {}
+        for (k, error, seconds) in run_in_workers(simulate_replicate,
+                [ (*job_args(j), r) for (j, r) in replicate_jobs ], min(slots, len(replicate_jobs))):
+            (j, r) = replicate_jobs[k]
+            replicate_time[j] = replicate_time.get(j, 0.0) + seconds
+            if error is not None and outcomes[j] is None:
+                fail(j, { 'error': f"Replicate {r} failed: {error}" }, replicate_time[j])
+        todo = [ j for j in todo if outcomes[j] is None ]
+
+    input_args = [ job_args(j) for j in todo ]
+
+    print(f"\033[1m[\033[94m>\033[0m\033[1m]:\033[0m Processing {len(input_args)} dataset(s), {workers} at a time...")
+
+    for (k, (results, error, profile), elapsed) in run_in_workers(try_process_hic, input_args, workers):
+        j = todo[k]
+        label = jobs[j]['label']
+        minutes, seconds = divmod(round(elapsed), 60)
+
+        if error is None:
+            print(f"  \033[1m[\033[32m✓\033[0m\033[1m {label}]:\033[0m Done in {minutes}m{seconds:02d}s")
+            outcomes[j] = { 'status': 'ok', 'results': results, 'elapsed': elapsed, 'profile': profile }
+        else:
+            fail(j, error, elapsed, profile)
 
-    with multiprocessing.Pool(processes=4) as pool:
-        input_args = [
-            ( settings, INDIR.joinpath(dataset['data']), outdir.joinpath(f'lammps_{i}') ) 
-            for i,dataset in enumerate(inputs) 
-        ]
-        results = pool.starmap(process_hic, input_args)
+    return outcomes
 
-    return results
+########################
+# BUILD REPORT
+########################
+
+def write_build_report(settings: Settings, options: dict, inputs: list[dict], jobs: list[dict], outcomes: list[dict]):
+    '''
+    Write the build report, recording which datasets were processed
+    successfully and why any others failed
+    '''
+    datasets = []
+    for (j, (job, outcome)) in enumerate( zip(jobs, outcomes) ):
+        dataset = inputs[ job['dataset'] ]
+        entry = {
+            'id': j,
+            'dataset': job['dataset'],
+            'name': dataset['name'],
+            'data': dataset['data'],
+            'chromosome': job['chromosome'],
+            'outdir': str( job['outdir'].relative_to(OUTDIR) ),
+            'status': 'skipped' if outcome is None else outcome['status']
+        }
+        if outcome is not None:
+            entry.update({ k: v for (k, v) in outcome.items() if k in ('elapsed', 'profile', 'error', 'traceback') })
+        # What the input was, so that changes to it can be noticed
+        input = INDIR.joinpath(dataset['data'])
+        if input.is_file():
+            entry['digest'] = file_digest(input)
+        datasets.append(entry)
+
+    failed = sum( 1 for d in datasets if d['status'] != 'ok' )
+    report = {
+        'status': 'ok' if failed == 0 else ( 'failed' if failed == len(datasets) else 'partial' ),
+        'settings': settings,
+        'options': options,
+        'datasets': datasets
+    }
+    with open(BUILD_REPORT, 'w') as f:
+        json.dump(report, f, indent=2)
+
+def load_previous_outcomes(settings: Settings, options: dict, inputs: list[dict], jobs: list[dict]) -> dict:
+    '''
+    Get the outcomes of the jobs which succeeded in the previous build
+    (according to its build report), as a dict keyed on their indices.
+    Jobs which have changed (or were run with different settings) since
+    then are left out.
+    '''
+    try:
+        with open(BUILD_REPORT, 'r') as f:
+            report = json.load(f)
+    except FileNotFoundError:
+        return {}
+
+    if report['settings'] != settings or report.get('options') != options:
+        return {}
+
+    previous = {}
+    for entry in report['datasets']:
+        j = entry['id']
+        if entry['status'] != 'ok' or j >= len(jobs):
+            continue
+        job = jobs[j]
+        dataset = inputs[ job['dataset'] ]
+        current = ( dataset['name'], dataset['data'], job['chromosome'], str(job['outdir'].relative_to(OUTDIR)) )
+        if current != ( entry['name'], entry['data'], entry.get('chromosome'), entry['outdir'] ):
+            continue
+        # (reports from before digests were recorded only go by the name)
+        input = INDIR.joinpath(dataset['data'])
+        if 'digest' in entry and ( not input.is_file() or file_digest(input) != entry['digest'] ):
+            continue
+        results = result_paths( job['outdir'], options['output_format'], options.get('replicates', 1),
+            options.get('contact_map_tiles', False) )
+        if not results['structure'].exists():
+            continue
+        previous[j] = { 'status': 'ok', 'results': results, 'elapsed': entry.get('elapsed', 0), 'profile': entry.get('profile', {}) }
+    return previous
 
 ########################
 # PROJECT.JSON GENERATION
@@ -264,26 +1148,36 @@ def contact_map_entry(project: dict, result: tuple[int,dict,dict]) -> dict:
     Create an entry for the project.json's 'md-contact-map' array for the given
     the result (represented as a tuple of id, input dataset and output paths)
     '''
-    return {
+    entry = {
         'id': result[0],
         'version': "1.0",
         'url': str( result[2]['contactmap'].relative_to(OUTDIR) ),
         'interval': project['project']['resolution']
     }
 
+    # The levels of the tiled contact map were saved in the metadata when
+    # it was made
+    if 'tiles_index' in result[2]:
+        with open(result[2]['metadata'], 'r') as f:
+            tiles = json.load(f)['contact_map_tiles']
+        entry['tiles'] = {
+            **tiles,
+            **{ name: str( result[2][f"tiles_{name}"].relative_to(OUTDIR) ) for name in ('offsets', 'counts', 'index') }
+        }
+
+    return entry
+
 def structure_entry(project: dict, result: tuple[int,dict,dict]) -> dict:
     '''
     Create an entry for the project.json's 'structure' array for the given
     the result (represented as a tuple of id, input dataset and output paths)
     '''
-    # We need to know the number of segments in the structure, which we can
-    # get by counting the lines of the output csv file
-    wc = subprocess.run(['wc', '--lines', result[2]['structure']],
-        capture_output=True, check=True, text=True
-    )
-    num_segments = int(wc.stdout.split()[0]) - 1
+    # We need to know the number of segments in the structure, which was
+    # saved in the metadata when it was made
+    with open(result[2]['metadata'], 'r') as f:
+        num_segments = json.load(f)['num_segments']
 
-    return {
+    entry = {
         'id': result[0],
         'type': {
             'version': "1.0",
@@ -296,6 +1190,26 @@ def structure_entry(project: dict, result: tuple[int,dict,dict]) -> dict:
         'interval': project['project']['resolution']
     }
 
+    # Projects with multiple chromosomes have a structure for each one
+    if 'chromosome' in result[1]:
+        entry['chromosome'] = result[1]['chromosome']
+
+    return entry
+
+def dataset_for_job(project: dict, jobs: list[dict], j: int) -> dict:
+    '''
+    Get the input dataset for a job (the j'th of the given jobs), as it should
+    appear in the output project. This includes the index of the column in
+    each track with the data for it: the dataset's, or with several
+    chromosomes, the job's (see project_tracks).
+    '''
+    job = jobs[j]
+    dataset = { **project['datasets'][ job['dataset'] ], 'name': job['label'], 'track_column': job['dataset'] }
+    if multiple_chromosomes(project):
+        dataset['chromosome'] = job['chromosome']
+        dataset['track_column'] = j
+    return dataset
+
 def dataset_entry(project: dict, result: tuple[int,dict,dict]) -> dict:
     '''
     Create an entry for the project.json's 'dataset' array for the given
@@ -311,17 +1225,18 @@ def dataset_entry(project: dict, result: tuple[int,dict,dict]) -> dict:
             'output_set': str( result[2]['outputset'].relative_to(OUTDIR) ),
             'settings': str( result[2]['settings'].relative_to(OUTDIR) )
         },
-        'epigenetics': result[0]
+        'epigenetics': result[1]['track_column']
     }
 
-def track_data_entries(tracks: list[dict]) -> list:
+def track_data_entries(tracks: list[dict], start: int = 0, directory: str = 'tracks') -> list:
     '''
     Create an entry for the project.json's 'array' field for the given
-    track data from the input project.
+    track data from the input project (or the tracks summarizing
+    replicates, which are in a different directory). Ids start from 'start'.
     '''
     return [{
-        'id': i,
-        'url': f"tracks/{track['name']}/track.json"
+        'id': start + i,
+        'url': f"{directory}/{track['name']}/track.json"
     }
     for i,track in enumerate(tracks)]
 
@@ -342,14 +1257,17 @@ def make_project_json(project: dict, results: list[tuple[int,dict,dict]]) -> dic
     Create a dict for the project.json for the output project, given the input
     project and a list of results from the Hi-C processing
     '''
-    out_project = copy.deepcopy(BROWSER_PROJECT_TEMPLATE)
+    out_project = copy.deepcopy(browser_project_template())
 
     out_project['project']['name'] = project['project']['name']
     out_project['project']['interval'] = project['project']['resolution']
 
-    if ('tracks' in project) and len(project['tracks']) > 0:
-        out_project['data']['array'] = track_data_entries(project['tracks'])
-    
+    arrays = track_data_entries(project.get('tracks', []))
+    arrays += track_data_entries(ensemble_tracks(project), start=len(arrays), directory=ENSEMBLE_TRACKS_DIR)
+    arrays += track_data_entries(timeseries_tracks(project), start=len(arrays), directory=TIMESERIES_TRACKS_DIR)
+    if len(arrays) > 0:
+        out_project['data']['array'] = arrays
+
     if ('annotations' in project):
         annotations = project['annotations']
         if ('genes' in annotations):
@@ -370,7 +1288,7 @@ def make_project_json(project: dict, results: list[tuple[int,dict,dict]]) -> dic
             controls['location']['favorites'] = [ f"{l[0]}-{l[1]}" for l in locs ]
         # Genes
         if ('features' in bookmarks):
-            controls['gene']['favorites'] = bookmarks['features']
+            controls['gene']['favorites'] = known_features( bookmarks['features'] )
 
     return out_project
 
@@ -378,27 +1296,497 @@ def make_project_json(project: dict, results: list[tuple[int,dict,dict]]) -> dic
 # TRACK DATA
 ########################
 
-def make_tracks():
+def project_tracks(project: dict) -> list[dict]:
     '''
-    Call csv2tracks to generate track data for the project
+    Get the project's tracks as they're written for the browser. A dataset's
+    column in a track is the one its structure is colored by, so with several
+    chromosomes, where each dataset has a structure for each chromosome,
+    tracks have a column for each job (see make_jobs, dataset_for_job). Each
+    track has values for the chromosome named by its 'chromosome' field, and
+    its columns for other chromosomes are empty.
     '''
-    csv2tracks = Path(__file__).parents[0].joinpath('csv2tracks')
-    run = subprocess.run([
-        csv2tracks,
-        '--workflow', INPUT_FILE,
-        '--destination', OUTDIR.joinpath('tracks'),
-        '--relative', OUTDIR,
-        '--verbose'
-    ],
-        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    tracks = project.get('tracks', [])
+    if not multiple_chromosomes(project):
+        return tracks
+
+    jobs = make_jobs(project, OUTDIR)
+    chromosomes = { job['chromosome'] for job in jobs }
+    expanded = []
+    for track in tracks:
+        if track.get('chromosome') not in chromosomes:
+            raise ValueError(f"Track '{track['name']}' must name the chromosome it's for (one of:"
+                f" {', '.join(map(str, chromosomes))}), since the project has several")
+        columns = [
+            track['columns'][ job['dataset'] ] if job['chromosome'] == track['chromosome'] else {}
+            for job in jobs
+        ]
+        expanded.append({ **track, 'columns': columns })
+    return expanded
+
+def track_files(project: dict, track: dict, directory: Path) -> list[Path]:
+    '''
+    Get the files (metadata and data) of a track written to the given directory
+    '''
+    names = [ 'track.json', *csv2tracks.track_data_files(track, track_format_from_project(project)) ]
+    return [ directory.joinpath(track['name'], name) for name in names ]
+
+def tracks_config(project: dict, tracks: Optional[list[dict]] = None):
+    '''
+    Get the configuration of a stage generating the given tracks (or the
+    project's tracks), for deciding whether it needs to run again
+    '''
+    tracks = project_tracks(project) if tracks is None else tracks
+    format = track_format_from_project(project)
+    # The format is only included if it's not the default, so that tracks
+    # from before it was an option aren't regenerated
+    if format == DEFAULT_PROJECT['project']['track_format']:
+        return tracks
+    return { 'tracks': tracks, 'track_format': format }
+
+def track_stamp(project: dict, track: dict) -> str:
+    '''
+    Get a digest of a track's definition, its format and the contents of the
+    csv files it's made from, for deciding whether it needs to be written again
+    '''
+    files = csv2tracks.needed_columns([ track ], INDIR)
+    stamp = {
+        'track': track,
+        'format': track_format_from_project(project),
+        'inputs': { str(f): file_digest(Path(f)) if Path(f).is_file() else None for f in files }
+    }
+    return hashlib.sha256( json.dumps(stamp, sort_keys=True).encode() ).hexdigest()
+
+def save_track_stamps(stamps: dict):
+    tmp = TRACK_STAMPS.with_suffix('.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(stamps, f, indent=2)
+    tmp.replace(TRACK_STAMPS)
+
+def make_tracks(project: dict, force: bool = False) -> list[dict]:
+    '''
+    Generate track data for the project with csv2tracks. Returns the metadata
+    for each track.
+
+    Only the tracks which have changed since they were last written (see
+    track_stamp) are written again, unless force is True.
+    '''
+    tracks = project_tracks(project)
+    directory = OUTDIR.joinpath('tracks')
+    stamps = { track['name']: track_stamp(project, track) for track in tracks }
+    try:
+        with open(TRACK_STAMPS, 'r') as f:
+            previous = json.load(f)
+    except (FileNotFoundError, ValueError):
+        previous = {}
+    skip = [] if force else [
+        track['name'] for track in tracks
+        if previous.get(track['name']) == stamps[track['name']]
+            and all( path.exists() for path in track_files(project, track, directory) )
+    ]
+
+    print(f"\033[1m[\033[94m>\033[0m\033[1m]:\033[0m Generating {len(tracks) - len(skip)} track(s)"
+        + (f" ({len(skip)} up to date)..." if skip else "..."))
+    start = time.perf_counter()
+
+    # Until they're written, the changed tracks have no stamps, so if this is
+    # interrupted they're written next time
+    save_track_stamps({ name: stamps[name] for name in skip })
+
+    # This runs in a thread alongside the processing of the datasets, so
+    # tracks are written by threads rather than forked processes
+    metadata = csv2tracks.make_tracks(tracks, INDIR, directory,
+        relative=OUTDIR,
+        jobs=worker_count(max(1, len(tracks) - len(skip)), max_workers=ARGS.jobs),
+        format=track_format_from_project(project),
+        threads=True,
+        skip=skip
     )
+    save_track_stamps(stamps)
 
+    (minutes, seconds) = divmod( int(time.perf_counter() - start), 60 )
+    print(f"  \033[1m[\033[32m✓\033[0m\033[1m Tracks]:\033[0m Done in {minutes}m{seconds:02d}s")
+    return metadata
+
+########################
+# ENSEMBLE TRACKS
+########################
+
+# Tracks summarizing the replicates for each dataset (see ensemble.py)
+#   positional_variance: the variance in the position of each bead
+#   contact_frequency:   the mean number of contacts each bead has in a replicate
+ENSEMBLE_TRACKS = ('positional_variance', 'contact_frequency')
+
+# Directory (relative to the output directory) the tracks are written to
+ENSEMBLE_TRACKS_DIR = 'ensemble/tracks'
+
+def ensemble_tracks(project: dict) -> list[dict]:
+    '''
+    Get the tracks summarizing the replicates (in the same form as the
+    project's 'tracks'), with a column for each dataset. There are none
+    unless the project has several replicates, and only for projects with a
+    single chromosome (since a track holds one value for each bead).
+    '''
+    if project['project']['replicates'] == 1 or multiple_chromosomes(project):
+        return []
+    return [
+        {
+            'name': name,
+            'file': 'ensemble.csv',
+            'columns': [ { 'name': f"{name}_{i}" } for i in range(len(project['datasets'])) ]
+        }
+        for name in ENSEMBLE_TRACKS
+    ]
+
+def ensemble_track_files(project: dict) -> dict[str, list[Path]]:
+    '''
+    Get the files for each of the tracks summarizing the replicates
+    '''
+    return {
+        track['name']: track_files(project, track, OUTDIR.joinpath(ENSEMBLE_TRACKS_DIR))
+        for track in ensemble_tracks(project)
+    }
+
+def make_ensemble_tracks(project: dict, datasets: list[tuple[int,dict,dict]]) -> list[dict]:
+    '''
+    Generate the tracks summarizing the replicates of each dataset (given as
+    tuples of id, input dataset and output paths). Returns the metadata for
+    each track.
+    '''
+    tracks = ensemble_tracks(project)
+    if len(tracks) == 0:
+        if project['project']['replicates'] > 1:
+            print(f"\033[1m[\033[93m!\033[0m\033[1m]:\033[0m Tracks summarizing the replicates are only made for projects"
+                " with a single chromosome")
+        return []
+
+    print(f"\033[1m[\033[94m>\033[0m\033[1m]:\033[0m Generating tracks summarizing the replicates...")
+
+    # One column for each track and dataset (datasets that failed are left
+    # empty), and one row for each bead
+    columns = {}
+    for (_, dataset, paths) in datasets:
+        variance = np.load(paths['variance'])
+        (pairs, frequency) = read_contact_frequency(paths['contact_frequency'])
+        i = dataset['track_column']
+        columns[f"positional_variance_{i}"] = variance
+        columns[f"contact_frequency_{i}"] = bead_contacts(pairs, frequency, len(variance))
+
+    names = [ column['name'] for track in tracks for column in track['columns'] ]
+    rows = max( [ len(values) for values in columns.values() ], default=0 )
+    table = np.full( (rows, len(names)), np.nan )
+    for (c, name) in enumerate(names):
+        if name in columns:
+            table[ :len(columns[name]), c ] = columns[name]
+
+    basedir = OUTDIR.joinpath(ENSEMBLE_TRACKS_DIR).parent
+    basedir.mkdir(parents=True, exist_ok=True)
+    np.savetxt(basedir.joinpath('ensemble.csv'), table, delimiter=',', header=','.join(names), comments='', fmt='%.9g')
+
+    return csv2tracks.make_tracks(tracks, basedir, Path(ENSEMBLE_TRACKS_DIR).name, relative=OUTDIR,
+        format=track_format_from_project(project))
+
+########################
+# TIME SERIES TRACKS
+########################
+
+# Tracks of the changes between each dataset and the one before (see
+# timeseries.py)
+#   displacement:          the distance each bead moved, once the structures
+#                          are aligned
+#   contacts_gained/lost:  the number of contacts in the structure each bead
+#                          gained or lost
+#   input_contacts_gained/lost: the same, for the contacts from the Hi-C data
+TIMESERIES_TRACKS = ('displacement', 'contacts_gained', 'contacts_lost', 'input_contacts_gained', 'input_contacts_lost')
+
+# Directory (relative to the output directory) the tracks are written to
+TIMESERIES_TRACKS_DIR = 'timeseries/tracks'
+
+def timeseries_tracks(project: dict) -> list[dict]:
+    '''
+    Get the tracks of the changes between datasets (in the same form as the
+    project's 'tracks'), with a column for each dataset. There are none
+    unless the project's 'timeseries' option is on and it has several
+    datasets, and only for projects with a single chromosome.
+    '''
+    if not project['project']['timeseries'] or len(project['datasets']) < 2 or multiple_chromosomes(project):
+        return []
+    return [
+        {
+            'name': name,
+            'file': 'timeseries.csv',
+            'columns': [ { 'name': f"{name}_{i}" } for i in range(len(project['datasets'])) ]
+        }
+        for name in TIMESERIES_TRACKS
+    ]
+
+def timeseries_track_files(project: dict) -> dict[str, list[Path]]:
+    '''
+    Get the files for each of the tracks of the changes between datasets
+    '''
+    return {
+        track['name']: track_files(project, track, OUTDIR.joinpath(TIMESERIES_TRACKS_DIR))
+        for track in timeseries_tracks(project)
+    }
+
+def make_timeseries_tracks(project: dict, datasets: list[tuple[int,dict,dict]]) -> list[dict]:
+    '''
+    Generate the tracks of the changes between each dataset (given as tuples
+    of id, input dataset and output paths) and the one before it. Datasets
+    that failed are skipped, so the one before is the one before that
+    succeeded. The aligned structures are saved too, in aligned.npy (an array
+    of shape datasets x beads x 3, in the order of the datasets). Returns the
+    metadata for each track.
+    '''
+    tracks = timeseries_tracks(project)
+    if len(tracks) == 0:
+        if project['project']['timeseries'] and multiple_chromosomes(project):
+            print(f"\033[1m[\033[93m!\033[0m\033[1m]:\033[0m Time series tracks are only made for projects"
+                " with a single chromosome")
+        return []
+
+    print(f"\033[1m[\033[94m>\033[0m\033[1m]:\033[0m Generating time series tracks...")
+    basedir = OUTDIR.joinpath(TIMESERIES_TRACKS_DIR).parent
+    basedir.mkdir(parents=True, exist_ok=True)
+
+    datasets = sorted( datasets, key=lambda result: result[1]['track_column'] )
+    columns = {}
+    if len(datasets) > 0:
+        structures = [ timeseries.read_structure(paths['structure']) for (_, _, paths) in datasets ]
+        aligned = timeseries.align_structures(structures)
+        np.save(basedir.joinpath('aligned.npy'), aligned.astype(np.float32))
+
+        moved = timeseries.displacement(aligned)
+
+        # Only the contact sets of two datasets are read at once
+        previous = None
+        for (k, (_, dataset, paths)) in enumerate(datasets):
+            current = { name: timeseries.read_contact_pairs(paths[name]) for name in ('inputset', 'outputset') }
+            if previous is not None:
+                i = dataset['track_column']
+                columns[f"displacement_{i}"] = moved[k - 1]
+                for (prefix, name) in (('contacts', 'outputset'), ('input_contacts', 'inputset')):
+                    beads = max( aligned.shape[1], int(previous[name].max(initial=0)), int(current[name].max(initial=0)) )
+                    (gained, lost) = timeseries.contact_changes(previous[name], current[name], beads)
+                    columns[f"{prefix}_gained_{i}"] = gained
+                    columns[f"{prefix}_lost_{i}"] = lost
+            previous = current
+    else:
+        basedir.joinpath('aligned.npy').unlink(missing_ok=True)
+
+    # One column for each track and dataset (left empty for the first, and
+    # for datasets that failed), and one row for each bead
+    names = [ column['name'] for track in tracks for column in track['columns'] ]
+    rows = max( [ len(values) for values in columns.values() ], default=0 )
+    table = np.full( (rows, len(names)), np.nan )
+    for (c, name) in enumerate(names):
+        if name in columns:
+            table[ :len(columns[name]), c ] = columns[name]
+    np.savetxt(basedir.joinpath('timeseries.csv'), table, delimiter=',', header=','.join(names), comments='', fmt='%.9g')
+
+    return csv2tracks.make_tracks(tracks, basedir, Path(TIMESERIES_TRACKS_DIR).name, relative=OUTDIR,
+        format=track_format_from_project(project))
+
+########################
+# PARAMETER SWEEPS
+########################
+
+
+def sweep_runs(project: dict) -> list[tuple[dict, list[tuple[dict, Path]]]]:
+    '''
+    Get the runs for the project's parameter sweep (see sweep.py). For each
+    job (see make_jobs), this is a tuple of the job and a list of the
+    combinations of settings to process it with, each with the directory
+    for its results.
+    '''
+    grid = sweep_grid(project['sweep'])
+    jobs = make_jobs(project, OUTDIR)
+    return [
+        ( job, [
+            ( combination, SWEEP_DIR.joinpath(combination_name(combination), job['outdir'].relative_to(OUTDIR)) )
+            for combination in grid
+        ] )
+        for job in jobs
+    ]
+
+def process_sweep(settings: Settings, options: dict, input: Path, runs: list[tuple[dict, Path]],
+        cache: BuildCache) -> list[tuple[dict, dict, dict]]:
+    '''
+    Process a Hi-C file with each of the given combinations of settings, one
+    after another. The combinations should only differ in their
+    distance_threshold, so they share a simulation.
+
+    Returns a list with the outcome of each run, as returned by try_process_hic
+    '''
+    simulations = {}
+    return [
+        try_process_hic({ **settings, **combination }, options, input, outdir, cache, simulations=simulations)
+        for (combination, outdir) in runs
+    ]
+
+def try_process_sweep(settings: Settings, options: dict, input: Path, runs: list[tuple[dict, Path]],
+        cache: BuildCache) -> list[tuple[dict, dict, dict]]:
+    '''
+    Call process_sweep, catching any error, which is then the outcome of
+    every run
+    '''
     try:
-        run.check_returncode()
-    except subprocess.CalledProcessError as e:
-        print(run.stdout)
-        print("Error creating tracks!")
-        raise e
+        return process_sweep(settings, options, input, runs, cache)
+    except Exception as e:
+        error = { 'error': str(e) or type(e).__name__, 'traceback': traceback.format_exc() }
+        return [ ( None, error, {} ) for _ in runs ]
+
+def run_sweep(project: dict) -> list[dict]:
+    '''
+    Run the project's parameter sweep, processing every dataset with every
+    combination of settings. Results already in the cache are reused. Runs
+    that fail (e.g. with a "bad FENE bond" error) are recorded in the summary
+    rather than stopping the sweep.
+
+    Writes a summary of how well the contacts in each structure agree with
+    the contacts input to the simulation to SWEEP_DIR/summary.tsv, and
+    returns its rows.
+    '''
+    if 'sweep' not in project:
+        return []
+
+    settings = settings_from_project(project)
+    options = options_from_project(project)
+    sweeps = sweep_runs(project)
+    names = list( sweep_grid(project['sweep'])[0].keys() )
+    cache = BuildCache(CACHE_DIR, ARGS.cache_size)
+
+    # Combinations whose simulations are the same (i.e. they only differ in
+    # their distance_threshold) are run one after another in the same job,
+    # so they can share it. Every other group is a job of its own.
+    groups = []
+    for (k, (job, combinations)) in enumerate(sweeps):
+        indices = {}
+        for (i, (combination, _)) in enumerate(combinations):
+            indices.setdefault( simulation_settings({ **settings, **combination }), [] ).append(i)
+        groups += [ (k, group) for group in indices.values() ]
+
+    runs = sum( len(combinations) for (_, combinations) in sweeps )
+    workers = worker_count( len(groups),
+        threads_per_job=ARGS.threads_per_job,
+        memory_per_job=ARGS.memory_per_job,
+        max_workers=ARGS.jobs
+    )
+    print(f"\033[1m[\033[94m>\033[0m\033[1m]:\033[0m Sweeping {runs} combination(s) of settings, {workers} at a time...")
+
+    input_args = [
+        (
+            { **settings, 'chromosome': sweeps[k][0]['chromosome'] },
+            options,
+            INDIR.joinpath( project['datasets'][ sweeps[k][0]['dataset'] ]['data'] ),
+            [ sweeps[k][1][i] for i in group ],
+            cache
+        )
+        for (k, group) in groups
+    ]
+
+    # Rows for each combination (kept in the same order as the jobs and
+    # their combinations, whichever order they finish in)
+    rows = [ [ None ] * len(combinations) for (_, combinations) in sweeps ]
+    for (g, outcomes, elapsed) in run_in_workers(try_process_sweep, input_args, workers):
+        (k, group) = groups[g]
+        (job, combinations) = sweeps[k]
+        for (i, (results, error, profile)) in zip(group, outcomes):
+            (combination, _) = combinations[i]
+            row = { 'dataset': project['datasets'][ job['dataset'] ]['name'], 'chromosome': job['chromosome'], **combination }
+            if error is None:
+                with open(results['metadata'], 'r') as f:
+                    metadata = json.load(f)
+                row.update({
+                    'status': 'ok',
+                    'input_contacts': metadata['num_input_contacts'],
+                    'output_contacts': metadata['num_output_contacts'],
+                    'shared_contacts': metadata.get('num_shared_contacts'),
+                    'agreement': metadata.get('contact_agreement')
+                })
+            else:
+                row.update({ 'status': 'failed', 'error': error['error'] })
+            if 'total' in profile:
+                row['elapsed'] = profile['total']['wall']
+            rows[k][i] = row
+        minutes, seconds = divmod(round(elapsed), 60)
+        print(f"  \033[1m[\033[32m✓\033[0m\033[1m {job['label']}]:\033[0m Swept {len(group)} combination(s)"
+            f" in {minutes}m{seconds:02d}s")
+    rows = [ row for job_rows in rows for row in job_rows ]
+
+    SWEEP_DIR.mkdir(parents=True, exist_ok=True)
+    write_summary(SWEEP_DIR.joinpath('summary.tsv'), names, rows)
+
+    columns = [ 'dataset', *names, 'status', 'agreement' ]
+    print(f"\033[1m[\033[94m>\033[0m\033[1m]:\033[0m Sweep summary (also in {SWEEP_DIR.relative_to(OUTDIR)}/summary.tsv):")
+    print(format_table(columns, [
+        [ r['dataset'], *[ r[n] for n in names ], r['status'], '' if r.get('agreement') is None else f"{r['agreement']:.3f}" ]
+        for r in rows
+    ]))
+    return rows
+
+########################
+# ANNOTATIONS
+########################
+
+# The index of the annotations, in the output directory (see annotation_index.py)
+ANNOTATION_INDEX = 'annotations.db'
+
+def annotation_copies(project: dict) -> list[tuple[Path,Path]]:
+    '''
+    Get the annotation files to copy into the output project, as a list of
+    (source, destination) tuples
+    '''
+    copies = []
+    if ('annotations' in project):
+        anno = project['annotations']
+        # The 'genes' annotation file is specified in the output
+        # project.json while the 'features' annotation file
+        # goes into a hard-coded location
+        if ('genes' in anno):
+            src  = INDIR.joinpath( anno['genes']['file'] )
+            copies.append( (src, OUTDIR.joinpath( src.name )) )
+        if ('features' in anno):
+            src  = INDIR.joinpath( anno['features']['file'] )
+            copies.append( (src, OUTDIR.joinpath('source', 'annotations.csv')) )
+    return copies
+
+def annotation_sources(project: dict) -> list[tuple[str,Path]]:
+    '''
+    Get the annotation files in the input project, as a list of tuples of
+    the annotation ('genes' or 'features') and the path to the file
+    '''
+    anno = project.get('annotations') or {}
+    return [ (name, INDIR.joinpath( anno[name]['file'] )) for name in ('genes', 'features') if name in anno ]
+
+def copy_annotations(project: dict):
+    '''
+    Copy annotation files into the output project, and index them (see
+    annotation_index.py)
+    '''
+    for (src, dest) in annotation_copies(project):
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(src, dest)
+
+    sources = annotation_sources(project)
+    if sources:
+        build_index(OUTDIR.joinpath(ANNOTATION_INDEX), sources)
+
+def known_features(names: list[str]) -> list[str]:
+    '''
+    Get which of the given names of features (i.e. bookmarks) are in the
+    project's annotations, according to the index in the output project.
+    The others are left out, with a warning. If the project has no index
+    (because it has no annotations), no names are left out.
+    '''
+    index = OUTDIR.joinpath(ANNOTATION_INDEX)
+    if not index.is_file():
+        return names
+    with AnnotationIndex(index) as annotations:
+        known = annotations.names(names)
+    for name in names:
+        if name not in known:
+            print(f"\033[1m[\033[93m!\033[0m\033[1m]:\033[0m Bookmarked feature '{name}' isn't in the annotations, so it's left out")
+    return [ name for name in names if name in known ]
 
 ########################
 # BROWSER
@@ -415,6 +1803,7 @@ def run_db_pop():
         else:
             db_pop = BROWSER_DIR.joinpath('bin', 'db_pop')
 
+    print(f"\033[1m[\033[94m>\033[0m\033[1m]:\033[0m Populating project database...")
     run = subprocess.run([db_pop, OUTDIR],
         stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
     )
@@ -426,57 +1815,115 @@ def run_db_pop():
         print("Error creating project database!")
         raise e
 
+def database_files(project: dict, datasets: list[tuple[int,dict,dict]]) -> list[Path]:
+    '''
+    Get the files the project database is populated from (the project.json,
+    and the files for each dataset, track, etc.), given the datasets in the
+    project (as tuples of id, input dataset and output paths)
+    '''
+    files = [ OUTDIR.joinpath('project.json') ]
+    for (_, _, paths) in datasets:
+        files += [ paths[name] for name in DATABASE_RESULTS ]
+    for track in project_tracks(project):
+        files += track_files(project, track, OUTDIR.joinpath('tracks'))
+    for track_group in ( ensemble_track_files(project), timeseries_track_files(project) ):
+        files += [ path for paths in track_group.values() for path in paths ]
+    files += [ dest for (_, dest) in annotation_copies(project) ]
+    return files
+
+def precompress_outputs(project: dict, datasets: list[tuple[int,dict,dict]]):
+    '''
+    Write compressed copies of the files the browser is sent (see
+    precompress.py)
+    '''
+    print(f"\033[1m[\033[94m>\033[0m\033[1m]:\033[0m Compressing output files for the browser...")
+    precompress.precompress(OUTDIR, database_files(project, datasets))
+
 ####################################
 #
 #    MAIN
 #
 ###################################
 
-def main():
-    multiprocessing.set_start_method('spawn')
-
-    project = load_project_spec()
+def build(project: Optional[dict] = None):
+    '''
+    Build the project (see configure), from the project file or the given
+    project specification
+    '''
+    WORKER_BATCHES.clear()
+    if project is None:
+        project = load_project_spec()
 
     OUTDIR.mkdir(exist_ok=True)
 
-    # Process Hi-C data
-    process_settings = settings_from_project(project)
-    process_outputs = process_datasets(process_settings, project['datasets'], OUTDIR )
-
-    # A list of tuples matching ids and input datasets with the paths to
-    # their output files
-    dataset_results = list( zip(
-        range( len(process_outputs) ),
-        project['datasets'],
-        process_outputs
-    ))
-
-    # Save browser project.json
-    out_project = make_project_json(project, dataset_results)
-    with open(OUTDIR.joinpath("project.json"), 'w') as f:
-        json.dump(out_project, f)
+    # Run the stages of the build (only rebuilding what's changed). If
+    # specific stages were asked for, they're run even if they're up to date
+    # (Stages run in threads of their own, so their CPU time is per-thread)
+    # The stages call back into this module (which may be __main__), see
+    # stages.py
+    workflow = sys.modules[__name__]
+    profiler = Profiler(PROFILE_DIR, cpu_clock=time.thread_time)
+    pipeline = Pipeline(stages.make_stages(workflow, project), STAGES_FILE, profiler)
+    try:
+        pipeline.run(only=ARGS.only, until=ARGS.until, force=ARGS.only is not None)
+    finally:
+        stages.report_profile(workflow, pipeline, profiler)
 
-    # Generate tracks
-    if ('tracks' in project) and len(project['tracks']) > 0:
-        make_tracks()
+########################
+# WATCH MODE
+########################
 
-    # Copy annotation files
-    if ('annotations' in project):
-        anno = project['annotations']
-        # The 'genes' annotation file is specified in the output
-        # project.json while the 'features' annotation file
-        # goes into a hard-coded location
-        if ('genes' in anno):
-            src  = INDIR.joinpath( anno['genes']['file'] )
-            dest = OUTDIR.joinpath( src.name )
-            shutil.copy2(src, dest)
-        if ('features' in anno):
-            src  = INDIR.joinpath( anno['features']['file'] )
-            dest = OUTDIR.joinpath('source', 'annotations.csv')
-            dest.parent.mkdir(parents=True, exist_ok=True)
-            shutil.copy2(src, dest)
+def try_build() -> bool:
+    '''
+    Build the project in watch mode: a failed build is reported rather than
+    raised, so the next change can fix it. After a successful build, the
+    reload file is updated. Returns whether the build succeeded.
+    '''
+    try:
+        build()
+    except (Exception, SystemExit) as e:
+        message = f"exit code {e.code}" if isinstance(e, SystemExit) else f"{type(e).__name__}: {e}"
+        print(f"\033[1m[\033[31mX\033[0m\033[1m]:\033[0m Build failed ({message})")
+        return False
+    RELOAD_FILE.write_text(f"{time.time()}\n")
+    return True
+
+def watch():
+    '''
+    Build the project, then keep watching the input directory (other than the
+    output and cache directories), building it again whenever anything in it
+    changes (until interrupted, see watcher.py).
+
+    Each build only redoes what a change affects: stages are skipped if
+    their inputs haven't changed, only the tracks and datasets which changed
+    are written or processed again, and the digests of unchanged input files
+    are remembered in this process. The worker processes are kept running
+    between builds too (see --persistent-workers).
+    '''
+    watcher.watch(INDIR, try_build, exclude=(OUTDIR, CACHE_DIR))
 
-    run_db_pop()
+def main(argv: Optional[list[str]] = None):
+    try:
+        configure(argv)
+    except FileNotFoundError:
+        print("Could not find project file. Please make sure your project directory has one of these files:")
+        for file in PROJECT_FILENAMES:
+            print(f"  - {file}")
+        exit(1)
+
+    interrupted = False
+    try:
+        if ARGS.watch:
+            watch()
+        else:
+            build()
+    except KeyboardInterrupt:
+        # (the way to stop watching)
+        interrupted = True
+        if not ARGS.watch:
+            raise
+    finally:
+        stop_workers(terminate=interrupted)
 
 if __name__ == '__main__':
     main()
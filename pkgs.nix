@@ -8,17 +8,35 @@ let
   # Workflow source files
   workflow-src = pkgs.linkFarm "workflow-src" [
     { name = "workflow.py"; path = ./build_stage/scripts/workflow.py; }
+    { name = "build_cache.py"; path = ./build_stage/scripts/build_cache.py; }
+    { name = "scheduler.py"; path = ./build_stage/scripts/scheduler.py; }
+    { name = "trajectory.py"; path = ./build_stage/scripts/trajectory.py; }
+    { name = "spatial.py"; path = ./build_stage/scripts/spatial.py; }
+    { name = "columnar.py"; path = ./build_stage/scripts/columnar.py; }
+    { name = "pipeline.py"; path = ./build_stage/scripts/pipeline.py; }
+    { name = "profiling.py"; path = ./build_stage/scripts/profiling.py; }
+    { name = "ensemble.py"; path = ./build_stage/scripts/ensemble.py; }
+    { name = "sweep.py"; path = ./build_stage/scripts/sweep.py; }
+    { name = "hic_contacts.py"; path = ./build_stage/scripts/hic_contacts.py; }
+    { name = "contact_tiles.py"; path = ./build_stage/scripts/contact_tiles.py; }
+    { name = "annotation_index.py"; path = ./build_stage/scripts/annotation_index.py; }
+    { name = "timeseries.py"; path = ./build_stage/scripts/timeseries.py; }
+    { name = "precompress.py"; path = ./build_stage/scripts/precompress.py; }
+    { name = "stages.py"; path = ./build_stage/scripts/stages.py; }
+    { name = "watcher.py"; path = ./build_stage/scripts/watcher.py; }
     { name = "project_template.json"; path = ./build_stage/scripts/project_template.json; }
     { name = "csv2tracks"; path = ./build_stage/scripts/csv2tracks; }
+    { name = "csv2tracks.py"; path = ./build_stage/scripts/csv2tracks.py; }
   ];
 
   # Workflow script
   workflow-build = { python3, db_pop, hic2structure }: pkgs.writeShellScriptBin "4dgb-workflow-build" (
     let
-      py = python3.withPackages (p: with p; [pyyaml pandas hic2structure]);
+      py = python3.withPackages (p: with p; [pyyaml pandas numpy scipy brotli hic2structure]);
       src = workflow-src;
     in ''
       export PATH="${db_pop}/bin:$PATH"
+      export PYTHONPATH="${src}:$PYTHONPATH"
       ${py}/bin/python3 ${src}/workflow.py "$@"
     ''
   );
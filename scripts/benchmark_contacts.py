@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+#
+# Benchmark the methods for finding contacts in a structure (see
+# build_stage/scripts/spatial.py) on synthetic structures of increasing size.
+#
+# Structures are random walks with unit-length steps, which have about the same
+# density of contacts as the structures output by LAMMPS at the default
+# distance_threshold.
+#
+# Usage:
+#   ./benchmark_contacts.py [--beads 1000 10000 100000] [--threshold 3.3] [--json FILE]
+#
+
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str( Path(__file__).parent.joinpath('..', 'build_stage', 'scripts').resolve() ))
+import spatial
+
+# The pairwise method needs (beads^2) memory, so it's skipped above this
+PAIRWISE_LIMIT = 20000
+
+def random_walk(beads: int, seed: int = 0) -> np.ndarray:
+    steps = np.random.default_rng(seed).normal(size=(beads, 3))
+    steps /= np.linalg.norm(steps, axis=1)[:, np.newaxis]
+    return np.cumsum(steps, axis=0)
+
+def contact_pairs_pairwise(positions: np.ndarray, threshold: float) -> np.ndarray:
+    '''
+    Check the distance between every pair of beads, in blocks of rows
+    '''
+    pairs = []
+    for start in range(0, len(positions), 1000):
+        block = positions[start:start+1000]
+        dist = np.linalg.norm(block[:, np.newaxis] - positions[np.newaxis], axis=-1)
+        (i, j) = np.nonzero(dist < threshold)
+        i += start
+        pairs.append( np.stack([ i[i < j], j[i < j] ], axis=1) )
+    return np.concatenate(pairs)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark methods for finding contacts")
+    parser.add_argument("--beads", type=int, nargs='+', default=[1000, 10000, 100000],
+        help="Sizes of structures to benchmark")
+    parser.add_argument("--threshold", type=float, default=3.3, help="Distance threshold")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of times to time each method (the best is kept)")
+    parser.add_argument("--json", type=str, default=None, metavar="FILE", help="Write the results to this file")
+    args = parser.parse_args()
+
+    methods = { 'grid': spatial.contact_pairs_grid, 'pairwise': contact_pairs_pairwise }
+    try:
+        import scipy
+        methods['kdtree'] = spatial.contact_pairs_kdtree
+    except ImportError:
+        print("(scipy is not installed, skipping 'kdtree')", file=sys.stderr)
+
+    results = []
+    print(f"{'beads':>10} {'method':>10} {'contacts':>10} {'seconds':>10}")
+    for beads in args.beads:
+        positions = random_walk(beads)
+        for (name, method) in methods.items():
+            if name == 'pairwise' and beads > PAIRWISE_LIMIT:
+                continue
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                pairs = method(positions, args.threshold)
+                times.append( time.perf_counter() - start )
+            print(f"{beads:>10} {name:>10} {len(pairs):>10} {min(times):>10.4f}")
+            results.append({ 'beads': beads, 'method': name, 'contacts': len(pairs), 'seconds': min(times) })
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+
+#
+# Benchmark each stage of processing a project on synthetic inputs of
+# increasing size, without docker or real Hi-C data.
+#
+# For each number of beads, this generates a synthetic contact map (contacts
+# between nearby bins are common, with counts falling off with distance, plus
+# some random long-range contacts) and a tracks CSV file, then times:
+#
+#   contact_records_to_set   (needs hic2structure)
+#   lammps                   (needs hic2structure; run for --timesteps steps)
+#   find_contacts            (pairwise, with hic2structure, for small structures)
+#   find_contacts_grid       (see build_stage/scripts/spatial.py)
+#   write_text               (needs hic2structure)
+#   write_binary             (see build_stage/scripts/columnar.py)
+#   contact_tiles            (see build_stage/scripts/contact_tiles.py)
+#   csv2tracks               (in the --track-format)
+#   load_tracks              (reading every track back, as the browser does)
+#   annotation_index         (indexing a .gff file with a gene for every 10
+#                            beads, see build_stage/scripts/annotation_index.py)
+#   annotation_queries       (1000 region queries and name lookups in it)
+#   timeseries_align         (aligning --timepoints copies of the structure,
+#                            see build_stage/scripts/timeseries.py)
+#   timeseries_contacts      (comparing the contacts of consecutive timepoints)
+#   project_json             (needs hic2structure, for the files it reads)
+#
+# Contact extraction from a .hic file can't be benchmarked on synthetic data
+# (there's no way to write a .hic file), but a real file can be given with
+# --hic to time that too.
+#
+# Stages which can't be run are recorded as skipped (with the reason) in the
+# results, so results from different machines and commits line up.
+#
+# Usage:
+#   ./benchmark_pipeline.py [--beads 1000 10000 100000] [--timesteps 1000] [--json FILE]
+#
+
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import importlib
+import platform
+import subprocess
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+
+SCRIPTS = Path(__file__).parent.joinpath('..', 'build_stage', 'scripts').resolve()
+sys.path.insert(0, str(SCRIPTS))
+import spatial
+import columnar
+import csv2tracks
+import contact_tiles
+import annotation_index
+import timeseries
+
+# The pairwise method for finding contacts is quadratic, so it's skipped above this
+PAIRWISE_LIMIT = 10000
+
+# Bins are positions in base pairs, stored as int32 (like real contact
+# records), so this is small enough for the largest --beads to fit
+RESOLUTION = 10000
+DISTANCE_THRESHOLD = 3.3
+
+# The same fields as the contact records read from .hic files by hicstraw
+Record = namedtuple('Record', ['binX', 'binY', 'counts'])
+
+def synthetic_records(beads: int, band: int = 10, seed: int = 0) -> list[Record]:
+    '''
+    Generate contact records for a chromosome of the given number of bins
+    '''
+    rng = np.random.default_rng(seed)
+
+    # Contacts between each bin and the next 'band' bins
+    i = np.repeat(np.arange(beads), band)
+    j = i + np.tile(np.arange(1, band + 1), beads)
+    keep = j < beads
+    (i, j) = (i[keep], j[keep])
+    counts = rng.poisson( 100.0 / (j - i) ).astype(np.float64)
+
+    # And some long-range contacts
+    far = rng.integers(0, beads, size=(beads, 2))
+    far = far[ far[:, 0] < far[:, 1] ]
+    i = np.concatenate([ i, far[:, 0] ])
+    j = np.concatenate([ j, far[:, 1] ])
+    counts = np.concatenate([ counts, rng.poisson(3.0, size=len(far)).astype(np.float64) ])
+
+    return [ Record(int(x) * RESOLUTION, int(y) * RESOLUTION, float(c)) for (x, y, c) in zip(i, j, counts) ]
+
+def random_walk(beads: int, seed: int = 0) -> np.ndarray:
+    steps = np.random.default_rng(seed).normal(size=(beads, 3))
+    steps /= np.linalg.norm(steps, axis=1)[:, np.newaxis]
+    return np.cumsum(steps, axis=0)
+
+def write_tracks_csv(path: Path, beads: int, tracks: int, datasets: int, seed: int = 0) -> list[dict]:
+    '''
+    Write a tracks CSV file in the same form as the example project's, and
+    return the 'tracks' section of a project using it
+    '''
+    rng = np.random.default_rng(seed)
+    names = [ f"track{t}_{d}" for t in range(tracks) for d in range(datasets) ]
+    start = np.arange(beads, dtype=np.int64) * RESOLUTION
+    with open(path, 'w') as f:
+        f.write("Chrom,Start,End," + ",".join(names) + "\n")
+        values = rng.gamma(1.0, size=(beads, len(names)))
+        for (s, row) in zip(start, values):
+            f.write(f"chrX,{s},{s + RESOLUTION}," + ",".join( f"{v:.6f}" for v in row ) + "\n")
+
+    return [
+        { 'name': f"track{t}", 'file': path.name, 'columns': [ { 'name': f"track{t}_{d}" } for d in range(datasets) ] }
+        for t in range(tracks)
+    ]
+
+def write_gff(path: Path, beads: int, seed: int = 0) -> list[str]:
+    '''
+    Write a .gff file with a gene (of up to 20 bins) for every 10 beads,
+    and return their names
+    '''
+    rng = np.random.default_rng(seed)
+    genes = max(1, beads // 10)
+    starts = rng.integers(0, beads * RESOLUTION, size=genes)
+    lengths = rng.integers(1, 20 * RESOLUTION, size=genes)
+    names = [ f"GENE{g}" for g in range(genes) ]
+    with open(path, 'w') as f:
+        f.write("##gff-version 3\n")
+        for (name, start, length) in zip(names, starts, lengths):
+            f.write(f"chrX\tbenchmark\tgene\t{start}\t{start + length}\t.\t+\t.\tID=gene-{name};Name={name}\n")
+    return names
+
+def timed(results: list, beads: int, stage: str, func, repeat: int = 1):
+    '''
+    Time a function (keeping the best of 'repeat' runs), recording it in
+    results. Returns the function's result.
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func()
+        times.append( time.perf_counter() - start )
+    print(f"{beads:>10} {stage:>24} {min(times):>10.4f}")
+    results.append({ 'beads': beads, 'stage': stage, 'seconds': min(times) })
+    return value
+
+def skipped(results: list, beads: int, stage: str, reason: str):
+    print(f"{beads:>10} {stage:>24} {'skipped':>10}  ({reason})")
+    results.append({ 'beads': beads, 'stage': stage, 'seconds': None, 'skipped': reason })
+
+def import_hic2structure():
+    try:
+        return importlib.import_module('hic2structure')
+    except ImportError:
+        return None
+
+def benchmark(beads: int, args, workdir: Path, results: list):
+    '''
+    Run the benchmarks for structures with the given number of beads
+    '''
+    h2s = import_hic2structure()
+    missing = "hic2structure is not installed"
+
+    indir = workdir.joinpath(f"in_{beads}")
+    outdir = workdir.joinpath(f"out_{beads}")
+    lammps_dir = outdir.joinpath('lammps_0')
+    for d in (indir, lammps_dir):
+        d.mkdir(parents=True, exist_ok=True)
+
+    settings = {
+        'chromosome': 'X',
+        'count_threshold': 2.0,
+        'distance_threshold': DISTANCE_THRESHOLD,
+        'resolution': RESOLUTION,
+        'bond_coeff': 55,
+        'timesteps': args.timesteps
+    }
+
+    records = [ r for r in synthetic_records(beads) if r.counts > settings['count_threshold'] ]
+
+    # Hi-C processing
+    if h2s is not None:
+        from hic2structure.contacts import contact_records_to_set, find_contacts
+        from hic2structure.lammps import run_lammps
+
+        input_set = timed(results, beads, 'contact_records_to_set',
+            lambda: contact_records_to_set(records), args.repeat)
+        lammps_data = timed(results, beads, 'lammps',
+            lambda: run_lammps(input_set, settings, copy_log_to=lammps_dir.joinpath('sim.log')))
+        positions = lammps_data[ max(lammps_data.keys()) ]
+        del lammps_data
+        if beads <= PAIRWISE_LIMIT:
+            timed(results, beads, 'find_contacts',
+                lambda: find_contacts(positions, settings), args.repeat)
+        else:
+            skipped(results, beads, 'find_contacts', f"more than {PAIRWISE_LIMIT} beads")
+    else:
+        input_set = { (r.binX // RESOLUTION + 1, r.binY // RESOLUTION + 1) for r in records }
+        positions = random_walk(beads)
+        for stage in ('contact_records_to_set', 'lammps', 'find_contacts'):
+            skipped(results, beads, stage, missing)
+
+    output_set = timed(results, beads, 'find_contacts_grid',
+        lambda: spatial.find_contacts(positions, DISTANCE_THRESHOLD), args.repeat)
+
+    # Writing outputs
+    if h2s is not None:
+        from hic2structure.out import write_contact_records, write_structure, write_contact_set
+        def write_text():
+            write_structure(lammps_dir.joinpath('structure.csv'), positions)
+            write_contact_records(lammps_dir.joinpath('contactmap.tsv'), records)
+            write_contact_set(lammps_dir.joinpath('inputset.tsv'), input_set)
+            write_contact_set(lammps_dir.joinpath('outputset.tsv'), output_set)
+        timed(results, beads, 'write_text', write_text, args.repeat)
+    else:
+        skipped(results, beads, 'write_text', missing)
+
+    def write_binary():
+        columnar.write_structure(lammps_dir.joinpath('structure.npy'), positions)
+        columnar.write_contact_records(lammps_dir.joinpath('contactmap.npz'), records)
+        columnar.write_contact_set(lammps_dir.joinpath('inputset.npy'), input_set)
+        columnar.write_contact_set(lammps_dir.joinpath('outputset.npy'), output_set)
+    timed(results, beads, 'write_binary', write_binary, args.repeat)
+    (bins, counts) = columnar.records_to_arrays(records)
+    timed(results, beads, 'contact_tiles',
+        lambda: contact_tiles.save_tiles([ lammps_dir.joinpath(name) for name in contact_tiles.TILE_FILES ],
+            bins, counts, RESOLUTION),
+        args.repeat)
+
+    # Tracks
+    tracks = write_tracks_csv(indir.joinpath('tracks.csv'), beads, args.tracks, args.datasets)
+    timed(results, beads, 'csv2tracks',
+        lambda: csv2tracks.make_tracks(tracks, str(indir), str(outdir.joinpath('tracks')), jobs=args.jobs,
+            format=args.track_format),
+        args.repeat)
+    def load_tracks():
+        # touch every value, so memory-mapped tracks are actually read
+        for track in tracks:
+            (_, arrays) = csv2tracks.load_track(outdir.joinpath('tracks', track['name']))
+            for array in arrays:
+                float(array.sum())
+    timed(results, beads, 'load_tracks', load_tracks, args.repeat)
+
+    # Annotations
+    genes = write_gff(indir.joinpath('genes.gff'), beads)
+    timed(results, beads, 'annotation_index',
+        lambda: annotation_index.build_index(outdir.joinpath('annotations.db'), [ ('genes', indir.joinpath('genes.gff')) ]),
+        args.repeat)
+    def annotation_queries():
+        rng = np.random.default_rng(0)
+        with annotation_index.AnnotationIndex(outdir.joinpath('annotations.db')) as index:
+            for start in rng.integers(0, beads * RESOLUTION, size=1000):
+                index.region(int(start), int(start) + 10 * RESOLUTION, 'chrX')
+                index.lookup(genes[ int(start) % len(genes) ])
+    timed(results, beads, 'annotation_queries', annotation_queries, args.repeat)
+
+    # Time series (each timepoint a moved, rotated copy of the structure)
+    rng = np.random.default_rng(0)
+    structures = []
+    for _ in range(args.timepoints):
+        (q, _) = np.linalg.qr(rng.normal(size=(3, 3)))
+        structures.append( (positions + rng.normal(scale=0.1, size=positions.shape)) @ q )
+    timed(results, beads, 'timeseries_align',
+        lambda: timeseries.displacement(timeseries.align_structures(structures)), args.repeat)
+    del structures
+    contact_sets = [ np.array(sorted(output_set)).reshape(-1, 2) ]
+    for _ in range(args.timepoints - 1):
+        # swap a tenth of the contacts for random ones
+        pairs = contact_sets[-1].copy()
+        changed = rng.random(len(pairs)) < 0.1
+        pairs[changed] = rng.integers(1, beads + 1, size=(int(changed.sum()), 2))
+        contact_sets.append(pairs)
+    timed(results, beads, 'timeseries_contacts',
+        lambda: [ timeseries.contact_changes(a, b, beads) for (a, b) in zip(contact_sets, contact_sets[1:]) ],
+        args.repeat)
+
+    # project.json
+    if h2s is not None:
+        with open(lammps_dir.joinpath('metadata.json'), 'w') as f:
+            json.dump({ 'num_segments': beads }, f)
+        lammps_dir.joinpath('settings.json').write_text(json.dumps(settings))
+        project = {
+            'project': { 'name': 'benchmark', 'resolution': RESOLUTION, 'chromosome': 'X', 'blackout': [] },
+            'datasets': [ { 'name': f"dataset{d}", 'data': f"dataset{d}.hic" } for d in range(args.datasets) ],
+            'tracks': tracks
+        }
+        with open(indir.joinpath('project.yaml'), 'w') as f:
+            json.dump(project, f)
+        workflow = import_workflow(indir, outdir)
+        project = workflow.load_project_spec()
+        paths = workflow.result_paths(lammps_dir, 'text')
+        dataset_results = [
+            ( d, { **dataset, 'track_column': d }, paths ) for (d, dataset) in enumerate(project['datasets'])
+        ]
+        timed(results, beads, 'project_json',
+            lambda: workflow.make_project_json(project, dataset_results), args.repeat)
+    else:
+        skipped(results, beads, 'project_json', missing)
+
+def import_workflow(indir: Path, outdir: Path):
+    workflow = importlib.import_module('workflow')
+    workflow.configure([ str(indir), str(outdir) ])
+    return workflow
+
+def benchmark_hic(path: Path, chromosome: str, resolution: int, results: list):
+    '''
+    Time reading contact records from a real .hic file
+    '''
+    if import_hic2structure() is None:
+        skipped(results, 0, 'read_hic', "hic2structure is not installed")
+        return
+    from hic2structure.hic import HIC
+    settings = { 'chromosome': chromosome, 'resolution': resolution, 'count_threshold': 2.0 }
+    records = timed(results, 0, 'read_hic', lambda: HIC(path).get_contact_records(settings))
+    results[-1]['records'] = len(records)
+
+def commit() -> str:
+    try:
+        return subprocess.run([ 'git', 'rev-parse', 'HEAD' ], cwd=SCRIPTS,
+            capture_output=True, check=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the stages of building a project on synthetic inputs")
+    parser.add_argument("--beads", type=int, nargs='+', default=[1000, 10000, 100000],
+        help="Sizes of structures (numbers of bins) to benchmark")
+    parser.add_argument("--timesteps", type=int, default=1000, help="Number of timesteps to run LAMMPS for")
+    parser.add_argument("--datasets", type=int, default=2, help="Number of datasets (columns in each track)")
+    parser.add_argument("--tracks", type=int, default=4, help="Number of tracks")
+    parser.add_argument("--timepoints", type=int, default=24, help="Number of structures to compare in the time series")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of tracks to write at once")
+    parser.add_argument("--track-format", type=str, default='npz', choices=csv2tracks.TRACK_FORMATS,
+        help="Format to write tracks in (see build_stage/scripts/csv2tracks.py)")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of times to time each stage (the best is kept)")
+    parser.add_argument("--hic", type=str, default=None, metavar="FILE",
+        help="Also time reading contact records from this .hic file")
+    parser.add_argument("--chromosome", type=str, default='chr22', help="Chromosome to read from the --hic file")
+    parser.add_argument("--resolution", type=int, default=200000, help="Resolution to read from the --hic file")
+    parser.add_argument("--workdir", type=str, default=None, metavar="DIR",
+        help="Directory to write inputs and outputs to (default: a temporary directory, removed afterwards)")
+    parser.add_argument("--json", type=str, default=None, metavar="FILE", help="Write the results to this file")
+    args = parser.parse_args()
+
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix='4dgb-benchmark-'))
+    results = []
+    print(f"{'beads':>10} {'stage':>24} {'seconds':>10}")
+    try:
+        if args.hic is not None:
+            benchmark_hic(Path(args.hic), args.chromosome, args.resolution, results)
+        for beads in args.beads:
+            benchmark(beads, args, workdir, results)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'commit': commit(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'machine': platform.machine(),
+                'options': { k: v for (k, v) in vars(args).items() if k not in ('json', 'workdir') },
+                'results': results
+            }, f, indent=2)
+
+if __name__ == '__main__':
+    main()
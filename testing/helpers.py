@@ -0,0 +1,43 @@
+#
+# Shared setup for the unit tests, which are run from the root of the
+# repository, e.g.:
+#
+#   python -m unittest testing/test_spatial.py
+#
+# Importing this puts the build stage's scripts on the path, so the tests can
+# import them as the workflow does. Other directories of scripts can be added
+# with add_path.
+#
+
+import sys
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parents[1]
+
+BUILD_SCRIPTS = REPO.joinpath("build_stage", "scripts")
+VIEW_SCRIPTS = REPO.joinpath("view_stage", "scripts")
+SCRIPTS = REPO.joinpath("scripts")
+
+def add_path(directory: Path):
+    '''
+    Make the modules in a directory importable (ahead of any others)
+    '''
+    if str(directory) not in sys.path:
+        sys.path.insert(0, str(directory))
+
+add_path(BUILD_SCRIPTS)
+
+class ScratchTestCase(unittest.TestCase):
+    '''
+    A test case with a scratch directory (self.scratch), which is made empty
+    for each test and removed afterwards
+    '''
+
+    def setUp(self):
+        self.scratch = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch, ignore_errors=True)
@@ -0,0 +1,92 @@
+import unittest
+import random
+
+from testing.helpers import ScratchTestCase
+import annotation_index
+from annotation_index import AnnotationIndex, build_index, region_bin, overlapping_bins
+
+GFF = """##gff-version 3
+#!processor NCBI annotwriter
+chr22\tBestRefSeq\tgene\t21549447\t21624034\t.\t+\t.\tID=gene-UBE2L3;Name=UBE2L3;description=ubiquitin%3B conjugating
+chr22\tGnomon\tgene\t22402797\t22409381\t.\t-\t.\tID=gene-LOC101929255;Name=LOC101929255
+chr22\tGnomon\texon\t22402797\t22403000\t.\t-\t.\tParent=gene-LOC101929255
+chr21\tGnomon\tgene\t100\t200\t.\t-\t.\tID=gene-ONLYID
+##FASTA
+>chr22
+ACGT
+"""
+
+FEATURES = """name,start,end,id,type
+firsthalf,25700000,50800000,firsthalf,feature
+sticky_outy_bit,18200000,19000000,sticky_outy_bit,feature
+"""
+
+class TestAnnotationIndex(ScratchTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.scratch.joinpath("genes.gff").write_text(GFF)
+        self.scratch.joinpath("features.csv").write_text(FEATURES)
+        self.path = self.scratch.joinpath("annotations.db")
+        build_index(self.path, [
+            ('genes', self.scratch.joinpath("genes.gff")),
+            ('features', self.scratch.joinpath("features.csv"))
+        ])
+
+    def test_lookup(self):
+        with AnnotationIndex(self.path) as index:
+            self.assertEqual(index.lookup("UBE2L3"), [ {
+                'name': 'UBE2L3', 'chromosome': 'chr22', 'start': 21549447, 'end': 21624034,
+                'type': 'gene', 'source': 'genes'
+            } ])
+            # features with no name go by their ID, or are left out
+            self.assertEqual(len(index.lookup("gene-ONLYID")), 1)
+            self.assertEqual(index.lookup("sticky_outy_bit")[0]['chromosome'], None)
+            self.assertEqual(index.lookup("nothing"), [])
+            self.assertEqual(index.names([ "firsthalf", "nothing", "UBE2L3" ]), { "firsthalf", "UBE2L3" })
+
+    def test_region(self):
+        with AnnotationIndex(self.path) as index:
+            names = lambda features: [ f['name'] for f in features ]
+            self.assertEqual(names(index.region(21624034, 22402797, 'chr22')), [ "UBE2L3", "LOC101929255" ])
+            self.assertEqual(names(index.region(21624035, 22402796, 'chr22')), [])
+            # features with no chromosome are on every chromosome
+            self.assertEqual(names(index.region(0, 1000, 'chr21')), [ "gene-ONLYID" ])
+            self.assertEqual(names(index.region(30000000, 30000000, 'chr21')), [ "firsthalf" ])
+            self.assertEqual(names(index.region(0, 1000)), [ "gene-ONLYID" ])
+
+    def test_bins(self):
+        """Region queries find the same features as checking every feature
+        """
+        rng = random.Random(0)
+        features = []
+        for i in range(2000):
+            start = rng.randrange(0, 300_000_000)
+            length = rng.choice([ 10, 1000, 100_000, 1_000_000, 50_000_000 ])
+            features.append( (f"f{i}", start, start + rng.randrange(length)) )
+        self.scratch.joinpath("many.csv").write_text("name,start,end,id,type\n" +
+            "".join( f"{name},{start},{end},{name},feature\n" for (name, start, end) in features ))
+        build_index(self.path, [ ('features', self.scratch.joinpath("many.csv")) ])
+
+        with AnnotationIndex(self.path) as index:
+            for _ in range(100):
+                start = rng.randrange(0, 300_000_000)
+                end = start + rng.choice([ 0, 5000, 2_000_000, 80_000_000 ])
+                expected = { name for (name, s, e) in features if s <= end and e >= start }
+                self.assertEqual({ f['name'] for f in index.region(start, end) }, expected)
+
+        # a feature's bin is always one of the bins searched for a region inside it
+        for (_, start, end) in features:
+            b = region_bin(start, end)
+            self.assertTrue(any( first <= b <= last for (first, last) in overlapping_bins(end, end) ))
+
+    def test_version(self):
+        import sqlite3
+        db = sqlite3.connect(self.path)
+        db.execute(f"PRAGMA user_version = {annotation_index.INDEX_VERSION + 1}")
+        db.close()
+        with self.assertRaises(ValueError):
+            AnnotationIndex(self.path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import os
+
+from testing.helpers import ScratchTestCase
+from build_cache import BuildCache, parse_size
+
+class TestBuildCache(ScratchTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.settings = { "chromosome": "chr22", "resolution": 200000, "count_threshold": 2.0 }
+
+    def make_file(self, name, contents):
+        path = self.scratch.joinpath(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(contents)
+        return path
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size("1024"), 1024)
+        self.assertEqual(parse_size("2K"), 2048)
+        self.assertEqual(parse_size("1.5g"), int(1.5 * 1024**3))
+        self.assertEqual(parse_size("20GB"), 20 * 1024**3)
+
+    def test_key(self):
+        """Keys depend on the contents of the input and the settings, not the file name
+        """
+        cache = BuildCache(self.scratch.joinpath("cache"), parse_size("1M"))
+        a = self.make_file("a.hic", "some hi-c data")
+        b = self.make_file("renamed/b.hic", "some hi-c data")
+        c = self.make_file("c.hic", "other hi-c data")
+
+        self.assertEqual(cache.key(a, self.settings), cache.key(b, self.settings))
+        self.assertNotEqual(cache.key(a, self.settings), cache.key(c, self.settings))
+        self.assertNotEqual(
+            cache.key(a, self.settings),
+            cache.key(a, { **self.settings, "count_threshold": 3.0 })
+        )
+
+    def test_store_fetch(self):
+        cache = BuildCache(self.scratch.joinpath("cache"), parse_size("1M"))
+        hic = self.make_file("a.hic", "some hi-c data")
+        structure = self.make_file("out_a/structure.csv", "x,y,z\n")
+        key = cache.key(hic, self.settings)
+
+        self.assertFalse(cache.fetch(key, self.scratch.joinpath("out_b")))
+        cache.store(key, [ structure ])
+        self.assertTrue(cache.fetch(key, self.scratch.joinpath("out_b")))
+        self.assertEqual(self.scratch.joinpath("out_b", "structure.csv").read_text(), "x,y,z\n")
+
+    def test_entry_files(self):
+        cache = BuildCache(self.scratch.joinpath("cache"), parse_size("1M"))
+        hic = self.make_file("a.hic", "some hi-c data")
+        bins = self.make_file("out_a/bins.npy", "bins")
+        key = cache.key(hic, self.settings)
+
+        self.assertIsNone(cache.entry_files(key, [ "bins.npy" ]))
+        cache.store(key, [ bins ])
+        paths = cache.entry_files(key, [ "bins.npy" ])
+        self.assertEqual(paths, [ cache.entry_dir(key)/"bins.npy" ])
+        self.assertEqual(paths[0].read_text(), "bins")
+        self.assertIsNone(cache.entry_files(key, [ "bins.npy", "counts.npy" ]))
+
+    def test_evict(self):
+        """The least-recently-used entries are evicted once the cache is over its size limit
+        """
+        cache = BuildCache(self.scratch.joinpath("cache"), 3500)
+        keys = []
+        for i in range(3):
+            hic = self.make_file(f"{i}.hic", f"hi-c data {i}")
+            structure = self.make_file(f"out_{i}/structure.csv", "x" * 1000)
+            keys.append(cache.key(hic, self.settings))
+            cache.store(keys[i], [ structure ])
+            # make sure entries have distinct last-used times
+            os.utime(cache.entry_dir(keys[i]), (i, i))
+
+        # using the first entry makes the second one the least-recently-used
+        self.assertTrue(cache.fetch(keys[0], self.scratch.joinpath("fetched")))
+        hic = self.make_file("3.hic", "hi-c data 3")
+        structure = self.make_file("out_3/structure.csv", "x" * 1000)
+        cache.store(cache.key(hic, self.settings), [ structure ])
+
+        self.assertTrue(cache.entry_dir(keys[0]).joinpath("entry.json").exists())
+        self.assertFalse(cache.entry_dir(keys[1]).exists())
+        self.assertTrue(cache.entry_dir(keys[2]).joinpath("entry.json").exists())
@@ -0,0 +1,40 @@
+import unittest
+from collections import namedtuple
+import numpy
+
+from testing.helpers import ScratchTestCase
+import columnar
+
+Record = namedtuple('Record', ['binX', 'binY', 'counts'])
+
+class TestColumnar(ScratchTestCase):
+
+    def test_structure(self):
+        positions = numpy.random.default_rng(0).normal(size=(100, 3))
+        columnar.write_structure(self.scratch/'structure.npy', positions)
+        for mmap in (False, True):
+            result = columnar.read_structure(self.scratch/'structure.npy', mmap=mmap)
+            self.assertEqual(result.dtype, numpy.float32)
+            numpy.testing.assert_allclose(result, positions, rtol=1e-6)
+
+    def test_contact_records(self):
+        records = [ Record(0, 0, 10.0), Record(0, 200000, 3.5), Record(200000, 400000, 1.0) ]
+        columnar.write_contact_records(self.scratch/'contactmap.npz', records)
+        (bins, counts) = columnar.read_contact_records(self.scratch/'contactmap.npz')
+        self.assertEqual(bins.tolist(), [ [0, 0], [0, 200000], [200000, 400000] ])
+        self.assertEqual(counts.tolist(), [ 10.0, 3.5, 1.0 ])
+
+    def test_contact_set(self):
+        contacts = { (3, 5), (1, 2), (1, 4) }
+        columnar.write_contact_set(self.scratch/'set.npy', contacts)
+        result = columnar.read_contact_set(self.scratch/'set.npy')
+        self.assertEqual(result.tolist(), [ [1, 2], [1, 4], [3, 5] ])
+
+    def test_empty(self):
+        columnar.write_contact_set(self.scratch/'set.npy', set())
+        columnar.write_contact_records(self.scratch/'contactmap.npz', [])
+        self.assertEqual(columnar.read_contact_set(self.scratch/'set.npy').shape, (0, 2))
+        self.assertEqual(columnar.read_contact_records(self.scratch/'contactmap.npz')[0].shape, (0, 2))
+
+if __name__ == '__main__':
+    unittest.main()
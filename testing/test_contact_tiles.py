@@ -0,0 +1,81 @@
+import unittest
+import numpy
+
+from testing.helpers import ScratchTestCase
+import contact_tiles
+from contact_tiles import ContactTiles
+
+RESOLUTION = 10000
+
+class TestContactTiles(ScratchTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.paths = [ self.scratch.joinpath(name) for name in contact_tiles.TILE_FILES ]
+
+        # Random records between 1000 bins, with binX <= binY
+        rng = numpy.random.default_rng(0)
+        pairs = numpy.sort(rng.integers(0, 1000, size=(5000, 2)), axis=1)
+        pairs = numpy.unique(pairs, axis=0)
+        self.bins = pairs * RESOLUTION
+        self.counts = rng.random(len(pairs)).astype(numpy.float32)
+
+    def brute_force(self, level, start, end):
+        # the records at a level with both bins in [start, end), summed by hand
+        summed = {}
+        for ((x, y), count) in zip(self.bins // RESOLUTION >> level, self.counts):
+            if start <= x < end and start <= y < end:
+                summed[(int(x), int(y))] = summed.get((int(x), int(y)), 0.0) + float(count)
+        return summed
+
+    def test_levels(self):
+        self.assertEqual(contact_tiles.num_levels(0), 1)
+        self.assertEqual(contact_tiles.num_levels(256), 1)
+        self.assertEqual(contact_tiles.num_levels(257), 2)
+        self.assertEqual(contact_tiles.num_levels(1000), 3)
+
+        levels = contact_tiles.save_tiles(self.paths, self.bins, self.counts, RESOLUTION)
+        self.assertEqual([ l['resolution'] for l in levels ], [ RESOLUTION, 2 * RESOLUTION, 4 * RESOLUTION ])
+        self.assertEqual([ l['bins'] for l in levels ], [ 1000, 500, 250 ])
+        self.assertEqual(levels[0]['records'], len(self.counts))
+        # the last level is a single tile
+        self.assertEqual(levels[-1]['tiles'], 1)
+        self.assertEqual(ContactTiles(self.paths).levels(), 3)
+
+    def test_downsample(self):
+        # Counts are summed over each pair of coarser bins
+        (bins, counts) = contact_tiles.downsample(numpy.array([ [0, 1], [1, 1], [2, 5], [3, 4] ]),
+            numpy.array([ 1.0, 2.0, 3.0, 4.0 ]))
+        self.assertEqual(bins.tolist(), [ [0, 0], [1, 2] ])
+        self.assertEqual(counts.tolist(), [ 3.0, 7.0 ])
+
+    def test_region(self):
+        contact_tiles.save_tiles(self.paths, self.bins, self.counts, RESOLUTION)
+        tiles = ContactTiles(self.paths)
+        self.assertIsInstance(tiles.offsets, numpy.memmap)
+        for (level, start, end) in [ (0, 0, 1000), (0, 200, 600), (1, 100, 300), (2, 0, 250) ]:
+            (bins, counts) = tiles.region(level, start, end)
+            expected = self.brute_force(level, start, end)
+            self.assertEqual(sorted(map(tuple, bins.tolist())), sorted(expected.keys()))
+            for ((x, y), count) in zip(bins.tolist(), counts.tolist()):
+                self.assertAlmostEqual(count, expected[(x, y)], places=4)
+
+    def test_tile(self):
+        contact_tiles.save_tiles(self.paths, self.bins, self.counts, RESOLUTION)
+        tiles = ContactTiles(self.paths)
+        (bins, _) = tiles.tile(0, 1, 2)
+        self.assertGreater(len(bins), 0)
+        self.assertTrue(numpy.all(bins // contact_tiles.TILE_SIZE == [ 1, 2 ]))
+        # there are no tiles below the diagonal
+        (bins, counts) = tiles.tile(0, 2, 1)
+        self.assertEqual(len(bins), 0)
+        self.assertEqual(len(counts), 0)
+
+    def test_empty(self):
+        levels = contact_tiles.save_tiles(self.paths, numpy.empty((0, 2)), numpy.empty(0), RESOLUTION)
+        self.assertEqual(len(levels), 1)
+        (bins, counts) = ContactTiles(self.paths).region(0, 0, 100)
+        self.assertEqual(len(counts), 0)
+
+if __name__ == '__main__':
+    unittest.main()
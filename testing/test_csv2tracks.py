@@ -2,8 +2,13 @@ import unittest
 import os
 import numpy
 import shutil
+import json
+import sys
 # import filecmp
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "build_stage", "scripts"))
+import csv2tracks
+
 class TestCSV2Tracks(unittest.TestCase):
     data_dir    = "testing/data/csv2tracks"
     gold_dir    = "testing/gold/csv2tracks"
@@ -50,3 +55,150 @@ class TestCSV2Tracks(unittest.TestCase):
         # a place we will find this data 
         data = numpy.load(os.path.join(TestCSV2Tracks.scratch_dir, TestCSV2Tracks.dest_dir, "trackname_06/track.npz"))
         numpy.testing.assert_array_equal(data["arr_1"], true_arr_6)
+
+    def test_chunked(self):
+        """Test that reading the csv files in chunks gives the same arrays
+        """
+        scratch_dir = TestCSV2Tracks.scratch_dir + "_chunked"
+        shutil.copytree(TestCSV2Tracks.data_dir, scratch_dir)
+        os.system("./build_stage/scripts/csv2tracks --workflow {}/workflow.yaml --destination {} --chunksize 3".format(
+                        scratch_dir, TestCSV2Tracks.dest_dir))
+
+        true_arr_2 = [0.2, 20.2, 0.2, 20.2, 0.2, 20.2, 0.2, 20.2, 0.2, 20.2]
+        data = numpy.load(os.path.join(scratch_dir, TestCSV2Tracks.dest_dir, "trackname_01/track.npz"))
+        numpy.testing.assert_array_equal(data["arr_1"], true_arr_2)
+        true_arr_6  = [0.6, 60.6, 0.6, 60.6, 0.6, 60.6, 0.6, 60.6, 0.6, 60.6]
+        data = numpy.load(os.path.join(scratch_dir, TestCSV2Tracks.dest_dir, "trackname_06/track.npz"))
+        numpy.testing.assert_array_equal(data["arr_1"], true_arr_6)
+
+    def test_minmax(self):
+        """Test the min and max of a track, and filling missing values with the min
+        """
+        scratch_dir = TestCSV2Tracks.scratch_dir + "_minmax"
+        os.makedirs(scratch_dir)
+        with open(os.path.join(scratch_dir, "input.csv"), "w") as f:
+            f.write("a,b\n2000000,3000000\n,2500000\n")
+        with open(os.path.join(scratch_dir, "workflow.yaml"), "w") as f:
+            f.write("tracks:\n  - name: big\n    file: input.csv\n    columns:\n      - name: a\n      - name: b\n")
+        os.system("./build_stage/scripts/csv2tracks --workflow {}/workflow.yaml --destination {}".format(
+                        scratch_dir, TestCSV2Tracks.dest_dir))
+
+        with open(os.path.join(scratch_dir, TestCSV2Tracks.dest_dir, "big/track.json")) as f:
+            metadata = json.load(f)
+        self.assertEqual(metadata["data"]["min"], 2000000)
+        self.assertEqual(metadata["data"]["max"], 3000000)
+        data = numpy.load(os.path.join(scratch_dir, TestCSV2Tracks.dest_dir, "big/track.npz"))
+        numpy.testing.assert_array_equal(data["arr_0"], [2000000, 2000000])
+
+    def test_jobs(self):
+        """Test writing tracks in parallel, uncompressed
+        """
+        scratch_dir = TestCSV2Tracks.scratch_dir + "_jobs"
+        shutil.copytree(TestCSV2Tracks.data_dir, scratch_dir)
+        os.system("./build_stage/scripts/csv2tracks --workflow {}/workflow.yaml --destination {} --jobs 3 --compression 0".format(
+                        scratch_dir, TestCSV2Tracks.dest_dir))
+
+        true_arr_2 = [0.2, 20.2, 0.2, 20.2, 0.2, 20.2, 0.2, 20.2, 0.2, 20.2]
+        true_arr_6  = [0.6, 60.6, 0.6, 60.6, 0.6, 60.6, 0.6, 60.6, 0.6, 60.6]
+        for (track, key, true_arr) in [ ("trackname_01", "arr_1", true_arr_2), ("trackname_04", "arr_0", true_arr_6),
+                                        ("trackname_05", "arr_1", true_arr_2), ("trackname_06", "arr_1", true_arr_6) ]:
+            data = numpy.load(os.path.join(scratch_dir, TestCSV2Tracks.dest_dir, track, "track.npz"))
+            numpy.testing.assert_array_equal(data[key], true_arr)
+
+        with open(os.path.join(scratch_dir, TestCSV2Tracks.dest_dir, "array_results.json")) as f:
+            self.assertEqual(len(json.load(f)["arrays"]), 6)
+
+    def test_formats(self):
+        """Test writing tracks uncompressed (as npy or raw files), and loading them memory-mapped
+        """
+        scratch_dir = TestCSV2Tracks.scratch_dir + "_formats"
+        shutil.copytree(TestCSV2Tracks.data_dir, scratch_dir)
+        true_arr_2 = [0.2, 20.2, 0.2, 20.2, 0.2, 20.2, 0.2, 20.2, 0.2, 20.2]
+        true_arr_6  = [0.6, 60.6, 0.6, 60.6, 0.6, 60.6, 0.6, 60.6, 0.6, 60.6]
+        for fmt in ("npz", "npy", "raw"):
+            dest_dir = TestCSV2Tracks.dest_dir + "_" + fmt
+            os.system("./build_stage/scripts/csv2tracks --workflow {}/workflow.yaml --destination {} --format {} --dtype float32 --chunksize 3".format(
+                            scratch_dir, dest_dir, fmt))
+
+            (metadata, arrays) = csv2tracks.load_track(os.path.join(scratch_dir, dest_dir, "trackname_06"))
+            self.assertEqual(metadata["name"], "trackname_06")
+            numpy.testing.assert_array_equal(arrays[1], numpy.float32(true_arr_6))
+            (metadata, arrays) = csv2tracks.load_track(os.path.join(scratch_dir, dest_dir, "trackname_05"))
+            numpy.testing.assert_array_equal(arrays[1], numpy.float32(true_arr_2))
+            if fmt != "npz":
+                self.assertEqual(metadata["data"]["format"], fmt)
+                self.assertEqual(len(metadata["data"]["values"]), 3)
+                self.assertIsInstance(arrays[0], numpy.memmap)
+
+        # the columns of a raw track are at the offsets in its metadata
+        (metadata, _) = csv2tracks.load_track(os.path.join(scratch_dir, TestCSV2Tracks.dest_dir + "_raw", "trackname_05"))
+        self.assertEqual([ v["offset"] for v in metadata["data"]["values"] ], [0, 40, 80])
+        self.assertEqual(metadata["data"]["dtype"], "<f4")
+
+        # writing a track in another format replaces the old files
+        track_dir = os.path.join(scratch_dir, TestCSV2Tracks.dest_dir + "_raw", "trackname_05")
+        os.system("./build_stage/scripts/csv2tracks --workflow {}/workflow.yaml --destination {} --format npy".format(
+                        scratch_dir, TestCSV2Tracks.dest_dir + "_raw"))
+        self.assertEqual(sorted(os.listdir(track_dir)), ["arr_0.npy", "arr_1.npy", "arr_2.npy", "track.json"])
+
+    def test_skip(self):
+        """Test leaving out tracks which are up to date
+        """
+        scratch_dir = TestCSV2Tracks.scratch_dir + "_skip"
+        shutil.copytree(TestCSV2Tracks.data_dir, scratch_dir)
+        import yaml
+        with open(os.path.join(scratch_dir, "workflow.yaml")) as f:
+            tracks = yaml.safe_load(f)["tracks"]
+        first = csv2tracks.make_tracks(tracks, scratch_dir, TestCSV2Tracks.dest_dir)
+
+        # skipped tracks aren't written again, but are still in the results
+        track_json = os.path.join(scratch_dir, TestCSV2Tracks.dest_dir, "trackname_01", "track.json")
+        os.utime(track_json, (0, 0))
+        skip = [ track["name"] for track in tracks if track["name"] != "trackname_04" ]
+        second = csv2tracks.make_tracks(tracks, scratch_dir, TestCSV2Tracks.dest_dir, skip=skip)
+        self.assertEqual(os.stat(track_json).st_mtime, 0)
+        self.assertEqual(second, first)
+        with open(os.path.join(scratch_dir, TestCSV2Tracks.dest_dir, "array_results.json")) as f:
+            self.assertEqual(len(json.load(f)["arrays"]), len(tracks))
+
+    def test_empty_column(self):
+        """Test that a column without a name is filled with the track's minimum
+        """
+        scratch_dir = TestCSV2Tracks.scratch_dir + "_empty"
+        shutil.copytree(TestCSV2Tracks.data_dir, scratch_dir)
+        tracks = [ { "name": "partial", "file": "input_01.csv", "columns": [ {}, { "name": "second" } ] } ]
+        for format in csv2tracks.TRACK_FORMATS:
+            csv2tracks.make_tracks(tracks, scratch_dir, TestCSV2Tracks.dest_dir + "_" + format, format=format)
+            (_, arrays) = csv2tracks.load_track(os.path.join(scratch_dir, TestCSV2Tracks.dest_dir + "_" + format, "partial"))
+            numpy.testing.assert_array_equal(arrays[1], [0.2, 20.2, 0.2, 20.2, 0.2, 20.2, 0.2, 20.2, 0.2, 20.2])
+            numpy.testing.assert_array_equal(arrays[0], [0.2] * 10)
+
+    def test_threads(self):
+        """Test making tracks for two destinations at once, from two threads
+        """
+        import threading
+        scratch_dir = TestCSV2Tracks.scratch_dir + "_threads"
+        os.makedirs(scratch_dir)
+        results = {}
+        def make(name, value):
+            basedir = os.path.join(scratch_dir, name)
+            os.makedirs(basedir)
+            with open(os.path.join(basedir, "input.csv"), "w") as f:
+                f.write("x\n" + "\n".join([ str(value) ] * 1000) + "\n")
+            tracks = [ { "name": "{}{}".format(name, i), "file": "input.csv", "columns": [ { "name": "x" } ] }
+                       for i in range(8) ]
+            results[name] = csv2tracks.make_tracks(tracks, basedir, "out", jobs=2, threads=True, compression=9)
+
+        threads = [ threading.Thread(target=make, args=(name, value)) for (name, value) in [ ("a", 1.0), ("b", 2.0) ] ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for (name, value) in [ ("a", 1.0), ("b", 2.0) ]:
+            self.assertEqual(len(results[name]), 8)
+            self.assertEqual(sorted(os.listdir(os.path.join(scratch_dir, name, "out"))),
+                             sorted([ "{}{}".format(name, i) for i in range(8) ] + [ "array_results.json" ]))
+            for i in range(8):
+                (_, arrays) = csv2tracks.load_track(os.path.join(scratch_dir, name, "out", "{}{}".format(name, i)))
+                numpy.testing.assert_array_equal(arrays[0], [ value ] * 1000)
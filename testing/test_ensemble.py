@@ -0,0 +1,88 @@
+import unittest
+import numpy
+
+from testing.helpers import ScratchTestCase
+import ensemble
+
+def rotation(seed):
+    # A random rotation matrix
+    (q, r) = numpy.linalg.qr( numpy.random.default_rng(seed).normal(size=(3, 3)) )
+    q *= numpy.sign(numpy.diag(r))
+    if numpy.linalg.det(q) < 0:
+        q[:, 0] *= -1
+    return q
+
+class TestEnsemble(ScratchTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.positions = numpy.cumsum( numpy.random.default_rng(0).normal(size=(60, 3)), axis=0 )
+
+    def test_kabsch(self):
+        reference = self.positions - self.positions.mean(axis=0)
+        moved = self.positions @ rotation(1) + [ 5.0, -2.0, 10.0 ]
+        numpy.testing.assert_allclose(ensemble.kabsch(moved, reference), reference, atol=1e-9)
+
+    def test_rigid_motion(self):
+        # Replicates which are the same structure, moved about, have no
+        # variance, and the same distances and contacts
+        summary = ensemble.Ensemble(self.scratch/'mean_distance.npy')
+        for seed in range(4):
+            summary.add(self.positions @ rotation(seed) + seed, { (1, 2), (2, 3) })
+        summary.save(self.scratch/'variance.npy', self.scratch/'contact_frequency.npz')
+
+        numpy.testing.assert_allclose(numpy.load(self.scratch/'variance.npy'), 0.0, atol=1e-9)
+        distances = numpy.linalg.norm(self.positions[:, None] - self.positions[None], axis=2)
+        numpy.testing.assert_allclose(numpy.load(self.scratch/'mean_distance.npy'), distances, rtol=1e-5, atol=1e-5)
+        (pairs, frequency) = ensemble.read_contact_frequency(self.scratch/'contact_frequency.npz')
+        self.assertEqual(pairs.tolist(), [ [1, 2], [2, 3] ])
+        self.assertEqual(frequency.tolist(), [ 1.0, 1.0 ])
+
+    def test_statistics(self):
+        # Compare to computing everything at once (with replicates that don't
+        # need aligning)
+        rng = numpy.random.default_rng(2)
+        replicates = [ self.positions + rng.normal(scale=0.1, size=self.positions.shape) for _ in range(5) ]
+        replicates = [ r - r.mean(axis=0) for r in replicates ]
+        contacts = [ { (1, 2), (3, 4) }, { (1, 2) }, { (1, 2), (5, 9) }, set(), { (3, 4) } ]
+
+        summary = ensemble.Ensemble(self.scratch/'mean_distance.npy')
+        for (r, c) in zip(replicates, contacts):
+            summary.add(r, c)
+        summary.save(self.scratch/'variance.npy', self.scratch/'contact_frequency.npz')
+
+        aligned = numpy.array([ ensemble.kabsch(r, replicates[0]) for r in replicates ])
+        expected = ((aligned - aligned.mean(axis=0))**2).sum(axis=2).mean(axis=0)
+        numpy.testing.assert_allclose(numpy.load(self.scratch/'variance.npy'), expected, rtol=1e-9)
+
+        distances = numpy.mean([ numpy.linalg.norm(r[:, None] - r[None], axis=2) for r in replicates ], axis=0)
+        numpy.testing.assert_allclose(numpy.load(self.scratch/'mean_distance.npy'), distances, rtol=1e-5, atol=1e-5)
+
+        (pairs, frequency) = ensemble.read_contact_frequency(self.scratch/'contact_frequency.npz')
+        self.assertEqual(pairs.tolist(), [ [1, 2], [3, 4], [5, 9] ])
+        numpy.testing.assert_allclose(frequency, [ 0.6, 0.4, 0.2 ])
+
+        totals = ensemble.bead_contacts(pairs, frequency, 10)
+        numpy.testing.assert_allclose(totals, [ 0.6, 0.6, 0.4, 0.4, 0.2, 0, 0, 0, 0.2, 0 ], rtol=1e-6)
+
+    def test_blocks(self):
+        # The distance matrix is the same when computed a few rows at a time
+        block = ensemble.DISTANCE_BLOCK
+        ensemble.DISTANCE_BLOCK = 7 * len(self.positions)
+        try:
+            summary = ensemble.Ensemble(self.scratch/'mean_distance.npy')
+            summary.add(self.positions, set())
+            summary.save(self.scratch/'variance.npy', self.scratch/'contact_frequency.npz')
+        finally:
+            ensemble.DISTANCE_BLOCK = block
+        distances = numpy.linalg.norm(self.positions[:, None] - self.positions[None], axis=2)
+        numpy.testing.assert_allclose(numpy.load(self.scratch/'mean_distance.npy'), distances, rtol=1e-5, atol=1e-5)
+
+    def test_mismatched(self):
+        summary = ensemble.Ensemble()
+        summary.add(self.positions, set())
+        with self.assertRaises(ValueError):
+            summary.add(self.positions[:10], set())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+import numpy
+
+from testing.helpers import ScratchTestCase
+import hic_contacts
+from hic_contacts import ContactRecord
+
+RESOLUTION = 200000
+
+class FakeHIC:
+    '''
+    Stands in for a Hi-C file opened with hic2structure
+    '''
+    def __init__(self, records):
+        self.records = records
+
+    def get_contact_records(self, settings):
+        return [ r for r in self.records if r.counts > settings['count_threshold'] ]
+
+class TestHicContacts(ScratchTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.records = [
+            ContactRecord(0, 0, 10.0),
+            ContactRecord(0, RESOLUTION, 0.5),
+            ContactRecord(RESOLUTION, 2 * RESOLUTION, 3.0),
+            ContactRecord(2 * RESOLUTION, 5 * RESOLUTION, 2.0),
+            ContactRecord(4 * RESOLUTION, 5 * RESOLUTION, 7.5),
+        ]
+
+    def test_extract(self):
+        # Every record is extracted, whatever the count_threshold
+        (bins, counts) = hic_contacts.extract_contacts(FakeHIC(self.records), { 'count_threshold': 2.0 })
+        self.assertEqual(bins.dtype, numpy.int32)
+        self.assertEqual(counts.dtype, numpy.float32)
+        self.assertEqual(len(bins), len(self.records))
+
+    def test_save_read(self):
+        (bins, counts) = hic_contacts.extract_contacts(FakeHIC(self.records), { 'count_threshold': 0 })
+        paths = hic_contacts.save_contacts(self.scratch, bins, counts)
+        self.assertEqual([ p.name for p in paths ], list(hic_contacts.CONTACT_FILES))
+
+        (read_bins, read_counts) = hic_contacts.read_contacts(self.scratch)
+        self.assertIsInstance(read_bins, numpy.memmap)
+        numpy.testing.assert_array_equal(read_bins, bins)
+        numpy.testing.assert_array_equal(read_counts, counts)
+        self.assertEqual(hic_contacts.arrays_to_records(read_bins, read_counts), self.records)
+
+    def test_threshold(self):
+        # The same records as filtering when reading the file
+        (bins, counts) = hic_contacts.extract_contacts(FakeHIC(self.records), { 'count_threshold': 0 })
+        for threshold in (0.0, 2.0, 2.5, 100.0):
+            filtered = hic_contacts.arrays_to_records( *hic_contacts.filter_contacts(bins, counts, threshold, RESOLUTION) )
+            expected = FakeHIC(self.records).get_contact_records({ 'count_threshold': threshold })
+            self.assertEqual(filtered, expected)
+
+    def test_blackout(self):
+        (bins, counts) = hic_contacts.extract_contacts(FakeHIC(self.records), { 'count_threshold': 0 })
+        # Segments are numbered from 1, so this is the first two bins, and the fifth
+        (_, kept) = hic_contacts.filter_contacts(bins, counts, 0.0, RESOLUTION, [ [1, 2], [5, 5] ])
+        self.assertEqual(kept.tolist(), [ 2.0 ])
+        # Ranges past the end are fine
+        (_, kept) = hic_contacts.filter_contacts(bins, counts, 0.0, RESOLUTION, [ [6, 100] ])
+        self.assertEqual(kept.tolist(), [ 10.0, 0.5, 3.0 ])
+        (_, kept) = hic_contacts.filter_contacts(bins, counts, 1.0, RESOLUTION, [])
+        self.assertEqual(kept.tolist(), [ 10.0, 3.0, 2.0, 7.5 ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import unittest
+import gzip
+import json
+
+from testing import helpers
+from testing.helpers import ScratchTestCase
+helpers.add_path(helpers.VIEW_SCRIPTS)
+import http_cache
+from http_cache import CachingMiddleware, accepted_encodings, etag_matches
+
+class App:
+    '''
+    WSGI app sending a JSON body for every path (or an error for /error),
+    counting the requests it handles
+    '''
+
+    def __init__(self):
+        self.calls = 0
+        self.closed = 0
+
+    def __call__(self, environ, start_response):
+        self.calls += 1
+        if environ['PATH_INFO'] == '/error':
+            start_response('404 Not Found', [ ('Content-Type', 'text/plain') ])
+            return [ b'not found' ]
+        start_response('200 OK', [ ('Content-Type', 'application/json') ])
+        return self.body(environ['PATH_INFO'].encode())
+
+    def body(self, path):
+        try:
+            yield b'['
+            for i in range(200):
+                yield str(i).encode() + b','
+            yield path + b']'
+        finally:
+            self.closed += 1
+
+class TestHTTPCache(ScratchTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.project = self.scratch
+        self.project.joinpath("project.json").write_text("{}")
+        self.app = App()
+        self.cached = CachingMiddleware(self.app, self.project)
+
+    def get(self, path, method='GET', **headers):
+        environ = { 'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': '' }
+        environ.update({ 'HTTP_' + name.upper(): value for (name, value) in headers.items() })
+        response = {}
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = dict(headers)
+        result = self.cached(environ, start_response)
+        body = b''.join(result)
+        if hasattr(result, 'close'):
+            result.close()
+        return ( response['status'], response['headers'], body )
+
+    def precompress(self, name, data):
+        '''
+        Write a file into the project with a gzip-compressed copy, as the
+        build does
+        '''
+        self.project.joinpath(name).write_bytes(data)
+        self.project.joinpath(name + '.gz').write_bytes(gzip.compress(data))
+        manifest = { name: { 'digest': 'abc', 'encodings': [ 'gzip' ], 'tried': [ 'gzip' ] } }
+        self.project.joinpath(http_cache.PRECOMPRESSED).write_text(json.dumps(manifest))
+
+    def test_etag(self):
+        (status, headers, body) = self.get('/data')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['Content-Type'], 'application/json')
+        self.assertEqual(headers['Content-Length'], str(len(body)))
+        self.assertEqual(headers['Cache-Control'], 'no-cache')
+        self.assertTrue(body.endswith(b'/data]'))
+        self.assertEqual(self.app.closed, 1)
+
+        # A client with the response is told it's not modified, without
+        # asking the app again
+        (status, _, body) = self.get('/data', if_none_match=headers['ETag'])
+        self.assertEqual(status, '304 Not Modified')
+        self.assertEqual(body, b'')
+        self.assertEqual(self.app.calls, 1)
+        self.assertEqual(self.get('/data', if_none_match='"other"')[0], '200 OK')
+        self.assertEqual(self.app.calls, 2)
+
+        # Errors aren't given ETags
+        (status, headers, _) = self.get('/error')
+        self.assertEqual(status, '404 Not Found')
+        self.assertNotIn('ETag', headers)
+
+    def test_rebuild(self):
+        '''ETags are forgotten when the project is rebuilt'''
+        (_, headers, _) = self.get('/data')
+        self.project.joinpath("project.json").write_text('{ "changed": true }')
+        self.assertEqual(self.get('/data', if_none_match=headers['ETag'])[0], '304 Not Modified')
+        self.assertEqual(self.app.calls, 2)
+
+    def test_streamed(self):
+        '''Responses over the size limit, and Range requests, are passed through'''
+        cached = CachingMiddleware(self.app, self.project, max_size=100)
+        self.cached = cached
+        (status, headers, body) = self.get('/data')
+        self.assertEqual(status, '200 OK')
+        self.assertNotIn('ETag', headers)
+        self.assertTrue(body.startswith(b'[0,1,') and body.endswith(b'/data]'))
+        self.assertEqual(self.app.closed, 1)
+
+        self.cached = CachingMiddleware(self.app, self.project)
+        (_, headers, _) = self.get('/data', range='bytes=0-9')
+        self.assertNotIn('ETag', headers)
+        (status, headers, _) = self.get('/data', method='HEAD')
+        self.assertEqual(status, '200 OK')
+        self.assertNotIn('ETag', headers)
+
+    def test_precompressed(self):
+        data = json.dumps(list(range(1000))).encode()
+        self.precompress('project.json', data)
+
+        (status, headers, body) = self.get('/project/project.json', accept_encoding='br, gzip;q=0.5')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Content-Type'], 'application/json')
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(headers['ETag'], '"abc-gzip"')
+        self.assertEqual(gzip.decompress(body), data)
+        self.assertEqual(headers['Content-Length'], str(len(body)))
+
+        (_, headers, body) = self.get('/project/project.json', accept_encoding='gzip;q=0')
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(headers['ETag'], '"abc"')
+        self.assertEqual(body, data)
+
+        self.assertEqual(self.get('/project/project.json', if_none_match='"abc"')[0], '304 Not Modified')
+        self.assertEqual(self.app.calls, 0)
+
+    def test_project_prefixes(self):
+        """Only URLs under the project's prefixes are served from its files
+        """
+        data = json.dumps(list(range(1000))).encode()
+        self.precompress('project.json', data)
+        for path in [ '/api/project.json', '/project/other/project.json', '/project.json' ]:
+            (_, headers, _) = self.get(path, accept_encoding='gzip')
+            self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(self.app.calls, 3)
+
+        cached = CachingMiddleware(self.app, self.project, project_prefixes=[ '/files', '/data/' ])
+        cached.update()
+        self.assertEqual(cached.find_file('/files/project.json'), 'project.json')
+        self.assertEqual(cached.find_file('/data/project.json'), 'project.json')
+        self.assertIsNone(cached.find_file('/project/project.json'))
+
+    def test_headers(self):
+        self.assertEqual(accepted_encodings("gzip, br;q=0.8, identity;q=0, *;q=0.1"), { 'gzip', 'br', '*' })
+        self.assertEqual(accepted_encodings(""), set())
+        self.assertTrue(etag_matches('"a", W/"b"', '"b"'))
+        self.assertTrue(etag_matches('*', '"b"'))
+        self.assertFalse(etag_matches('"a"', '"b"'))
+
+    def test_max_age(self):
+        cached = CachingMiddleware(self.app, self.project, max_age=600)
+        self.assertEqual(cached.cache_control(), 'public, max-age=600')
+
+if __name__ == '__main__':
+    unittest.main()
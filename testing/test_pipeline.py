@@ -0,0 +1,77 @@
+import unittest
+
+from testing.helpers import ScratchTestCase
+from pipeline import Stage, Pipeline
+
+class TestPipeline(ScratchTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.input = self.scratch.joinpath("input.txt")
+        self.input.write_text("a")
+        self.ran = []
+
+    def make_pipeline(self, fail=None):
+        def stage(name, after=[], inputs=[]):
+            def run(results):
+                self.ran.append(name)
+                if name == fail:
+                    raise RuntimeError(f"{name} failed")
+                return name + "".join( results[dep] for dep in after )
+            return Stage(name, run, after=after,
+                inputs=lambda results: inputs,
+                load=lambda: name
+            )
+        return Pipeline([
+            stage("d", after=["b", "c"]),
+            stage("b", after=["a"]),
+            stage("a", inputs=[self.input]),
+            stage("c")
+        ], self.scratch.joinpath("stages.json"))
+
+    def test_order(self):
+        pipeline = self.make_pipeline()
+        self.assertEqual(pipeline.order, ["a", "b", "c", "d"])
+        results = pipeline.run()
+        self.assertEqual(results["d"], "dbac")
+        self.assertLess(self.ran.index("a"), self.ran.index("b"))
+        self.assertEqual(self.ran[-1], "d")
+
+    def test_skip(self):
+        self.make_pipeline().run()
+        self.ran = []
+        self.make_pipeline().run()
+        self.assertEqual(self.ran, [])
+
+        # changing an input re-runs just the stage that reads it
+        self.input.write_text("b")
+        self.make_pipeline().run()
+        self.assertEqual(self.ran, ["a"])
+
+    def test_select(self):
+        pipeline = self.make_pipeline()
+        self.assertEqual(pipeline.select(until="b"), ["a", "b"])
+        self.assertEqual(pipeline.select(only=["d", "a"]), ["a", "d"])
+        with self.assertRaises(ValueError):
+            pipeline.select(only=["e"])
+
+        pipeline.run(only=["b"])
+        self.assertEqual(self.ran, ["b"])
+
+    def test_failure(self):
+        with self.assertRaises(RuntimeError):
+            self.make_pipeline(fail="b").run()
+        self.assertNotIn("d", self.ran)
+
+        # the stages that succeeded aren't run again
+        self.ran = []
+        self.make_pipeline().run()
+        self.assertNotIn("a", self.ran)
+        self.assertIn("b", self.ran)
+
+    def test_cycle(self):
+        with self.assertRaises(ValueError):
+            Pipeline([ Stage("a", None, after=["b"]), Stage("b", None, after=["a"]) ], self.scratch.joinpath("stages.json"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+import gzip
+import json
+
+from testing.helpers import ScratchTestCase
+import precompress
+from precompress import PRECOMPRESSED
+
+class TestPrecompress(ScratchTestCase):
+
+    def make_file(self, name, contents):
+        path = self.scratch.joinpath(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(contents)
+        return path
+
+    def test_precompress(self):
+        large = self.make_file("tracks/track.json", json.dumps(list(range(2000))))
+        small = self.make_file("project.json", "{}")
+
+        manifest = precompress.precompress(self.scratch, [ large, small, self.scratch.joinpath("missing.json") ])
+        self.assertEqual(set(manifest), { "tracks/track.json", "project.json" })
+        self.assertEqual(manifest["tracks/track.json"]["encodings"], precompress.available_encodings())
+        self.assertEqual(gzip.decompress(large.with_name("track.json.gz").read_bytes()), large.read_bytes())
+        # (small files aren't compressed)
+        self.assertEqual(manifest["project.json"]["encodings"], [])
+        self.assertFalse(self.scratch.joinpath("project.json.gz").exists())
+        self.assertEqual(json.loads(self.scratch.joinpath(PRECOMPRESSED).read_text()), manifest)
+
+    def test_unchanged(self):
+        '''Files are only compressed again if they've changed'''
+        path = self.make_file("track.json", json.dumps(list(range(2000))))
+        precompress.precompress(self.scratch, [ path ])
+        copy = self.scratch.joinpath("track.json.gz")
+        mtime = copy.stat().st_mtime_ns
+        precompress.precompress(self.scratch, [ path ])
+        self.assertEqual(copy.stat().st_mtime_ns, mtime)
+
+        self.make_file("track.json", json.dumps(list(range(3000))))
+        precompress.precompress(self.scratch, [ path ])
+        self.assertEqual(gzip.decompress(copy.read_bytes()), path.read_bytes())
+
+    def test_stale(self):
+        '''Copies of files which aren't listed any more are removed'''
+        first = self.make_file("a.json", json.dumps(list(range(2000))))
+        second = self.make_file("b.json", json.dumps(list(range(2000))))
+        precompress.precompress(self.scratch, [ first, second ])
+        manifest = precompress.precompress(self.scratch, [ second ])
+        self.assertEqual(set(manifest), { "b.json" })
+        self.assertFalse(self.scratch.joinpath("a.json.gz").exists())
+        self.assertTrue(self.scratch.joinpath("b.json.gz").exists())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+import os
+import pstats
+import threading
+
+from testing.helpers import ScratchTestCase
+from profiling import Profiler, format_size, summary
+
+class TestProfiling(ScratchTestCase):
+
+    def test_step(self):
+        profiler = Profiler()
+        with profiler.step("work"):
+            sum( i * i for i in range(100000) )
+        timing = profiler.report()["work"]
+        self.assertEqual(set(timing.keys()), { "wall", "cpu", "children_cpu", "process_peak_rss" })
+        self.assertGreater(timing["wall"], 0)
+        self.assertGreater(timing["process_peak_rss"], 0)
+        self.assertEqual(timing["children_cpu"], 0)
+
+    @unittest.skipUnless(os.path.exists("/proc/self/statm"), "needs /proc")
+    def test_sampled_rss(self):
+        profiler = Profiler(sample_rss=True)
+        with profiler.step("small"):
+            pass
+        with profiler.step("large"):
+            data = bytearray(256 * 1024**2)
+            data[::4096] = b'x' * len(data[::4096])
+            del data
+        timings = profiler.report()
+        self.assertNotIn("process_peak_rss", timings["large"])
+        self.assertGreater(timings["large"]["peak_rss"] - timings["small"]["peak_rss"], 128 * 1024**2)
+
+    def test_overlapping(self):
+        '''Child CPU time isn't attributed to steps running at the same time'''
+        profiler = Profiler()
+        started = threading.Barrier(2)
+        def run(name):
+            with profiler.step(name):
+                started.wait()
+                with profiler.step(name + "_inner"):
+                    pass
+        threads = [ threading.Thread(target=run, args=(name,)) for name in ("a", "b") ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with profiler.step("after"):
+            pass
+        timings = profiler.report()
+        self.assertIsNone(timings["a"]["children_cpu"])
+        self.assertIsNone(timings["b"]["children_cpu"])
+        self.assertIsNotNone(timings["after"]["children_cpu"])
+
+    def test_failed_step(self):
+        profiler = Profiler()
+        with self.assertRaises(ValueError):
+            with profiler.step("fails"):
+                raise ValueError()
+        self.assertIn("fails", profiler.report())
+
+    def test_cprofile(self):
+        profiler = Profiler(self.scratch, prefix="lammps_0")
+        with profiler.step("total", profile=True):
+            sorted(range(1000))
+        with profiler.step("other"):
+            pass
+        stats = self.scratch.joinpath("lammps_0.total.prof")
+        self.assertTrue(stats.is_file())
+        pstats.Stats(str(stats))
+        self.assertEqual(os.listdir(self.scratch), ["lammps_0.total.prof"])
+
+    def test_summary(self):
+        self.assertEqual(format_size(512), "512B")
+        self.assertEqual(format_size(3 * 1024**2), "3.0M")
+        timing = { "wall": 2.0, "cpu": 0.5, "children_cpu": 1.0, "peak_rss": 1024**3 }
+        overlapped = { "wall": 2.0, "cpu": 0.5, "children_cpu": None, "process_peak_rss": 1024**3 }
+        table = summary(
+            { "structures": { "status": "ran", "timing": timing }, "ensemble": { "status": "ran", "timing": overlapped },
+              "tracks": { "status": "skipped", "timing": None } },
+            [ ("0 Hours", { "lammps": timing, "total": timing }) ]
+        )
+        lines = table.splitlines()
+        self.assertEqual(lines[0].split(), [ "Stage", "Status", "Wall", "CPU", "Peak", "RSS" ])
+        self.assertEqual(lines[2].split(), [ "structures", "ran", "2.0s", "1.5s", "1.0G" ])
+        self.assertEqual(lines[3].split(), [ "ensemble", "ran", "2.0s", "0.5s", "1.0G", "(process)" ])
+        self.assertEqual(lines[4].split(), [ "tracks", "skipped" ])
+        self.assertIn("lammps", lines[6])
+
+if __name__ == '__main__':
+    unittest.main()
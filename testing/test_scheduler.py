@@ -0,0 +1,47 @@
+import unittest
+import os
+
+from testing import helpers
+from scheduler import available_cpus, worker_count, run_jobs, WorkerPool
+
+class TestScheduler(unittest.TestCase):
+
+    def test_worker_count(self):
+        cpus = available_cpus()
+        self.assertGreaterEqual(cpus, 1)
+        # never more workers than jobs, and always at least one
+        self.assertEqual(worker_count(1), 1)
+        self.assertEqual(worker_count(1000, threads_per_job=1000), 1)
+        self.assertEqual(worker_count(1000, max_workers=2), min(2, cpus))
+        self.assertLessEqual(worker_count(1000, threads_per_job=2), max(1, cpus // 2))
+        # not enough memory for more than one job at a time
+        self.assertEqual(worker_count(1000, memory_per_job=1024**5), 1)
+
+    def test_run_jobs(self):
+        jobs = [ (2, i) for i in range(8) ]
+        results = {}
+        for (i, result, elapsed) in run_jobs(pow, jobs, workers=3):
+            self.assertGreaterEqual(elapsed, 0)
+            results[i] = result
+        self.assertEqual(results, { i: 2**i for i in range(8) })
+
+    def test_worker_pool(self):
+        """Workers in a pool are kept running between batches of jobs
+        """
+        with WorkerPool(2) as pool:
+            first = { result for (_, result, _) in run_jobs(os.getpid, [ () ] * 8, workers=2, pool=pool) }
+            second = { result for (_, result, _) in pool.run(os.getpid, [ () ] * 8) }
+            self.assertNotIn(os.getpid(), first)
+            self.assertLessEqual(len(first | second), 2)
+            self.assertTrue(all( t >= 0 for t in pool.startup() ))
+            # exceptions in a job are raised
+            with self.assertRaises(ZeroDivisionError):
+                list(pool.run(divmod, [ (1, 0) ]))
+
+    def test_threads_per_job(self):
+        """Workers are given OMP_NUM_THREADS as they start, for the pool as a whole
+        """
+        with WorkerPool(1, preload=os.getcwd, threads_per_job=3) as pool:
+            self.assertEqual([ result for (_, result, _) in pool.run(os.getenv, [ ('OMP_NUM_THREADS',) ]) ], [ '3' ])
+            with self.assertRaises(ValueError):
+                list(run_jobs(os.getpid, [ () ], workers=1, threads_per_job=2, pool=pool))
@@ -0,0 +1,61 @@
+import unittest
+import numpy
+
+from testing import helpers
+helpers.add_path(helpers.SCRIPTS)
+import spatial
+from benchmark_contacts import contact_pairs_pairwise
+
+class TestSpatial(unittest.TestCase):
+    threshold = 3.3
+
+    def setUp(self):
+        rng = numpy.random.default_rng(0)
+        self.positions = numpy.cumsum(rng.normal(size=(500, 3)), axis=0)
+
+        # the contacts found by checking every pair of beads
+        pairs = contact_pairs_pairwise(self.positions, self.threshold) + 1
+        self.expected = set(zip(pairs[:, 0].tolist(), pairs[:, 1].tolist()))
+
+    def test_grid(self):
+        self.assertEqual(spatial.find_contacts(self.positions, self.threshold, 'grid'), self.expected)
+
+    def test_kdtree(self):
+        try:
+            import scipy
+        except ImportError:
+            self.skipTest("scipy is not installed")
+        self.assertEqual(spatial.find_contacts(self.positions, self.threshold, 'kdtree'), self.expected)
+
+    def test_hic2structure(self):
+        """The contacts agree with hic2structure's (pairwise) find_contacts
+        """
+        try:
+            from hic2structure.contacts import find_contacts
+        except ImportError:
+            self.skipTest("hic2structure is not installed")
+        self.assertEqual(find_contacts(self.positions, { 'distance_threshold': self.threshold }), self.expected)
+
+    def test_threshold(self):
+        """Beads exactly the threshold apart aren't in contact
+        """
+        positions = [ [ 0, 0, 0 ], [ 0, 0, 2 ], [ 0, 1.5, 0 ] ]
+        self.assertEqual(spatial.find_contacts(positions, 2.0, 'grid'), { (1, 3) })
+        try:
+            import scipy
+        except ImportError:
+            return
+        self.assertEqual(spatial.find_contacts(positions, 2.0, 'kdtree'), { (1, 3) })
+
+    def test_small(self):
+        self.assertEqual(spatial.find_contacts(self.positions[:1], self.threshold), set())
+        self.assertEqual(spatial.find_contacts([[0, 0, 0], [0, 0, 1]], self.threshold), { (1, 2) })
+
+    def test_jaccard(self):
+        self.assertEqual(spatial.jaccard(set(), set()), 1.0)
+        self.assertEqual(spatial.jaccard({ (1, 2) }, { (1, 2) }), 1.0)
+        self.assertEqual(spatial.jaccard({ (1, 2), (2, 3) }, { (2, 3), (3, 4) }), 1/3)
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            spatial.find_contacts(self.positions, self.threshold, 'octree')
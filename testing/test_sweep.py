@@ -0,0 +1,50 @@
+import unittest
+
+from testing.helpers import ScratchTestCase
+import sweep
+
+class TestSweep(ScratchTestCase):
+
+    def test_grid(self):
+        # Settings are always in the same order, whatever order they're given in
+        grid = sweep.sweep_grid({ 'bond_coeff': [ 55, 75 ], 'count_threshold': [ 1.0, 2.0, 3.0 ] })
+        self.assertEqual(len(grid), 6)
+        self.assertEqual(grid[0], { 'count_threshold': 1.0, 'bond_coeff': 55 })
+        self.assertEqual(grid[1], { 'count_threshold': 1.0, 'bond_coeff': 75 })
+        self.assertEqual(grid[-1], { 'count_threshold': 3.0, 'bond_coeff': 75 })
+        self.assertEqual(list(grid[0].keys()), [ 'count_threshold', 'bond_coeff' ])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            sweep.sweep_grid({ 'timesteps': [ 1000 ] })
+        with self.assertRaises(ValueError):
+            sweep.sweep_grid({ 'bond_coeff': [] })
+        with self.assertRaises(ValueError):
+            sweep.sweep_grid({ 'bond_coeff': 55 })
+
+    def test_names(self):
+        names = [ sweep.combination_name(c) for c in sweep.sweep_grid({ 'count_threshold': [ 1.0, 2.0 ], 'distance_threshold': [ 3.3 ] }) ]
+        self.assertEqual(names, [ "count_threshold=1.0_distance_threshold=3.3", "count_threshold=2.0_distance_threshold=3.3" ])
+
+    def test_simulation_settings(self):
+        settings = { 'chromosome': 'X', 'count_threshold': 2.0, 'bond_coeff': 55, 'distance_threshold': 3.3 }
+        self.assertEqual(sweep.simulation_settings(settings),
+            sweep.simulation_settings({ **settings, 'distance_threshold': 2.0 }))
+        self.assertNotEqual(sweep.simulation_settings(settings),
+            sweep.simulation_settings({ **settings, 'bond_coeff': 75 }))
+
+    def test_summary(self):
+        rows = [
+            { 'dataset': "0 Hours", 'chromosome': 'X', 'bond_coeff': 55, 'status': 'ok',
+              'input_contacts': 10, 'output_contacts': 8, 'shared_contacts': 6, 'agreement': 0.5, 'elapsed': 1.23456 },
+            { 'dataset': "0 Hours", 'chromosome': 'X', 'bond_coeff': 30, 'status': 'failed',
+              'error': "bad FENE bond\nat timestep 100" }
+        ]
+        sweep.write_summary(self.scratch/'summary.tsv', [ 'bond_coeff' ], rows)
+        lines = (self.scratch/'summary.tsv').read_text().splitlines()
+        self.assertEqual(lines[0].split("\t"), [ 'dataset', 'chromosome', 'bond_coeff', *sweep.SUMMARY_COLUMNS ])
+        self.assertEqual(lines[1].split("\t"), [ "0 Hours", 'X', '55', 'ok', '10', '8', '6', '0.5', '1.235', '' ])
+        self.assertEqual(lines[2].split("\t"), [ "0 Hours", 'X', '30', 'failed', '', '', '', '', '', "bad FENE bond at timestep 100" ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+
+import numpy as np
+
+from testing.helpers import ScratchTestCase
+from timeseries import align_structures, displacement, contact_changes, read_structure, read_contact_pairs
+
+def rotation(angle, axis):
+    # Rotation matrix about one of the axes
+    (c, s) = ( np.cos(angle), np.sin(angle) )
+    (i, j) = [ k for k in range(3) if k != axis ]
+    r = np.eye(3)
+    r[i, i], r[i, j], r[j, i], r[j, j] = c, -s, s, c
+    return r
+
+class TestTimeseries(ScratchTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.rng = np.random.default_rng(0)
+        self.structure = self.rng.normal(size=(50, 3)) * 10
+
+    def test_align(self):
+        """Rotated and translated copies of a structure are aligned back onto it
+        """
+        copies = [ self.structure ] + [
+            self.structure @ rotation(angle, axis) + self.rng.normal(size=3) * 100
+            for (angle, axis) in [ (0.5, 0), (2.0, 1), (-1.2, 2) ]
+        ]
+        aligned = align_structures(copies)
+        self.assertEqual(aligned.shape, (4, 50, 3))
+        for k in range(1, 4):
+            np.testing.assert_allclose(aligned[k], aligned[0], atol=1e-8)
+        np.testing.assert_allclose(displacement(aligned), np.zeros((3, 50)), atol=1e-8)
+
+    def test_reflection(self):
+        """A mirror image is only rotated, never reflected
+        """
+        aligned = align_structures([ self.structure, self.structure * [ -1, 1, 1 ] ])
+        self.assertGreater(np.abs(aligned[1] - aligned[0]).max(), 1.0)
+        # the best rotation still leaves the distances between beads alone
+        np.testing.assert_allclose(
+            np.linalg.norm(aligned[1] - aligned[1][0], axis=1),
+            np.linalg.norm(self.structure - self.structure[0], axis=1)
+        )
+
+    def test_displacement(self):
+        moved = self.structure.copy()
+        moved[7] += [ 0, 0, 0.25 ]
+        aligned = align_structures([ self.structure, self.structure, moved ])
+        distances = displacement(aligned)
+        self.assertEqual(distances.shape, (2, 50))
+        self.assertEqual(int(np.argmax(distances[1])), 7)
+        np.testing.assert_allclose(distances[0], np.zeros(50), atol=1e-8)
+
+    def test_different_lengths(self):
+        """Structures with fewer beads are aligned on the beads they have
+        """
+        aligned = align_structures([ self.structure, self.structure[:40] @ rotation(1.0, 2) ])
+        self.assertEqual(aligned.shape, (2, 50, 3))
+        self.assertTrue(np.isnan(aligned[1, 40:]).all())
+        np.testing.assert_allclose(aligned[1, :40], aligned[0, :40], atol=1e-8)
+
+    def test_contact_changes(self):
+        """Contacts gained and lost agree with comparing sets of pairs
+        """
+        beads = 30
+        before = self.rng.integers(1, beads + 1, size=(200, 2))
+        after = self.rng.integers(1, beads + 1, size=(200, 2))
+        # the same contact the other way round isn't a change
+        after = np.concatenate([ after, before[:50, ::-1] ])
+
+        pairs = lambda a: { tuple(sorted(p)) for p in a.tolist() }
+        counts = lambda contacts: np.bincount(
+            [ b - 1 for pair in contacts for b in pair ], minlength=beads )
+
+        (gained, lost) = contact_changes(before, after, beads)
+        np.testing.assert_array_equal(gained, counts(pairs(after) - pairs(before)))
+        np.testing.assert_array_equal(lost, counts(pairs(before) - pairs(after)))
+
+        (gained, lost) = contact_changes(np.empty((0, 2)), after, beads)
+        np.testing.assert_array_equal(gained, counts(pairs(after)))
+        np.testing.assert_array_equal(lost, np.zeros(beads))
+
+    def test_read(self):
+        pairs = np.array([ [ 1, 2 ], [ 3, 10 ] ])
+        np.savetxt(self.scratch.joinpath("set.tsv"), pairs, fmt='%d', delimiter='\t')
+        np.save(self.scratch.joinpath("set.npy"), pairs.astype(np.int32))
+        self.scratch.joinpath("empty.tsv").write_text("")
+        np.testing.assert_array_equal(read_contact_pairs(self.scratch.joinpath("set.tsv")), pairs)
+        np.testing.assert_array_equal(read_contact_pairs(self.scratch.joinpath("set.npy")), pairs)
+        self.assertEqual(read_contact_pairs(self.scratch.joinpath("empty.tsv")).shape, (0, 2))
+
+        self.assertIsNone(read_structure(self.scratch.joinpath("missing.csv")))
+        np.save(self.scratch.joinpath("structure.npy"), self.structure.astype(np.float32))
+        np.testing.assert_allclose(read_structure(self.scratch.joinpath("structure.npy")), self.structure, rtol=1e-6)
+        np.savetxt(self.scratch.joinpath("structure.csv"), self.structure, delimiter=',', header="x,y,z", comments='')
+        np.testing.assert_allclose(read_structure(self.scratch.joinpath("structure.csv")), self.structure)
+
+if __name__ == '__main__':
+    unittest.main()
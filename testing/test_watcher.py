@@ -0,0 +1,31 @@
+import unittest
+
+from testing.helpers import ScratchTestCase
+from watcher import snapshot, changed_files
+
+class TestWatcher(ScratchTestCase):
+
+    def test_snapshot(self):
+        """Changes to the directory are noticed, except in hidden and excluded directories
+        """
+        self.scratch.joinpath("project.yaml").write_text("{}")
+        self.scratch.joinpath("tracks.csv").write_text("a\n1\n")
+        exclude = [ self.scratch.joinpath("out").resolve() ]
+        before = snapshot(self.scratch, exclude)
+        self.assertEqual(sorted(before), [ "project.yaml", "tracks.csv" ])
+
+        self.scratch.joinpath("out").mkdir()
+        self.scratch.joinpath("out", "project.json").write_text("{}")
+        self.scratch.joinpath(".build").mkdir()
+        self.scratch.joinpath(".build", "project.json").write_text("{}")
+        self.scratch.joinpath(".hidden").write_text("")
+        self.assertEqual(snapshot(self.scratch, exclude), before)
+
+        self.scratch.joinpath("tracks.csv").write_text("a\n1\n2\n")
+        self.scratch.joinpath("project.yaml").unlink()
+        self.scratch.joinpath("new.hic").write_text("")
+        self.assertEqual(changed_files(before, snapshot(self.scratch, exclude)),
+            [ "new.hic", "project.yaml", "tracks.csv" ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import unittest
+import sys
+import json
+
+from testing.helpers import ScratchTestCase
+import workflow
+
+class TestWorkflow(ScratchTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.indir = self.scratch.joinpath("project")
+        self.indir.mkdir()
+        self.outdir = self.scratch.joinpath("out")
+
+    def write_project(self, name, project):
+        # JSON is also YAML
+        self.indir.joinpath(name).write_text(json.dumps(project))
+
+    def test_import(self):
+        """Importing the workflow doesn't start a build, or import hic2structure
+        """
+        self.assertNotIn('hic2structure', sys.modules)
+        self.assertTrue(hasattr(workflow, 'configure'))
+
+    def test_configure(self):
+        self.write_project("project.yaml", { 'project': { 'name': 'test', 'replicates': 2 } })
+        workflow.configure([ str(self.indir), str(self.outdir), '--keep-going', '--persistent-workers' ])
+
+        self.assertEqual(workflow.INPUT_FILE, self.indir.resolve().joinpath("project.yaml"))
+        self.assertEqual(workflow.OUTDIR, self.outdir.resolve())
+        self.assertEqual(workflow.CACHE_DIR, self.outdir.resolve().joinpath(".cache"))
+        self.assertTrue(workflow.ARGS.keep_going)
+        self.assertTrue(workflow.ARGS.persistent_workers)
+
+        # Defaults are filled in, and only non-default options are included
+        project = workflow.load_project_spec()
+        self.assertEqual(project['project']['resolution'], workflow.DEFAULT_PROJECT['project']['resolution'])
+        self.assertEqual(workflow.options_from_project(project), {
+            'trajectory': False, 'contact_method': 'pairwise', 'output_format': 'text', 'replicates': 2
+        })
+
+    def test_options(self):
+        """trajectory is false, 'all' or a number of frames, and replicates is a number
+        """
+        def options(**project):
+            return workflow.options_from_project({ 'project': { **workflow.DEFAULT_PROJECT['project'], **project } })
+
+        self.assertEqual(options(trajectory='all')['trajectory'], 'all')
+        self.assertEqual(options(trajectory=5)['trajectory'], 5)
+        self.assertIs(options()['trajectory'], False)
+        for trajectory in [ True, 0, -1, 2.5, 'some' ]:
+            with self.assertRaises(ValueError):
+                options(trajectory=trajectory)
+        for replicates in [ True, 0, 1.5 ]:
+            with self.assertRaises(ValueError):
+                options(replicates=replicates)
+
+    def test_chromosome_tracks(self):
+        """With several chromosomes, a track only has data for the structures of its own chromosome
+        """
+        track = { 'name': 't', 'file': 'a.csv', 'columns': [ { 'name': 'x' }, { 'name': 'y' } ] }
+        self.write_project("project.yaml", {
+            'project': { 'name': 'test', 'chromosome': [ '1', '2' ] },
+            'datasets': [ { 'name': 'a', 'data': 'a.hic' }, { 'name': 'b', 'data': 'b.hic' } ],
+            'tracks': [ { **track, 'chromosome': '2' } ]
+        })
+        workflow.configure([ str(self.indir), str(self.outdir) ])
+        project = workflow.load_project_spec()
+        jobs = workflow.make_jobs(project, self.outdir)
+
+        # a column for each job (dataset and chromosome), in the same order
+        [ tracks ] = workflow.project_tracks(project)
+        self.assertEqual(tracks['columns'], [ {}, { 'name': 'x' }, {}, { 'name': 'y' } ])
+        self.assertEqual([ workflow.dataset_for_job(project, jobs, j)['track_column'] for j in range(4) ], [ 0, 1, 2, 3 ])
+
+        project['tracks'] = [ track ]
+        with self.assertRaises(ValueError):
+            workflow.project_tracks(project)
+
+    def test_project_file(self):
+        with self.assertRaises(FileNotFoundError):
+            workflow.find_project_file(self.indir)
+        # workflow.yaml is preferred over project.yaml
+        self.write_project("project.yaml", {})
+        self.assertEqual(workflow.find_project_file(self.indir).name, "project.yaml")
+        self.write_project("workflow.yaml", {})
+        self.assertEqual(workflow.find_project_file(self.indir).name, "workflow.yaml")
+
+    def test_stages(self):
+        """The stages of the build are made for the build the workflow is configured for
+        """
+        import stages
+        self.write_project("project.yaml", { 'project': { 'name': 'test' }, 'datasets': [ { 'name': 'a', 'data': 'a.hic' } ] })
+        workflow.configure([ str(self.indir), str(self.outdir) ])
+        made = stages.make_stages(workflow, workflow.load_project_spec())
+        # (there are no tracks)
+        self.assertEqual(sorted( stage.name for stage in made ), sorted( set(workflow.STAGES) - { 'tracks' } ))
+        structures = next( stage for stage in made if stage.name == 'structures' )
+        self.assertEqual(structures.inputs({}), [ self.indir.resolve().joinpath("a.hic") ])
+
+    def test_track_stamp(self):
+        """A track's stamp changes with its definition and the contents of its files
+        """
+        self.write_project("project.yaml", { 'project': { 'name': 'test' } })
+        self.indir.joinpath("a.csv").write_text("x,y\n1,2\n")
+        self.indir.joinpath("b.csv").write_text("x,y\n3,4\n")
+        workflow.configure([ str(self.indir), str(self.outdir) ])
+        project = workflow.load_project_spec()
+        track = { 'name': 't', 'file': 'a.csv', 'columns': [ { 'name': 'x' } ] }
+
+        stamp = workflow.track_stamp(project, track)
+        self.assertEqual(workflow.track_stamp(project, track), stamp)
+        self.assertNotEqual(workflow.track_stamp(project, { **track, 'columns': [ { 'name': 'y' } ] }), stamp)
+        self.assertNotEqual(workflow.track_stamp(project, { **track, 'file': 'b.csv' }), stamp)
+        self.indir.joinpath("a.csv").write_text("x,y\n1,5\n")
+        self.assertNotEqual(workflow.track_stamp(project, track), stamp)
+
+    def test_replicate(self):
+        """A replicate simulated ahead of process_hic is only picked up for the same results
+        """
+        import numpy as np
+        positions = np.arange(12, dtype=float).reshape(4, 3)
+        contacts = { (1, 2), (2, 4) }
+        self.assertIsNone(workflow.read_replicate(self.scratch, 1, "key"))
+        workflow.save_replicate(self.scratch, 1, "key", positions, contacts)
+
+        (saved_positions, saved_contacts) = workflow.read_replicate(self.scratch, 1, "key")
+        np.testing.assert_array_equal(saved_positions, positions)
+        self.assertEqual(saved_contacts, contacts)
+        self.assertIsNone(workflow.read_replicate(self.scratch, 1, "other"))
+        self.assertIsNone(workflow.read_replicate(self.scratch, 2, "key"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,8 +2,30 @@
 # Gunicorn Config
 # Used in the Docker container
 #
+# The workers can be tuned with environment variables (see add_view_args in
+# 4DGBWorkflow):
+#   VIEW_WORKERS:       number of worker processes
+#   VIEW_THREADS:       number of threads each worker handles requests with
+#   VIEW_WORKER_CLASS:  Gunicorn worker class
+#   VIEW_PRELOAD:       load the app before forking the workers (0 to not)
+# and the caching of responses with VIEW_MAX_AGE, VIEW_ETAG_MAX_SIZE and
+# VIEW_PROJECT_PREFIXES (see scripts/http_cache.py)
+#
+
+import os
 
 bind = "0.0.0.0:8000"
-workers = 4
+workers = int(os.environ.get('VIEW_WORKERS', 4))
+threads = int(os.environ.get('VIEW_THREADS', 4))
+worker_class = os.environ.get('VIEW_WORKER_CLASS', 'gthread')
+# With the app preloaded, whatever it loads when it starts is loaded once and
+# shared by the workers. (But since it isn't reloaded on a SIGHUP, it's off
+# when the project is being rebuilt in watch mode.)
+preload_app = os.environ.get('VIEW_PRELOAD', '1').lower() not in ('0', 'false', 'no')
 daemon = True
-wsgi_app = 'gtkserver:app'
+# (so the server can be told to reload, see scripts/entrypoint.sh)
+pidfile = '/tmp/gunicorn.pid'
+# Responses are given ETags, and precompressed files are served, see
+# scripts/http_cache.py
+pythonpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts')
+wsgi_app = 'http_cache:make_app()'
@@ -41,4 +41,17 @@ echo -e "
     \e[1m#
     "
 
-sleep infinity
+# When the project is being built in watch mode ('build --watch'), the build
+# updates .reload in the project directory each time it finishes. Gunicorn
+# reloads its workers on a SIGHUP, so they serve the new project.
+RELOAD_FILE="/in/.reload"
+LAST_RELOAD="$(cat "$RELOAD_FILE" 2>/dev/null || true)"
+while true; do
+    sleep 1
+    RELOAD="$(cat "$RELOAD_FILE" 2>/dev/null || true)"
+    if [ "$RELOAD" != "$LAST_RELOAD" ]; then
+        LAST_RELOAD="$RELOAD"
+        echo -e "\e[1m> Project rebuilt, reloading\e[0m"
+        kill -HUP "$(cat /tmp/gunicorn.pid)" || true
+    fi
+done
@@ -0,0 +1,285 @@
+#
+# HTTP caching for the 4DGB Browser's server (gtkserver)
+#
+# The project being viewed is the output of a build, so nothing the server
+# sends for it changes until the project is rebuilt. This wraps the server's
+# WSGI app so that:
+#
+#   - output files which the build wrote compressed copies of (listed in its
+#     .precompressed.json, see build_stage/scripts/precompress.py) are
+#     streamed straight from disk, as the smallest copy the client accepts,
+#     with the digest recorded by the build as their ETag. Only URLs under
+#     the prefixes the app serves the project's files from (project_prefixes)
+#     are served this way, and only if the rest of the URL is exactly the
+#     path of one of those files in the project.
+#   - other responses of up to max_size bytes get a strong ETag (a hash of
+#     the body). The ETag of each URL is remembered until the project is
+#     rebuilt, so a client which already has a response is sent "304 Not
+#     Modified" without the app making it again. Larger responses are
+#     streamed as they are.
+#   - responses get a Cache-Control header, letting clients keep them for
+#     max_age seconds without asking again (by default, they always ask,
+#     since the same URL gets different data once the project is rebuilt)
+#
+# Nothing is compressed here, or kept in memory other than ETags. Requests
+# other than GET, and Range requests, are passed straight to the app.
+#
+
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+# Written by the build (see build_stage/scripts/precompress.py)
+PRECOMPRESSED = '.precompressed.json'
+ENCODING_SUFFIXES = { 'br': '.br', 'gzip': '.gz' }
+
+# Files in the project directory which a build rewrites whenever the project
+# changes
+VERSION_FILES = ('project.json', 'generated-project.db', PRECOMPRESSED, '.reload')
+
+# URL prefixes which the app serves the files in the project directory from
+DEFAULT_PROJECT_PREFIXES = ( '/project/', )
+
+# Largest response (in bytes) given an ETag
+DEFAULT_MAX_SIZE = 16 * 1024**2
+
+CHUNK_SIZE = 1024**2
+
+def build_version(project_home: Path) -> str:
+    '''
+    Get a string identifying the current build of the project in
+    project_home, from the modification times and sizes of its
+    VERSION_FILES
+    '''
+    stamp = hashlib.sha256()
+    for name in VERSION_FILES:
+        try:
+            stat = os.stat(Path(project_home, name))
+        except FileNotFoundError:
+            continue
+        stamp.update(f"{name}:{stat.st_mtime_ns}:{stat.st_size};".encode())
+    return stamp.hexdigest()[:16]
+
+def accepted_encodings(header: str) -> set[str]:
+    '''
+    Get the content-codings a client accepts, from its Accept-Encoding header
+    '''
+    accepted = set()
+    for item in header.split(','):
+        (coding, *params) = [ part.strip() for part in item.split(';') ]
+        q = 1.0
+        for param in params:
+            (key, _, value) = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding and q > 0:
+            accepted.add(coding.lower())
+    return accepted
+
+def etag_matches(header: str, etag: str) -> bool:
+    '''
+    Check whether an If-None-Match header matches an ETag (comparing them
+    weakly, as that header is)
+    '''
+    tags = [ tag.strip() for tag in header.split(',') ]
+    return any( tag == '*' or tag.removeprefix('W/') == etag for tag in tags )
+
+class Streamed:
+    '''
+    A response passed on from the app while it's being read: the chunks
+    already read from it, then the rest of its iterator. Closing this closes
+    the app's response.
+    '''
+
+    def __init__(self, chunks: list[bytes], rest: Iterable[bytes], response: Iterable[bytes]):
+        self.chunks = chunks
+        self.rest = rest
+        self.response = response
+
+    def __iter__(self):
+        yield from self.chunks
+        yield from self.rest
+
+    def close(self):
+        if hasattr(self.response, 'close'):
+            self.response.close()
+
+class CachingMiddleware:
+    '''
+    WSGI middleware adding ETags and serving precompressed files (see the
+    top of this file) for the project in project_home, which the app serves
+    under the URL prefixes in project_prefixes
+    '''
+
+    def __init__(self, app: Callable, project_home: Path, max_age: int = 0, max_size: int = DEFAULT_MAX_SIZE,
+            project_prefixes: Iterable[str] = DEFAULT_PROJECT_PREFIXES):
+        self.app = app
+        self.project_home = Path(project_home)
+        self.project_prefixes = [ '/' + prefix.strip('/') + '/' for prefix in project_prefixes ]
+        self.max_age = max_age
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.version = None
+        self.files = {}
+        self.etags = {}
+
+    def cache_control(self) -> str:
+        return f"public, max-age={self.max_age}" if self.max_age > 0 else "no-cache"
+
+    def update(self):
+        '''
+        Forget the ETags of responses, and re-read the list of precompressed
+        files, if the project has been rebuilt
+        '''
+        version = build_version(self.project_home)
+        with self.lock:
+            if version == self.version:
+                return
+            try:
+                with open(self.project_home.joinpath(PRECOMPRESSED), 'r') as f:
+                    files = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                files = {}
+            (self.version, self.files, self.etags) = (version, files, {})
+
+    def find_file(self, path: str) -> Optional[str]:
+        '''
+        Get the precompressed file (its path relative to the project) a
+        request is for, if its path is one of the project_prefixes followed
+        by the path of the file
+        '''
+        for prefix in self.project_prefixes:
+            if path.startswith(prefix) and path[len(prefix):] in self.files:
+                return path[len(prefix):]
+        return None
+
+    def __call__(self, environ: dict, start_response: Callable):
+        if environ.get('REQUEST_METHOD') != 'GET' or 'HTTP_RANGE' in environ:
+            return self.app(environ, start_response)
+
+        self.update()
+        name = self.find_file(environ.get('PATH_INFO', ''))
+        if name is not None:
+            return self.send_file(environ, start_response, name)
+
+        url = environ.get('PATH_INFO', '') + '?' + environ.get('QUERY_STRING', '')
+        etag = self.etags.get(url)
+        if etag is not None and etag_matches(environ.get('HTTP_IF_NONE_MATCH', ''), etag):
+            start_response('304 Not Modified', [ ('ETag', etag), ('Cache-Control', self.cache_control()) ])
+            return []
+        return self.send_response(environ, start_response, url)
+
+    def send_file(self, environ: dict, start_response: Callable, name: str):
+        '''
+        Send a precompressed file, as the first of its copies the client
+        accepts
+        '''
+        entry = self.files[name]
+        accepted = accepted_encodings(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        coding = next( ( e for e in ENCODING_SUFFIXES if e in accepted and e in entry['encodings'] ), None )
+        path = self.project_home.joinpath(name + (ENCODING_SUFFIXES[coding] if coding else ''))
+        etag = f'"{entry["digest"]}-{coding}"' if coding else f'"{entry["digest"]}"'
+        headers = [ ('ETag', etag), ('Cache-Control', self.cache_control()), ('Vary', 'Accept-Encoding') ]
+
+        if etag_matches(environ.get('HTTP_IF_NONE_MATCH', ''), etag):
+            start_response('304 Not Modified', headers)
+            return []
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            # (the project is being rebuilt)
+            return self.app(environ, start_response)
+
+        (content_type, _) = mimetypes.guess_type(name)
+        headers += [
+            ('Content-Type', content_type or 'application/octet-stream'),
+            ('Content-Length', str(os.fstat(f.fileno()).st_size))
+        ]
+        if coding:
+            headers.append( ('Content-Encoding', coding) )
+        start_response('200 OK', headers)
+        if 'wsgi.file_wrapper' in environ:
+            return environ['wsgi.file_wrapper'](f, CHUNK_SIZE)
+        return Streamed([], iter(lambda: f.read(CHUNK_SIZE), b''), f)
+
+    def send_response(self, environ: dict, start_response: Callable, url: str):
+        '''
+        Send the app's response to a request, with an ETag if it's no larger
+        than max_size
+        '''
+        response = {}
+        chunks = []
+        # (nothing is sent until it's known whether the response gets an
+        # ETag, so an error response simply replaces the one started before it)
+        def capture(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+            return chunks.append
+
+        result = self.app(environ, capture)
+        rest = iter(result)
+        size = sum( len(chunk) for chunk in chunks )
+        tagged = self.cacheable(response, self.max_size)
+        while tagged:
+            chunk = next(rest, None)
+            if chunk is None:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+            tagged = size <= self.max_size
+
+        if not tagged:
+            start_response(response['status'], response['headers'])
+            return Streamed(chunks, rest, result)
+
+        if hasattr(result, 'close'):
+            result.close()
+        body = b''.join(chunks)
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self.etags[url] = etag
+        headers = [ (name, value) for (name, value) in response['headers']
+            if name.lower() not in ('etag', 'cache-control', 'content-length') ]
+        headers += [ ('ETag', etag), ('Cache-Control', self.cache_control()), ('Content-Length', str(len(body))) ]
+        if etag_matches(environ.get('HTTP_IF_NONE_MATCH', ''), etag):
+            start_response('304 Not Modified', [ ('ETag', etag), ('Cache-Control', self.cache_control()) ])
+            return []
+        start_response(response['status'], headers)
+        return [ body ]
+
+    @staticmethod
+    def cacheable(response: dict, max_size: int) -> bool:
+        '''
+        Check whether a response (as started so far) can be given an ETag
+        '''
+        names = { name.lower(): value for (name, value) in response.get('headers', []) }
+        if not response.get('status', '').startswith('200'):
+            return False
+        if names.keys() & { 'set-cookie', 'content-encoding', 'vary', 'etag' }:
+            return False
+        if int(names.get('content-length', 0) or 0) > max_size:
+            return False
+        directives = { d.strip().lower() for d in names.get('cache-control', '').split(',') }
+        return not directives & { 'no-store', 'private' }
+
+def make_app() -> CachingMiddleware:
+    '''
+    Get the browser's server app (gtkserver, serving the project in
+    PROJECT_HOME), wrapped in CachingMiddleware. Responses may be kept by
+    clients for VIEW_MAX_AGE seconds, and responses up to VIEW_ETAG_MAX_SIZE
+    bytes are given ETags. Precompressed files are served for URLs under the
+    (comma-separated) prefixes in VIEW_PROJECT_PREFIXES.
+    '''
+    from gtkserver import app
+    prefixes = os.environ.get('VIEW_PROJECT_PREFIXES')
+    return CachingMiddleware(app, os.environ['PROJECT_HOME'],
+        max_age=int(os.environ.get('VIEW_MAX_AGE', 0)),
+        max_size=int(os.environ.get('VIEW_ETAG_MAX_SIZE', DEFAULT_MAX_SIZE)),
+        project_prefixes=prefixes.split(',') if prefixes else DEFAULT_PROJECT_PREFIXES
+    )